@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+语音识别后端
+转录窗口在独立的进程池中执行；本模块不依赖yt_dlp_api，子进程以spawn方式导入时没有副作用
+"""
+
+import os
+import wave
+
+# 每个工作进程中已加载的模型：(后端名称, 模型名称) -> 后端实例
+_loaded = {}
+
+class StubBackend:
+    """不做识别的占位后端：每个窗口返回一个描述时间范围的片段，用于测试转录流水线"""
+    name = 'stub'
+
+    def __init__(self, model):
+        self.model = model
+
+    @staticmethod
+    def available():
+        return True
+
+    def transcribe(self, path, language=None):
+        with wave.open(path, 'rb') as audio:
+            duration = audio.getnframes() / float(audio.getframerate())
+        return {
+            'language': language or 'en',
+            'segments': [{'start': 0.0, 'end': round(duration, 3), 'text': f'[stub {self.model} {duration:.1f}s]'}]
+        }
+
+class WhisperBackend:
+    """OpenAI Whisper后端（需要安装openai-whisper）"""
+    name = 'whisper'
+
+    def __init__(self, model):
+        import whisper
+        self.model = whisper.load_model(model)
+
+    @staticmethod
+    def available():
+        import importlib.util
+        return importlib.util.find_spec('whisper') is not None
+
+    def transcribe(self, path, language=None):
+        result = self.model.transcribe(path, language=language, fp16=False)
+        return {
+            'language': result.get('language'),
+            'segments': [
+                {'start': segment['start'], 'end': segment['end'], 'text': segment['text'].strip()}
+                for segment in result.get('segments', [])
+            ]
+        }
+
+class FasterWhisperBackend:
+    """faster-whisper后端（CTranslate2，CPU上比openai-whisper快且占用内存少）"""
+    name = 'faster-whisper'
+
+    def __init__(self, model):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model, device='cpu', compute_type='int8')
+
+    @staticmethod
+    def available():
+        import importlib.util
+        return importlib.util.find_spec('faster_whisper') is not None
+
+    def transcribe(self, path, language=None):
+        segments, info = self.model.transcribe(path, language=language)
+        return {
+            'language': info.language,
+            'segments': [
+                {'start': segment.start, 'end': segment.end, 'text': segment.text.strip()}
+                for segment in segments
+            ]
+        }
+
+ASR_BACKENDS = {
+    backend.name: backend for backend in (WhisperBackend, FasterWhisperBackend, StubBackend)
+}
+
+def get_backend(backend_name, model):
+    """返回当前进程中的后端实例，模型只在第一次使用时加载"""
+    key = (backend_name, model)
+    backend = _loaded.get(key)
+    if backend is None:
+        backend = _loaded[key] = ASR_BACKENDS[backend_name](model)
+    return backend
+
+def transcribe_window(backend_name, model, path, language, offset):
+    """在工作进程中转录一个音频窗口，返回时间戳已加上窗口偏移的片段"""
+    try:
+        result = get_backend(backend_name, model).transcribe(path, language)
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    for segment in result['segments']:
+        segment['start'] = round(segment['start'] + offset, 3)
+        segment['end'] = round(segment['end'] + offset, 3)
+    return result
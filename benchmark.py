@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+yt-dlp HTTP API 离线基准测试
+用注册到yt-dlp的假提取器和本地媒体源站代替YouTube，测量各接口的吞吐和延迟
+
+用法:
+    python benchmark.py                                  # 运行全部场景
+    python benchmark.py -s info -s stream -c 16 -n 400   # 指定场景、并发和请求数
+    python benchmark.py -o after.json --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = ('info', 'info-cold', 'stream-links', 'stream', 'stream-token', 'download', 'download-dedup')
+
+class FakeBenchIE(InfoExtractor):
+    """返回合成格式列表的假提取器，同时接管YouTube观看链接（/api/stream会拼接YouTube URL）"""
+    IE_NAME = 'FakeBench'
+    _VALID_URL = r'https?://(?:bench\.invalid|(?:www\.)?youtube\.com)/watch\?v=(?P<id>[\w-]+)'
+
+    # 由run_benchmark()设置
+    origin = None
+    media_size = 0
+    extract_latency = 0.0
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        if self.extract_latency:
+            time.sleep(self.extract_latency)
+        expire = int(time.time()) + 6 * 3600
+
+        def media_format(format_id, ext, vcodec, acodec, height=None, tbr=None):
+            return {
+                'format_id': format_id,
+                'url': f'{self.origin}/media/{video_id}/{format_id}?expire={expire}',
+                'ext': ext,
+                'vcodec': vcodec,
+                'acodec': acodec,
+                'height': height,
+                'width': height * 16 // 9 if height else None,
+                'tbr': tbr,
+                'filesize': self.media_size,
+                'protocol': 'http',
+                'http_headers': {'User-Agent': 'yt-dlp-api-benchmark'},
+            }
+
+        return {
+            'id': video_id,
+            'title': f'Benchmark video {video_id}',
+            'description': 'synthetic',
+            'uploader': 'benchmark',
+            'duration': 212,
+            'view_count': 1000,
+            'thumbnail': f'{self.origin}/thumb/{video_id}.jpg',
+            'formats': [
+                media_format('140', 'm4a', 'none', 'mp4a.40.2', tbr=128),
+                media_format('18', 'mp4', 'avc1.42001E', 'mp4a.40.2', height=360, tbr=500),
+                media_format('137', 'mp4', 'avc1.640028', 'none', height=1080, tbr=4000),
+            ],
+        }
+
+def register_fake_extractor():
+    """把假提取器放在提取器列表最前面，使其优先匹配"""
+    try:
+        from yt_dlp.globals import extractors
+    except ImportError:
+        # 旧版yt-dlp直接使用_ALL_CLASSES列表
+        from yt_dlp.extractor import extractors as extractor_module
+        extractor_module._ALL_CLASSES.insert(0, FakeBenchIE)
+        return
+    yt_dlp.extractor.import_extractors()
+    ordered = {'FakeBenchIE': FakeBenchIE}
+    ordered.update(extractors.value)
+    extractors.value = ordered
+
+class MediaOriginHandler(BaseHTTPRequestHandler):
+    """本地媒体源站：返回确定性的字节内容，支持Range请求和可配置延迟"""
+    protocol_version = 'HTTP/1.1'
+    media_size = 0
+    latency = 0.0
+    block = bytes(range(256)) * 256
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        start, end = 0, self.media_size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header:
+            match = re.match(r'bytes=(\d*)-(\d*)', range_header)
+            if match and match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), end) if match.group(2) else end
+            elif match and match.group(2):
+                start = max(self.media_size - int(match.group(2)), 0)
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{self.media_size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{self.media_size}')
+        self.end_headers()
+
+        remaining = end - start + 1
+        offset = start % len(self.block)
+        try:
+            while remaining > 0:
+                chunk = self.block[offset:offset + remaining]
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+                offset = 0
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def count_open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+def max_rss_mb():
+    # Linux上ru_maxrss单位为KB，macOS上为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Scenario:
+    """一个负载场景：准备阶段（不计时）和单次请求"""
+
+    def __init__(self, name, api_base, video_ids, media_size):
+        self.name = name
+        self.api_base = api_base
+        self.video_ids = video_ids
+        self.media_size = media_size
+        self.local = threading.local()
+        self.tokens = {}
+
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def video_url(self, index):
+        return f'https://bench.invalid/watch?v={self.video_ids[index % len(self.video_ids)]}'
+
+    def prepare(self):
+        if self.name == 'stream-token':
+            # 预先获取签名播放链接，计时部分只测令牌快速路径
+            for video_id in self.video_ids:
+                response = self.session().get(f'{self.api_base}/api/playable-links',
+                                              params={'url': f'https://bench.invalid/watch?v={video_id}'})
+                response.raise_for_status()
+                self.tokens[video_id] = find_playable_url(response.json())
+
+    def run_once(self, index):
+        """执行一次请求，返回是否成功"""
+        session = self.session()
+        video_id = self.video_ids[index % len(self.video_ids)]
+        if self.name == 'info':
+            response = session.get(f'{self.api_base}/api/info', params={'url': self.video_url(index)})
+            return response.status_code == 200
+        if self.name == 'info-cold':
+            response = session.get(f'{self.api_base}/api/info', params={'url': self.video_url(index), 'cache': 'bypass'})
+            return response.status_code == 200
+        if self.name == 'stream-links':
+            response = session.get(f'{self.api_base}/api/stream-links', params={'url': self.video_url(index)})
+            return response.status_code == 200
+        if self.name in ('stream', 'stream-token'):
+            if self.name == 'stream':
+                url = f'{self.api_base}/api/stream/{video_id}'
+            else:
+                url = self.tokens[video_id]
+            # 交替请求完整内容和Range分段，模拟播放器拖动
+            headers = {'Range': 'bytes=0-65535'} if index % 2 else {}
+            received = 0
+            with session.get(url, headers=headers, stream=True) as response:
+                for chunk in response.iter_content(64 * 1024):
+                    received += len(chunk)
+                expected = 65536 if headers else self.media_size
+                return response.status_code in (200, 206) and received == min(expected, self.media_size)
+        if self.name in ('download', 'download-dedup'):
+            # download每次请求不同视频，测量实际传输；download-dedup轮换少量视频，测量去重命中
+            url = f'https://bench.invalid/watch?v=dl{index:06d}' if self.name == 'download' else self.video_url(index)
+            response = session.post(f'{self.api_base}/api/download', json={
+                'url': url,
+                'options': {'format': '18', 'quiet': True, 'noprogress': True}
+            })
+            if response.status_code != 200:
+                return False
+            task_id = response.json()['task_id']
+            deadline = time.time() + 120
+            while time.time() < deadline:
+                status = session.get(f'{self.api_base}/api/status/{task_id}').json().get('status')
+                if status == 'completed':
+                    return True
+                if status in ('error', 'cancelled'):
+                    return False
+                time.sleep(0.02)
+            return False
+        raise ValueError(f'未知场景: {self.name}')
+
+def find_playable_url(data):
+    """在/api/playable-links响应中找到第一个带令牌的播放链接"""
+    if isinstance(data, dict):
+        url = data.get('playable_url')
+        if url and 'token=' in url:
+            return url
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        url = find_playable_url(value)
+        if url:
+            return url
+    return None
+
+def snapshot_resources(api, tmp_dir):
+    return {
+        'temp_entries': set(os.listdir(tmp_dir)),
+        'fds': count_open_fds(),
+    }
+
+def check_leaks(api, tmp_dir, before):
+    """场景结束后检查临时文件、cookies引用、未完成的下载文件和文件描述符"""
+    # 等待流式响应的清理回调和后台任务收尾
+    time.sleep(0.5)
+    cookie_stats = api.cookie_jars.stats()
+    part_files = [os.path.join(root, name) for root, _, files in os.walk(api.DOWNLOAD_DIR)
+                  for name in files if name.endswith(('.part', '.ytdl'))]
+    fds = count_open_fds()
+    return {
+        'new_temp_entries': sorted(set(os.listdir(tmp_dir)) - before['temp_entries']),
+        'cookie_refs_held': cookie_stats['refs'],
+        'cookie_files': cookie_stats['files'],
+        'partial_downloads': part_files,
+        'fd_delta': fds - before['fds'] if fds is not None and before['fds'] is not None else None,
+    }
+
+def run_scenario(api, scenario, requests_count, concurrency, tmp_dir):
+    print(f"▶ {scenario.name}: {requests_count} 次请求, 并发 {concurrency}")
+    scenario.prepare()
+    before = snapshot_resources(api, tmp_dir)
+    latencies = []
+    errors = []
+
+    def timed(index):
+        started = time.perf_counter()
+        try:
+            ok = scenario.run_once(index)
+        except Exception as e:
+            ok = False
+            errors.append(str(e))
+        else:
+            if not ok:
+                errors.append(None)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(requests_count)))
+    elapsed = time.perf_counter() - started
+
+    failures = len(errors)
+    result = {
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'errors': failures,
+        'duration_s': round(elapsed, 3),
+        'requests_per_s': round(requests_count / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p90': round(percentile(latencies, 0.90) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(max(latencies) * 1000, 2),
+        },
+        'max_rss_mb': max_rss_mb(),
+        'leaks': check_leaks(api, tmp_dir, before),
+    }
+    sample_errors = [e for e in errors if e][:3]
+    if sample_errors:
+        result['sample_errors'] = sample_errors
+    print(f"  {result['requests_per_s']} req/s  p50 {result['latency_ms']['p50']}ms  "
+          f"p99 {result['latency_ms']['p99']}ms  错误 {failures}  RSS峰值 {result['max_rss_mb']}MB")
+    return result
+
+def run_benchmark(args):
+    """启动源站和API服务，依次运行场景并返回结果"""
+    workdir = tempfile.mkdtemp(prefix='yt-dlp-api-bench-')
+    # 下载目录和任务数据库都放在临时工作目录中，不污染仓库
+    os.environ.setdefault('TASK_DB_PATH', os.path.join(workdir, 'tasks.db'))
+    os.environ.setdefault('DOWNLOAD_WORKERS', str(args.download_workers))
+    if not args.governor:
+        # 默认放开上游请求预算，测量的是服务本身而不是令牌桶速率，结果可以与之前的运行对比
+        for name in ('GOVERNOR_EXTRACT_RATE', 'GOVERNOR_EXTRACT_BURST', 'GOVERNOR_MEDIA_RATE', 'GOVERNOR_MEDIA_BURST'):
+            os.environ.setdefault(name, '1000000')
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    MediaOriginHandler.media_size = args.media_size
+    MediaOriginHandler.latency = args.origin_latency / 1000
+    origin = start_http_server(ThreadingHTTPServer(('127.0.0.1', 0), MediaOriginHandler))
+    origin.daemon_threads = True
+
+    FakeBenchIE.origin = f'http://127.0.0.1:{origin.server_port}'
+    FakeBenchIE.media_size = args.media_size
+    FakeBenchIE.extract_latency = args.extract_latency / 1000
+    register_fake_extractor()
+
+    import yt_dlp_api as api
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    start_http_server(server)
+    api_base = f'http://127.0.0.1:{server.server_port}'
+
+    video_ids = [f'bench{i:06d}' for i in range(args.videos)]
+    tmp_dir = tempfile.gettempdir()
+    results = {}
+    try:
+        for name in args.scenario or SCENARIOS:
+            scenario = Scenario(name, api_base, video_ids, args.media_size)
+            results[name] = run_scenario(api, scenario, args.requests, args.concurrency, tmp_dir)
+    finally:
+        server.shutdown()
+        origin.shutdown()
+        os.chdir(original_cwd)
+
+    return {
+        'revision': get_git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'yt_dlp': yt_dlp.version.__version__,
+        'params': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'videos': args.videos,
+            'media_size': args.media_size,
+            'origin_latency_ms': args.origin_latency,
+            'extract_latency_ms': args.extract_latency,
+            'governor': args.governor,
+        },
+        'scenarios': results,
+    }
+
+def print_comparison(baseline, current):
+    """对比两次结果，打印吞吐和延迟的变化"""
+    if baseline.get('params') != current.get('params'):
+        print("⚠️ 两次运行的参数不同，对比结果仅供参考")
+    print(f"\n对比 {baseline.get('revision')} -> {current.get('revision')}")
+    print(f"{'场景':<14}{'req/s':>22}{'p50 ms':>22}{'p99 ms':>22}")
+
+    def change(old, new):
+        if old is None or new is None:
+            return f'{new}'
+        delta = (new - old) / old * 100 if old else 0
+        return f'{old}→{new} ({delta:+.0f}%)'
+
+    for name, result in current['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            continue
+        print(f"{name:<14}{change(old['requests_per_s'], result['requests_per_s']):>22}"
+              f"{change(old['latency_ms']['p50'], result['latency_ms']['p50']):>22}"
+              f"{change(old['latency_ms']['p99'], result['latency_ms']['p99']):>22}")
+
+def main():
+    parser = argparse.ArgumentParser(description='yt-dlp HTTP API 离线基准测试')
+    parser.add_argument('-s', '--scenario', action='append', choices=SCENARIOS, help='要运行的场景，可重复指定（默认全部）')
+    parser.add_argument('-n', '--requests', type=int, default=200, help='每个场景的请求数')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='并发客户端数')
+    parser.add_argument('--videos', type=int, default=20, help='轮换使用的不同视频数量')
+    parser.add_argument('--media-size', type=int, default=2 * 1024 * 1024, help='源站媒体文件大小（字节）')
+    parser.add_argument('--origin-latency', type=float, default=0, help='源站首字节延迟（毫秒）')
+    parser.add_argument('--extract-latency', type=float, default=0, help='假提取器的提取延迟（毫秒）')
+    parser.add_argument('--download-workers', type=int, default=2, help='下载工作线程数')
+    parser.add_argument('--governor', action='store_true', help='保留默认的上游请求预算（GOVERNOR_*），测量限速后的表现')
+    parser.add_argument('-o', '--output', help='把结果写入JSON文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果对比')
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), result)
+
+    if any(scenario['errors'] for scenario in result['scenarios'].values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
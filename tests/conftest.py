@@ -0,0 +1,115 @@
+"""
+测试环境：复用benchmark.py的假提取器和本地媒体源站，无需联网
+源站返回一段真实的wav音频，转录流水线可以端到端运行
+"""
+
+import io
+import math
+import os
+import struct
+import sys
+import tempfile
+import time
+import wave
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='yt-dlp-api-test-')
+
+# 必须在导入yt_dlp_api之前设置：任务数据库和cookies池放在临时目录，
+# 放开上游请求预算，并固定播放令牌密钥，使子进程签发的令牌可以在测试进程中校验
+os.environ.setdefault('TASK_DB_PATH', os.path.join(WORKDIR, 'tasks.db'))
+os.environ.setdefault('COOKIE_POOL_DIR', os.path.join(WORKDIR, 'cookies'))
+os.environ.setdefault('STREAM_TOKEN_SECRET', 'test-secret')
+os.environ.setdefault('TRANSCRIBE_PROCESSES', '1')
+for name in ('GOVERNOR_EXTRACT_RATE', 'GOVERNOR_EXTRACT_BURST', 'GOVERNOR_MEDIA_RATE', 'GOVERNOR_MEDIA_BURST'):
+    os.environ.setdefault(name, '1000000')
+os.chdir(WORKDIR)
+sys.path.insert(0, REPO_DIR)
+
+import benchmark  # noqa: E402
+
+def make_wav(path, seconds=3, rate=16000):
+    """生成交替的音调和静音，静音检测和窗口切分都有数据可用"""
+    with wave.open(path, 'wb') as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(rate)
+        frames = bytearray()
+        for i in range(seconds * rate):
+            tone = (i // (rate // 2)) % 2 == 0
+            value = int(8000 * math.sin(2 * math.pi * 440 * i / rate)) if tone else 0
+            frames += struct.pack('<h', value)
+        audio.writeframes(bytes(frames))
+
+class RecordingOriginHandler(benchmark.MediaOriginHandler):
+    """记录请求路径和Range头的媒体源站"""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('Range')))
+        super().do_GET()
+
+@pytest.fixture(scope='session')
+def origin():
+    path = os.path.join(WORKDIR, 'origin.wav')
+    make_wav(path)
+    with open(path, 'rb') as f:
+        payload = f.read()
+    # 源站按block循环输出，block为整个文件时输出的就是文件本身
+    RecordingOriginHandler.block = payload
+    RecordingOriginHandler.media_size = len(payload)
+    server = benchmark.start_http_server(ThreadingHTTPServer(('127.0.0.1', 0), RecordingOriginHandler))
+    server.daemon_threads = True
+    benchmark.FakeBenchIE.origin = f'http://127.0.0.1:{server.server_port}'
+    benchmark.FakeBenchIE.media_size = len(payload)
+    benchmark.register_fake_extractor()
+    yield SimpleNamespace(url=benchmark.FakeBenchIE.origin, payload=payload, requests=RecordingOriginHandler.requests)
+    server.shutdown()
+
+@pytest.fixture(scope='session')
+def api(origin):
+    import yt_dlp_api
+    return yt_dlp_api
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
+
+def make_upstream(status, body=b'', headers=None):
+    """构造上游媒体响应"""
+    upstream = requests.Response()
+    upstream.status_code = status
+    upstream.headers.update(headers or {})
+    upstream.raw = io.BytesIO(body)
+    return upstream
+
+@pytest.fixture
+def upstream_requests(api, monkeypatch):
+    """替换共享会话的get，记录发往上游的请求并返回预设的响应"""
+    sent = []
+    responses = []
+
+    def get(url, **kwargs):
+        sent.append((url, kwargs))
+        return responses.pop(0)
+
+    monkeypatch.setattr(api.upstream_session, 'get', get)
+    return sent, responses
+
+@pytest.fixture
+def wait_for_task(client):
+    """轮询任务状态直到结束"""
+    def wait(task_id, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            task = client.get(f'/api/status/{task_id}').get_json()
+            if task['status'] in ('completed', 'error', 'cancelled'):
+                return task
+            time.sleep(0.05)
+        raise AssertionError(f'任务{task_id}在{timeout}秒内没有结束')
+    return wait
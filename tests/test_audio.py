@@ -0,0 +1,65 @@
+import pytest
+import yt_dlp
+
+def audio_format(format_id, acodec, abr):
+    return {'format_id': format_id, 'vcodec': 'none', 'acodec': acodec, 'abr': abr}
+
+INFO = {'formats': [
+    audio_format('251', 'opus', 160),
+    audio_format('140', 'mp4a.40.2', 128),
+    audio_format('250', 'opus', 70),
+    {'format_id': '18', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'abr': 96},
+]}
+
+def test_parse_accept_codecs(api):
+    assert api.parse_accept_codecs('m4a, opus,aac') == ['aac', 'opus']
+    assert api.parse_accept_codecs(None) == []
+    with pytest.raises(ValueError):
+        api.parse_accept_codecs(['wma'])
+
+def test_negotiate_follows_client_preference_then_bitrate(api):
+    fmt, codec = api.negotiate_audio_format(INFO, ['aac', 'opus'])
+    assert (fmt['format_id'], codec) == ('140', 'aac')
+    fmt, codec = api.negotiate_audio_format(INFO, ['opus'])
+    assert (fmt['format_id'], codec) == ('251', 'opus')
+    assert api.negotiate_audio_format(INFO, ['flac']) == (None, None)
+
+@pytest.fixture
+def enqueued(api, monkeypatch):
+    """记录放入下载队列的选项，不实际下载"""
+    calls = []
+
+    def enqueue(task_id, url, options, task_type, cookies_data=None, requested_priority=None):
+        calls.append(options)
+        return {'task_id': task_id, 'status': 'queued'}
+
+    monkeypatch.setattr(api, 'enqueue_download', enqueue)
+    return calls
+
+def test_audio_remuxes_matching_format(client, origin, enqueued):
+    body = {'url': 'https://bench.invalid/watch?v=audio0001', 'accept_codecs': ['opus', 'm4a']}
+    response = client.post('/api/audio', json=body)
+    assert response.status_code == 200
+    assert response.get_json()['audio'] == {'mode': 'remux', 'codec': 'aac', 'format_id': '140', 'abr': 128}
+    assert enqueued[0]['format'] == '140/bestaudio[acodec^=mp4a]'
+    assert enqueued[0]['postprocessors'] == [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'best'}]
+
+def test_audio_transcodes_when_nothing_matches(client, origin, enqueued):
+    body = {'url': 'https://bench.invalid/watch?v=audio0001', 'accept_codecs': ['flac', 'mp3']}
+    response = client.post('/api/audio', json=body)
+    assert response.get_json()['audio'] == {'mode': 'transcode', 'codec': 'flac'}
+    assert enqueued[0]['postprocessors'] == [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'flac'}]
+
+def test_audio_rejects_unknown_codec(client, enqueued):
+    response = client.post('/api/audio', json={'url': 'https://bench.invalid/watch?v=audio0001', 'accept_codecs': 'wma'})
+    assert response.status_code == 400
+    assert 'opus' in response.get_json()['codecs']
+    assert enqueued == []
+
+def test_ffmpeg_limiter_honours_cancellation(api):
+    limiter = api.FFmpegLimiter(1)
+    with limiter.slot():
+        assert limiter.stats()['running'] == 1
+        with pytest.raises(yt_dlp.utils.DownloadCancelled):
+            limiter.acquire(is_cancelled=lambda: True)
+    assert limiter.stats() == {'slots': 1, 'running': 0, 'waiting': 0, 'started': 1}
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+COOKIES = '# Netscape HTTP Cookie File\n.example.com\tTRUE\t/\tTRUE\t0\tSID\tabc\n'
+
+@pytest.fixture
+def jars(api):
+    jars = api.CookieJarManager(idle_ttl=0)
+    yield jars
+    jars.close()
+
+def test_same_content_shares_one_file(jars):
+    first = jars.acquire(COOKIES)
+    second = jars.acquire(COOKIES)
+    other = jars.acquire(COOKIES + '# other\n')
+    assert first == second != other
+    with open(first) as f:
+        assert f.read() == COOKIES
+    # 私有目录，其他用户不可读
+    assert os.stat(jars.directory).st_mode & 0o077 == 0
+    assert jars.stats() == {'files': 2, 'in_use': 2, 'refs': 3, 'writes': 2, 'evictions': 0}
+
+def test_idle_files_are_swept_after_release(api, jars, monkeypatch):
+    path = jars.acquire(COOKIES)
+    in_use = jars.acquire(COOKIES + '# in use\n')
+    jars.release(path)
+    jars.release('/not/managed.txt')
+    monkeypatch.setattr(api, 'COOKIE_JAR_SWEEP_INTERVAL', 0)
+    jars._last_sweep = 0
+    # 下一次acquire时清理引用归零且空闲超时的文件，仍被引用的文件保留
+    jars.acquire(COOKIES + '# trigger\n')
+    assert not os.path.exists(path)
+    assert os.path.exists(in_use)
+    assert jars.stats()['evictions'] == 1
+
+def test_ydl_opts_reference_shared_jar(api):
+    before = api.cookie_jars.stats()['refs']
+    opts = api.get_ydl_opts_with_cookies({}, {'cookies_text': COOKIES})
+    assert api.cookie_jars.owns(opts['cookiefile'])
+    assert api.cookie_jars.stats()['refs'] == before + 1
+    # 共享的cookies文件在YoutubeDL退出时不会被写回
+    ydl = api.create_ydl(opts)
+    assert ydl.params['cookiefile'] is None
+    assert opts['cookiefile']
+    api.release_cookiefile(opts)
+    assert api.cookie_jars.stats()['refs'] == before
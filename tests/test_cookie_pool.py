@@ -0,0 +1,32 @@
+COOKIE_LINE = '.youtube.com\tTRUE\t/\tTRUE\t0\t{name}\tvalue\n'
+
+def write_identity(directory, name):
+    (directory / f'{name}.txt').write_text('# Netscape HTTP Cookie File\n' + COOKIE_LINE.format(name=name))
+
+def test_rotates_least_recently_used(api, tmp_path):
+    write_identity(tmp_path, 'a')
+    write_identity(tmp_path, 'b')
+    (tmp_path / 'notes.txt').write_text('not cookies')
+    pool = api.CookiePool(str(tmp_path), 'default cookies')
+    names = [pool.checkout()[0] for _ in range(4)]
+    assert names == ['a', 'b', 'a', 'b']
+    assert pool.stats()['identities'] == 2
+
+def test_bot_wall_quarantines_identity(api, tmp_path):
+    write_identity(tmp_path, 'a')
+    write_identity(tmp_path, 'b')
+    pool = api.CookiePool(str(tmp_path), 'default cookies')
+    pool.report('a', 'bot_wall')
+    assert [pool.checkout()[0] for _ in range(2)] == ['b', 'b']
+    stats = {identity['name']: identity for identity in pool.stats()['pool']}
+    assert stats['a']['state'] == 'quarantined'
+    assert stats['a']['health'] < 1.0
+
+    # 所有身份都被隔离时不使用cookies
+    pool.report('b', 'bot_wall')
+    assert pool.checkout() is None
+    assert pool.stats()['anonymous'] == 1
+
+def test_empty_directory_uses_default_cookies(api, tmp_path):
+    pool = api.CookiePool(str(tmp_path), 'default cookies')
+    assert pool.checkout() == ('default', 'default cookies')
@@ -0,0 +1,68 @@
+import os
+
+MANIFEST = 'artifact.json'
+
+def add_artifact(store, artifact_id, size, last_access):
+    os.makedirs(store.artifact_dir(artifact_id))
+    filename = os.path.join(store.artifact_dir(artifact_id), 'video.mp4')
+    with open(filename, 'wb') as f:
+        f.write(b'\0' * size)
+    store.complete(artifact_id, filename)
+    os.utime(os.path.join(store.artifact_dir(artifact_id), MANIFEST), (last_access, last_access))
+
+def make_store(api, directory, quota_bytes):
+    # 构造时不设上限，不启动后台清理线程，由测试直接调用ensure_space
+    store = api.DownloadStore(str(directory), 0)
+    store.quota_bytes = quota_bytes
+    return store
+
+def test_evicts_least_recently_used_down_to_low_watermark(api, tmp_path):
+    store = make_store(api, tmp_path, 35000)
+    for index, artifact_id in enumerate(['a', 'b', 'c', 'd']):
+        add_artifact(store, artifact_id, 10000, 1000 + index)
+    # 最早访问的a被重新访问后变成最新
+    os.utime(os.path.join(store.artifact_dir('a'), MANIFEST), (2000, 2000))
+
+    # 访问时间在外部修改，完整扫描后才计入
+    assert store.ensure_space(rescan=True) is True
+    assert sorted(os.listdir(tmp_path)) == ['a', 'd']
+    assert store.lookup('b') is None
+    assert store.lookup('a')['size'] == 10000
+    usage = store.usage()
+    assert usage['artifacts'] == 2
+    assert usage['evictions'] == 2
+    assert usage['used_bytes'] <= 35000 * api.DOWNLOAD_LOW_WATERMARK
+
+def test_inflight_artifacts_are_pinned(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(api.task_store, 'update', lambda task_id, **fields: None)
+    store = make_store(api, tmp_path, 25000)
+    add_artifact(store, 'old', 10000, 1000)
+    add_artifact(store, 'new', 10000, 2000)
+    assert store.claim('old-download', 'task-1')[0] == 'download'
+    os.makedirs(store.artifact_dir('old-download'))
+    with open(os.path.join(store.artifact_dir('old-download'), 'part'), 'wb') as f:
+        f.write(b'\0' * 10000)
+    os.utime(store.artifact_dir('old-download'), (500, 500))
+
+    store.ensure_space(rescan=True)
+    assert os.path.isdir(store.artifact_dir('old-download'))
+    assert not os.path.exists(store.artifact_dir('old'))
+
+def test_usage_counter_without_rescan(api, tmp_path):
+    store = make_store(api, tmp_path, 35000)
+    for index, artifact_id in enumerate(['a', 'b', 'c']):
+        add_artifact(store, artifact_id, 10000, 1000 + index)
+    usage = store.usage()
+    assert usage['artifacts'] == 3
+    assert 30000 < usage['used_bytes'] < 31000
+    # 完成的产物按完成顺序计入最近访问时间，超过高水位时淘汰最早完成的
+    add_artifact(store, 'd', 10000, 1003)
+    assert store.ensure_space() is True
+    assert sorted(os.listdir(tmp_path)) == ['c', 'd']
+    assert store.usage()['scans'] == 0
+
+def test_rejects_when_nothing_can_be_evicted(api, tmp_path):
+    store = make_store(api, tmp_path, 10000)
+    assert store.ensure_space(20000) is False
+    assert store.usage()['rejections'] == 1
+    assert store.ensure_space(5000) is True
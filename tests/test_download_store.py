@@ -0,0 +1,48 @@
+import os
+
+def test_artifact_id_depends_on_output_options(api):
+    url = 'https://bench.invalid/watch?v=store0001'
+    base = api.get_artifact_id(url, {'format': '18'})
+    assert api.get_artifact_id(url, {'format': '18', 'quiet': True, 'retries': 3}) == base
+    assert api.get_artifact_id(url, {'format': '22'}) != base
+    assert api.get_artifact_id(url, {'format': '18', 'merge_output_format': 'mkv'}) != base
+    assert api.get_artifact_id('https://bench.invalid/watch?v=store0002', {'format': '18'}) != base
+
+def test_artifact_id_uses_resolved_format(api, origin):
+    url = 'https://bench.invalid/watch?v=store0004'
+    info, _ = api.extract_info_cached(url)
+    assert [f['format_id'] for f in api.select_formats(info, 'bv*+ba')] == ['137', '140']
+    explicit = api.get_artifact_id(url, {'format': '137+140'}, info)
+    assert api.get_artifact_id(url, {'format': 'bv*+ba'}, info) == explicit
+    assert api.get_artifact_id(url, {'format': 'best'}, info) == api.get_artifact_id(url, {'format': '18'}, info)
+    assert api.get_artifact_id(url, {'format': 'best'}, info) != explicit
+    # 无法解析的表达式退回请求的格式
+    assert api.get_artifact_id(url, {'format': 'bogus['}, info) == api.get_artifact_id(url, {'format': 'bogus['})
+
+def test_repeated_download_is_deduplicated(api, client, origin, wait_for_task):
+    body = {'url': 'https://bench.invalid/watch?v=store0003', 'options': {'format': '18'}}
+    first_id = client.post('/api/download', json=body).get_json()['task_id']
+    first = wait_for_task(first_id)
+    assert first['status'] == 'completed', first.get('error')
+    requests_before = len(origin.requests)
+
+    second = client.post('/api/download', json=body).get_json()
+    assert second['status'] == 'completed'
+    assert second['deduplicated'] is True
+    assert second['filename'] == first['filename']
+    assert len(origin.requests) == requests_before
+
+    artifact_id = api.get_artifact_id(body['url'], body['options'])
+    assert os.path.samefile(os.path.dirname(first['filename']), api.download_store.artifact_dir(artifact_id))
+    with open(first['filename'], 'rb') as f:
+        assert f.read() == origin.payload
+
+def test_equivalent_format_selector_is_deduplicated(client, origin, wait_for_task):
+    url = 'https://bench.invalid/watch?v=store0005'
+    first = client.post('/api/download', json={'url': url, 'options': {'format': '18'}}).get_json()
+    first = wait_for_task(first['task_id'])
+    assert first['status'] == 'completed', first.get('error')
+    # best在假视频中选中的也是18
+    second = client.post('/api/download', json={'url': url, 'options': {'format': 'best'}}).get_json()
+    assert second['deduplicated'] is True
+    assert second['filename'] == first['filename']
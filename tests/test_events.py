@@ -0,0 +1,99 @@
+import threading
+import time
+import uuid
+
+def create_task(api, status='queued'):
+    task_id = str(uuid.uuid4())
+    api.task_store.create(task_id, {'status': status, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    return task_id
+
+def read_events(response):
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        if block.startswith('event: task'):
+            events.append(block.split('data: ', 1)[1])
+    return events
+
+def test_task_events_until_finished(api, client):
+    task_id = create_task(api)
+
+    def progress():
+        # 等待SSE连接订阅后再更新任务
+        while not api.task_events.has_subscribers():
+            time.sleep(0.01)
+        api.task_store.update(task_id, status='downloading', progress={'percent': 50.0})
+        api.task_store.update(task_id, status='completed')
+
+    thread = threading.Thread(target=progress)
+    thread.start()
+    response = client.get(f'/api/status/{task_id}/events')
+    thread.join()
+    assert response.content_type == 'text/event-stream'
+    events = read_events(response)
+    assert '"status": "completed"' in events[-1]
+    # 连接随任务结束关闭，订阅被移除
+    assert not api.task_events.has_subscribers()
+    response.close()
+    assert api.stream_slots.active == 0
+
+def test_finished_task_sends_one_event(api, client):
+    task_id = create_task(api, 'completed')
+    response = client.get(f'/api/status/{task_id}/events')
+    events = read_events(response)
+    response.close()
+    assert len(events) == 1
+    assert f'"task_id": "{task_id}"' in events[0]
+    assert client.get('/api/status/missing/events').status_code == 404
+
+def test_subscription_keeps_latest_state(api):
+    subscription = api.TaskSubscription({'a'})
+    assert subscription.wants('a') and not subscription.wants('b')
+    for percent in range(10):
+        subscription.push('a', {'percent': percent})
+    assert subscription.drain(0) == {'a': {'percent': 9}}
+    assert subscription.drain(0) == {}
+
+def test_progress_throttle_coalesces_hooks(api, monkeypatch):
+    task_id = create_task(api)
+    published = []
+    subscription = api.task_events.subscribe({task_id})
+    try:
+        monkeypatch.setattr(api, 'PROGRESS_MIN_INTERVAL', 60)
+        throttle = api.ProgressThrottle(task_id)
+        for downloaded in range(0, 1001, 1):
+            throttle({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': 1000})
+            published.extend(subscription.drain(0).values())
+        throttle({'status': 'finished', 'filename': 'a.mp4'})
+        published.extend(subscription.drain(0).values())
+    finally:
+        api.task_events.unsubscribe(subscription)
+    # 每变化PROGRESS_MIN_PERCENT个百分点才发布一次，finished总是发布
+    assert len(published) <= 100 / api.PROGRESS_MIN_PERCENT + 2
+    assert published[-1]['filename'] == 'a.mp4'
+
+def test_stream_limit_rejects_extra_connections(api, client, monkeypatch):
+    monkeypatch.setattr(api.stream_slots, 'limit', 1)
+    # 没有初始状态时第一块数据是心跳
+    monkeypatch.setattr(api, 'SSE_HEARTBEAT_INTERVAL', 1)
+    first = client.get('/api/events', buffered=False)
+    assert first.status_code == 200
+    rejected = client.get('/api/events', buffered=False)
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == '1'
+    # 关闭连接后名额归还
+    first.close()
+    assert api.stream_slots.active == 0
+    second = client.get('/api/events', buffered=False)
+    assert second.status_code == 200
+    second.close()
+
+def test_unknown_task_releases_slot(api, client):
+    assert client.get('/api/status/missing/events').status_code == 404
+    assert api.stream_slots.active == 0
+
+def test_stream_closes_after_max_duration(api, client, monkeypatch):
+    monkeypatch.setattr(api, 'SSE_MAX_DURATION', 0)
+    response = client.get('/api/events')
+    assert response.get_data(as_text=True).startswith('event: timeout\n')
+    response.close()
+    assert api.stream_slots.active == 0
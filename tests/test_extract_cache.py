@@ -0,0 +1,47 @@
+import time
+
+def media_info(*expires):
+    return {'formats': [{'url': f'https://rr1.googlevideo.com/videoplayback?id=1&expire={expire}&ip=1'}
+                        for expire in expires]}
+
+def test_ttl_follows_earliest_expire(api):
+    now = time.time()
+    ttl = api.compute_info_ttl(media_info(int(now) + 7200, int(now) + 3600))
+    assert abs(ttl - (3600 - api.EXTRACT_CACHE_EXPIRE_MARGIN)) < 5
+    # manifest链接把expire放在路径里
+    manifest = {'url': f'https://manifest.googlevideo.com/api/manifest/hls/expire/{int(now) + 1800}/ei/x'}
+    assert abs(api.compute_info_ttl(manifest) - (1800 - api.EXTRACT_CACHE_EXPIRE_MARGIN)) < 5
+    assert api.compute_info_ttl({'formats': [{'url': 'https://example.com/v.mp4'}]}) == api.EXTRACT_CACHE_DEFAULT_TTL
+
+def test_expired_and_nearly_expired_entries_are_not_served(api):
+    cache = api.ExtractionCache(8)
+    # 剩余时间不足安全余量的结果不缓存
+    cache.put('soon', media_info(int(time.time()) + api.EXTRACT_CACHE_EXPIRE_MARGIN - 10))
+    assert cache.get('soon') is None
+
+    info = media_info(int(time.time()) + 3600)
+    cache.put('video', info)
+    assert cache.get('video') is info
+    cache._entries['video'][0] = time.time() - 1
+    assert cache.get('video') is None
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['expirations'] == 1
+    assert stats['entries'] == 0
+
+def test_lru_eviction(api):
+    cache = api.ExtractionCache(2)
+    info = media_info(int(time.time()) + 3600)
+    cache.put('a', info)
+    cache.put('b', info)
+    cache.get('a')
+    cache.put('c', info)
+    assert cache.get('b') is None
+    assert cache.get('a') is info and cache.get('c') is info
+    assert cache.stats()['evictions'] == 1
+
+def test_cookie_identities_do_not_share_entries(api):
+    default = api.get_cookie_fingerprint(None)
+    assert api.get_cookie_fingerprint({'cookies_text': 'a'}) != default
+    assert api.get_cookie_fingerprint({'cookies_text': 'a'}) != api.get_cookie_fingerprint({'cookies_text': 'b'})
+    assert api.get_cookie_fingerprint({'cookies_text': 'a'}) == api.get_cookie_fingerprint({'cookies_text': 'a'})
@@ -0,0 +1,61 @@
+import pytest
+
+@pytest.fixture
+def completed_task(client, origin, wait_for_task):
+    # 相同的下载请求由产物存储去重，每个测试只有第一次真正下载
+    body = {'url': 'https://bench.invalid/watch?v=files0001', 'options': {'format': '18'}}
+    task_id = client.post('/api/download', json=body).get_json()['task_id']
+    task = wait_for_task(task_id)
+    assert task['status'] == 'completed', task.get('error')
+    return task_id
+
+def test_full_download_with_validators(client, origin, completed_task):
+    response = client.get(f'/api/files/{completed_task}')
+    assert response.status_code == 200
+    assert response.data == origin.payload
+    assert response.headers['Content-Length'] == str(len(origin.payload))
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag'].startswith('"')
+    assert response.headers['Last-Modified']
+    assert response.headers['Content-Disposition'].startswith('attachment;')
+    inline = client.get(f'/api/files/{completed_task}?disposition=inline')
+    assert inline.headers['Content-Disposition'].startswith('inline;')
+
+def test_range_requests(client, origin, completed_task):
+    size = len(origin.payload)
+    response = client.get(f'/api/files/{completed_task}', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{size}'
+    assert response.data == origin.payload[100:200]
+
+    suffix = client.get(f'/api/files/{completed_task}', headers={'Range': 'bytes=-50'})
+    assert suffix.status_code == 206
+    assert suffix.data == origin.payload[-50:]
+
+    unsatisfiable = client.get(f'/api/files/{completed_task}', headers={'Range': f'bytes={size}-'})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers['Content-Range'] == f'bytes */{size}'
+
+    # 多区间请求返回完整文件
+    multi = client.get(f'/api/files/{completed_task}', headers={'Range': 'bytes=0-9,20-29'})
+    assert multi.status_code == 200
+    assert multi.data == origin.payload
+
+def test_conditional_requests(client, origin, completed_task):
+    first = client.get(f'/api/files/{completed_task}')
+    etag = first.headers['ETag']
+    assert client.get(f'/api/files/{completed_task}', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f'/api/files/{completed_task}',
+                      headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+    assert client.get(f'/api/files/{completed_task}', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+    # If-Range匹配时返回区间，不匹配时返回完整文件
+    matched = client.get(f'/api/files/{completed_task}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert matched.status_code == 206
+    assert matched.data == origin.payload[:10]
+    stale = client.get(f'/api/files/{completed_task}', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == origin.payload
+
+def test_unknown_task(client):
+    assert client.get('/api/files/missing').status_code == 404
@@ -0,0 +1,73 @@
+import pytest
+
+def fmt(format_id, vcodec='none', acodec='none', height=None, tbr=None, abr=None, ext='mp4', protocol='https', fps=None):
+    return {'format_id': format_id, 'vcodec': vcodec, 'acodec': acodec, 'height': height, 'tbr': tbr, 'abr': abr,
+            'ext': ext, 'protocol': protocol, 'fps': fps, 'url': f'https://media.invalid/{format_id}'}
+
+FORMATS = [
+    fmt('sb0', ext='mhtml'),
+    fmt('140', acodec='mp4a.40.2', abr=128, ext='m4a'),
+    fmt('251', acodec='opus', abr=160, ext='webm'),
+    fmt('18', vcodec='avc1.42001E', acodec='mp4a.40.2', height=360, tbr=500),
+    fmt('137', vcodec='avc1.640028', height=1080, tbr=4000, fps=30),
+    fmt('248', vcodec='vp9', height=1080, tbr=3000, ext='webm', fps=30),
+    fmt('299', vcodec='avc1.64002a', height=1080, tbr=6000, fps=60),
+    fmt('401', vcodec='av01.0.12M.08', height=2160, tbr=20000),
+    fmt('hls-720', vcodec='avc1.4d401f', acodec='mp4a.40.2', height=720, tbr=2000, protocol='m3u8_native'),
+]
+
+def best(api, kind, **params):
+    policy = api.FormatPolicy.from_params(params)
+    return (api.FormatIndex(FORMATS).best(kind, policy) or {}).get('format_id')
+
+def test_default_policy_prefers_height_fps_then_bitrate(api):
+    index = api.FormatIndex(FORMATS)
+    assert index.best('video')['format_id'] == '401'
+    assert index.best('audio')['format_id'] == '251'
+    # 非媒体格式不进入任何分组
+    assert all(entry['format']['format_id'] != 'sb0' for entries in index.entries.values() for entry in entries)
+
+def test_hard_limits(api):
+    assert best(api, 'video', max_height=1080) == '299'
+    assert best(api, 'video', max_height='1080', max_bitrate='5000') == '137'
+    assert best(api, 'muxed', min_height=480) == 'hls-720'
+    assert best(api, 'muxed', progressive='true') == '18'
+    assert best(api, 'video', min_height=4320) is None
+
+def test_codec_preferences_in_order(api):
+    # 编码偏好优先于高度
+    assert best(api, 'video', vcodec='vp9,h264') == '248'
+    assert best(api, 'video', vcodec='h264') == '299'
+    assert best(api, 'audio', acodec='m4a') == '140'
+    # 偏好不满足时退回其他格式，strict时排除
+    assert best(api, 'video', vcodec='hevc') == '401'
+    assert best(api, 'video', vcodec='hevc', strict='true') is None
+
+def test_invalid_params(api):
+    with pytest.raises(ValueError, match='max_height'):
+        api.FormatPolicy.from_params({'max_height': 'tall'})
+    with pytest.raises(ValueError, match='不支持的编码'):
+        api.FormatPolicy.from_params({'vcodec': 'mpeg2'})
+
+def test_playable_links_apply_policy(client, origin):
+    url = 'https://bench.invalid/watch?v=policy001'
+    links = client.get(f'/api/playable-links?url={url}').get_json()
+    assert links['video_stream']['format_id'] == '18'
+    assert links['audio_stream']['format_id'] == '140'
+    links = client.get(f'/api/playable-links?url={url}&max_height=240').get_json()
+    assert links['video_stream'] is None
+    assert links['audio_stream']['format_id'] == '140'
+    assert client.get(f'/api/playable-links?url={url}&vcodec=mpeg2').status_code == 400
+
+def test_format_index_lives_on_the_cache_entry(api, monkeypatch):
+    cache = api.ExtractionCache(1)
+    monkeypatch.setattr(api, 'extract_cache', cache)
+    info = {'id': 'idx', 'formats': list(FORMATS)}
+    cache.put('idx', info)
+    index = api.get_format_index(info)
+    assert api.get_format_index(info) is index
+    # 条目被淘汰后索引随之释放，不在缓存中的info每次临时建立
+    cache.put('other', {'id': 'other', 'formats': list(FORMATS)})
+    assert cache.format_index(info) is None
+    assert api.get_format_index(info) is not index
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,53 @@
+import pytest
+
+@pytest.fixture
+def governor(api, monkeypatch):
+    """每个测试使用独立的调速器：提取每秒1次、突发2次，媒体不限"""
+    governor = api.UpstreamGovernor({'extract': (1.0, 2.0), 'media': (1000000.0, 1000000.0)})
+    monkeypatch.setattr(api, 'upstream_governor', governor)
+    return governor
+
+def bucket_stats(governor, kind='extract', extractor='FakeBench'):
+    return next(b for b in governor.stats() if b['kind'] == kind and b['extractor'] == extractor)
+
+def test_acquire_rejects_when_budget_exhausted(api, governor):
+    api.acquire_upstream('extract', 'FakeBench', max_wait=0)
+    api.acquire_upstream('extract', 'FakeBench', max_wait=0)
+    with pytest.raises(api.UpstreamThrottled) as excinfo:
+        api.acquire_upstream('extract', 'FakeBench', max_wait=0)
+    assert 0 < excinfo.value.retry_after <= 1
+    # 其他提取器和出口的预算互不影响
+    api.acquire_upstream('extract', 'Other', max_wait=0)
+    api.acquire_upstream('extract', 'FakeBench', 'socks5://proxy:1080', max_wait=0)
+    stats = bucket_stats(governor)
+    assert stats['granted'] == 2
+    assert stats['rejected'] == 1
+
+def test_acquire_waits_within_max_wait(api, governor):
+    for _ in range(2):
+        api.acquire_upstream('extract', 'FakeBench', max_wait=0)
+    api.acquire_upstream('extract', 'FakeBench', max_wait=2)
+    assert bucket_stats(governor)['tokens'] < 0.5
+
+def test_report_throttled_backs_off_and_recovers(api, governor):
+    api.report_upstream('extract', 'FakeBench', 'default', True, retry_after=30)
+    stats = bucket_stats(governor)
+    assert stats['rate'] == 0.5
+    assert stats['throttled'] == 1
+    assert stats['cooldown_remaining'] >= 29
+    with pytest.raises(api.UpstreamThrottled) as excinfo:
+        api.acquire_upstream('extract', 'FakeBench', max_wait=5)
+    assert excinfo.value.retry_after >= 29
+
+    # 成功后加性恢复，不超过基础速率
+    for _ in range(100):
+        api.report_upstream('extract', 'FakeBench', 'default', False)
+    assert bucket_stats(governor)['rate'] == 1.0
+
+def test_info_returns_503_with_retry_after(api, client, origin, governor):
+    # 新的视频ID不在提取缓存中，请求必须经过上游预算
+    governor.report('extract', 'FakeBench', 'default', True, retry_after=10)
+    response = client.get('/api/info?url=https://bench.invalid/watch?v=gov000001')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 10
+    assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
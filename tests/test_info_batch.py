@@ -0,0 +1,19 @@
+import json
+
+def test_throttled_items_include_retry_after(api, client, origin, monkeypatch):
+    extract_info_cached = api.extract_info_cached
+
+    def throttle_second(url, *args, **kwargs):
+        if url.endswith('batch00002'):
+            raise api.UpstreamThrottled(4.2)
+        return extract_info_cached(url, *args, **kwargs)
+
+    monkeypatch.setattr(api, 'extract_info_cached', throttle_second)
+    urls = [f'https://bench.invalid/watch?v=batch0000{i}' for i in (1, 2)]
+    response = client.post('/api/info/batch', json={'urls': urls})
+    lines = sorted((json.loads(line) for line in response.get_data(as_text=True).splitlines()),
+                   key=lambda line: line['index'])
+    assert lines[0]['info']['title'] == 'Benchmark video batch00001'
+    assert 'retry_after' not in lines[0]
+    assert lines[1]['retry_after'] == 5
+    assert '5秒后重试' in lines[1]['error']
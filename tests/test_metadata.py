@@ -0,0 +1,28 @@
+def test_parse_and_project_fields(api):
+    tree = api.parse_fields('title, formats.format_id,formats.url,,formats')
+    assert tree == {'title': True, 'formats': True}
+    tree = api.parse_fields(['title', 'formats.format_id'])
+    data = {'title': 't', 'id': 'x', 'formats': [{'format_id': '18', 'url': 'u'}, {'format_id': '140'}]}
+    assert api.project_fields(data, tree) == {'title': 't', 'formats': [{'format_id': '18'}, {'format_id': '140'}]}
+    assert api.parse_fields('') is None
+
+def test_info_fields_projection(client, origin):
+    url = 'https://bench.invalid/watch?v=fields001'
+    response = client.get(f'/api/info?url={url}&fields=title,formats.format_id,formats.http_headers')
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'title': 'Benchmark video fields001',
+        # http_headers不在白名单中，不会返回
+        'formats': [{'format_id': '140'}, {'format_id': '18'}, {'format_id': '137'}]
+    }
+
+def test_info_etag_and_not_modified(client, origin):
+    url = 'https://bench.invalid/watch?v=fields002'
+    first = client.get(f'/api/info?url={url}&fields=title')
+    etag = first.headers['ETag']
+    assert 'max-age=' in first.headers['Cache-Control']
+    again = client.get(f'/api/info?url={url}&fields=title', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    other = client.get(f'/api/info?url={url}&fields=id', headers={'If-None-Match': etag})
+    assert other.status_code == 200
@@ -0,0 +1,50 @@
+import threading
+
+def test_shards_from_threads_are_merged(api):
+    registry = api.MetricsRegistry()
+    counter = registry.counter('jobs_total', 'jobs', ('kind',))
+    histogram = registry.histogram('job_seconds', 'duration', ('kind',), buckets=(0.1, 1))
+
+    def work():
+        for _ in range(100):
+            counter.inc('download')
+        histogram.observe(0.5, 'download')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc('audio', amount=3)
+    # 已退出线程的分片并入后仍然计数
+    values, _ = registry.snapshot()
+    assert values[('ytdlp_api_jobs_total', ('download',))] == 400
+    assert values[('ytdlp_api_jobs_total', ('audio',))] == 3
+
+    text = registry.render(values, {})
+    assert '# TYPE ytdlp_api_jobs_total counter' in text
+    assert 'ytdlp_api_jobs_total{kind="download"} 400' in text
+    assert 'ytdlp_api_job_seconds_bucket{kind="download",le="0.1"} 0' in text
+    assert 'ytdlp_api_job_seconds_bucket{kind="download",le="1"} 4' in text
+    assert 'ytdlp_api_job_seconds_bucket{kind="download",le="+Inf"} 4' in text
+    assert 'ytdlp_api_job_seconds_count{kind="download"} 4' in text
+    assert 'ytdlp_api_job_seconds_sum{kind="download"} 2' in text
+
+def test_gauges_and_published_snapshots(api):
+    registry = api.MetricsRegistry()
+    registry.gauge('queue', 'queued jobs', ('state',), lambda: {('queued',): 2})
+    registry.gauge('workers', 'pushed by workers', ())
+    registry.publish('web-1', {}, {('ytdlp_api_workers', ()): 8})
+    _, gauges = registry.snapshot()
+    assert gauges == {('ytdlp_api_queue', ('queued',)): 2}
+    _, gauges = registry.snapshot(include_published=True)
+    assert gauges[('ytdlp_api_workers', ())] == 8
+    assert 'ytdlp_api_queue{state="queued"} 2' in registry.render({}, gauges)
+
+def test_metrics_endpoint_records_requests(client):
+    client.get('/health')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert 'ytdlp_api_http_request_duration_seconds_count{endpoint="/health",method="GET",status="200"}' in text
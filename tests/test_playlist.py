@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLtest'
+
+@pytest.fixture
+def fake_playlist(api, monkeypatch):
+    """条目为生成器的播放列表，记录提取次数和生成的条目数"""
+    counters = {'extractions': 0, 'produced': 0}
+
+    def entries():
+        for index in range(25):
+            counters['produced'] += 1
+            yield {'id': f'video{index:02d}', 'title': f'Video {index}', 'url': f'https://www.youtube.com/watch?v=video{index:02d}'}
+
+    def open_playlist(ydl, url):
+        counters['extractions'] += 1
+        return {'_type': 'playlist', 'id': 'PLtest', 'title': 'Test playlist', 'entries': entries()}
+
+    monkeypatch.setattr(api, 'open_playlist', open_playlist)
+    monkeypatch.setattr(api, 'playlist_cursors', api.PlaylistCursorCache(60, 4))
+    return counters
+
+def test_next_page_continues_without_reextracting(api, client, fake_playlist):
+    ids = []
+    cursor = 0
+    while cursor is not None:
+        page = client.get(f'/api/playlist?url={PLAYLIST_URL}&page_size=10&cursor={cursor}').get_json()
+        ids.extend(entry['id'] for entry in page['entries'])
+        cursor = page['next_cursor']
+    assert ids == [f'video{index:02d}' for index in range(25)]
+    assert fake_playlist['extractions'] == 1
+    assert fake_playlist['produced'] == 25
+    stats = api.playlist_cursors.stats()
+    assert (stats['hits'], stats['sessions']) == (2, 0)
+
+def test_unknown_cursor_falls_back_to_extraction(api, client, fake_playlist):
+    page = client.get(f'/api/playlist?url={PLAYLIST_URL}&page_size=10&cursor=20').get_json()
+    assert [entry['id'] for entry in page['entries']] == [f'video{index:02d}' for index in range(20, 25)]
+    assert page['next_cursor'] is None
+    assert fake_playlist['extractions'] == 1
+    assert api.playlist_cursors.stats()['misses'] == 1
+
+class Session:
+    def __init__(self, name, closed):
+        self.name = name
+        self.closed = closed
+
+    def close(self):
+        self.closed.append(self.name)
+
+def test_sessions_are_closed_when_evicted_or_expired(api):
+    closed = []
+    cache = api.PlaylistCursorCache(60, 1)
+    cache.put('a', Session('a', closed))
+    cache.put('b', Session('b', closed))
+    # 超过数量上限时关闭最早的会话
+    assert closed == ['a']
+    assert cache.take('a') is None
+    assert cache.take('b').name == 'b'
+
+    cache = api.PlaylistCursorCache(0.01, 4)
+    cache.put('c', Session('c', closed))
+    time.sleep(0.05)
+    assert cache.take('c') is None
+    assert closed == ['a', 'c']
+    assert cache.stats()['expired'] == 1
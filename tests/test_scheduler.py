@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+@pytest.fixture
+def blocked_scheduler(api, monkeypatch):
+    """单个工作线程、队列上限3的调度器；第一个任务占住工作线程，直到测试放行"""
+    scheduler = api.DownloadScheduler(1, 3)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    monkeypatch.setitem(api.JOB_RUNNERS, 'test-block', blocker)
+    scheduler.submit('blocker', 'test-block', ())
+    assert started.wait(5)
+    yield scheduler, release
+    release.set()
+
+def test_runs_by_priority_then_size(api, blocked_scheduler, monkeypatch):
+    scheduler, release = blocked_scheduler
+    order = []
+    finished = threading.Event()
+    monkeypatch.setitem(api.JOB_RUNNERS, 'test-record', order.append)
+    monkeypatch.setitem(api.JOB_RUNNERS, 'test-finish', finished.set)
+    scheduler.submit('video-large', 'test-record', ('video-large',), (1, 500))
+    scheduler.submit('video-small', 'test-record', ('video-small',), (1, 10))
+    scheduler.submit('audio', 'test-record', ('audio',), (0, float('inf')))
+    assert [scheduler.queue_position(task_id) for task_id in ('audio', 'video-small', 'video-large')] == [1, 2, 3]
+    assert scheduler.queue_position('blocker') is None
+
+    with pytest.raises(api.DownloadQueueFull):
+        scheduler.submit('overflow', 'test-record', ('overflow',))
+    assert scheduler.cancel('video-large') == 'queued'
+    scheduler.submit('last', 'test-finish', (), (2,))
+
+    release.set()
+    assert finished.wait(5)
+    assert order == ['audio', 'video-small']
+    assert scheduler.stats()['queued'] == 0
+
+def test_cancel_running_task(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    assert scheduler.cancel('blocker') == 'running'
+    assert scheduler.is_cancelled('blocker')
+    assert scheduler.cancel('unknown') is None
+
+def test_drain_waits_for_running_jobs(api, blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    assert scheduler.drain(0.05) is False
+    # 关闭期间不再接受新任务
+    with pytest.raises(api.DownloadQueueFull):
+        scheduler.submit('late', 'test-block', ())
+    release.set()
+    assert scheduler.drain(5) is True
+
+def test_audio_jobs_rank_before_video(api):
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    assert api.get_task_priority('audio_only', url) < api.get_task_priority('video', url)
+    # 客户端可以显式指定优先级
+    assert api.get_task_priority('video', url, requested_priority='0')[0] == 0
+    assert api.get_task_priority('video', url, requested_priority='high')[0] == 1
+
+def test_size_follows_selected_formats(api, origin):
+    url = 'https://bench.invalid/watch?v=prio00001'
+    # 缓存未命中时体积未知
+    assert api.get_task_priority('video', url)[1] == float('inf')
+    info, _ = api.extract_info_cached(url)
+    size = len(origin.payload)
+    assert api.get_task_priority('video', url, format_spec='18') == (1, size)
+    # 合并下载按视频和音频体积之和排序
+    assert api.get_task_priority('video', url, format_spec='137+140', info=info) == (1, 2 * size)
+
+def test_enqueue_resolves_size_on_cold_cache(api, origin, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(api.download_scheduler, 'submit', lambda task_id, kind, args, priority: submitted.append(priority))
+    url = 'https://bench.invalid/watch?v=prio00002'
+    task_id = 'prio-cold'
+    api.task_store.create(task_id, {'status': 'queued', 'url': url, 'type': 'video', 'created_at': '', 'progress': {}})
+    api.enqueue_download(task_id, url, {'format': '18'}, 'video')
+    api.download_store.abandon(api.get_artifact_id(url, {'format': '18'}, api.extract_info_cached(url)[0]))
+    assert submitted == [(1, len(origin.payload))]
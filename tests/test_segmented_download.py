@@ -0,0 +1,65 @@
+from http.server import ThreadingHTTPServer
+
+import pytest
+import yt_dlp
+
+import benchmark
+from conftest import RecordingOriginHandler
+
+class ShiftedOriginHandler(RecordingOriginHandler):
+    """忽略Range起始位置、总是从文件开头返回的源站"""
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        if range_header:
+            del self.headers['Range']
+            self.headers['Range'] = 'bytes=0-' + range_header.split('-', 1)[1]
+        super().do_GET()
+
+@pytest.fixture
+def downloader(api):
+    return api.SegmentedHttpFD(yt_dlp.YoutubeDL({'quiet': True}), {'segment_connections': 2, 'socket_timeout': 5})
+
+def test_probe_size_uses_media_budget(api, origin, downloader, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, 'acquire_upstream', lambda kind, *args: calls.append(kind))
+    size = downloader._probe_size(f'{origin.url}/media/probe/18', {}, 'FakeBench', 'default')
+    assert size == len(origin.payload)
+    assert calls == ['media']
+    assert origin.requests[-1] == ('/media/probe/18', 'bytes=0-0')
+
+def test_rejects_misaligned_content_range(api, origin, downloader):
+    ShiftedOriginHandler.block = RecordingOriginHandler.block
+    ShiftedOriginHandler.media_size = RecordingOriginHandler.media_size
+    server = benchmark.start_http_server(ThreadingHTTPServer(('127.0.0.1', 0), ShiftedOriginHandler))
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/media/shifted/18'
+        # 从0开始的请求与上游一致
+        downloader._request_range(url, {}, 0, 99, 'FakeBench', 'default').close()
+        with pytest.raises(yt_dlp.utils.DownloadError, match='Content-Range'):
+            downloader._request_range(url, {}, 100, 199, 'FakeBench', 'default')
+    finally:
+        server.shutdown()
+
+def test_segmented_download_final_progress(api, client, origin, wait_for_task, monkeypatch):
+    monkeypatch.setattr(api, 'DOWNLOAD_SEGMENT_SIZE', 16 * 1024)
+    body = {'url': 'https://bench.invalid/watch?v=seg000001', 'options': {'format': '18'}, 'connections': 4}
+    task = wait_for_task(client.post('/api/download', json=body).get_json()['task_id'])
+    assert task['status'] == 'completed', task.get('error')
+    progress = task['progress']
+    assert progress['segments_total'] > 2
+    assert progress['segments_done'] == progress['segments_total']
+    assert progress['downloaded_bytes'] == progress['total_bytes'] == len(origin.payload)
+    with open(task['filename'], 'rb') as f:
+        assert f.read() == origin.payload
+
+def test_segmented_download_reassembles_file(api, client, origin, wait_for_task, monkeypatch):
+    monkeypatch.setattr(api, 'DOWNLOAD_SEGMENT_SIZE', 16 * 1024)
+    body = {'url': 'https://bench.invalid/watch?v=seg000000', 'options': {'format': '18'}, 'connections': 4}
+    task = wait_for_task(client.post('/api/download', json=body).get_json()['task_id'])
+    assert task['status'] == 'completed', task.get('error')
+    with open(task['filename'], 'rb') as f:
+        assert f.read() == origin.payload
+    ranges = [range_header for path, range_header in origin.requests if path.startswith('/media/seg000000/')]
+    # 探测请求之外，每个分段一个Range请求
+    assert len([r for r in ranges if r and r != 'bytes=0-0']) > 2
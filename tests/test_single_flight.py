@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+def run_concurrently(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def wait_for_callers(flights, key, count, timeout=5):
+    """等待所有调用者都加入同一次进行中的调用"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        call = flights._calls.get(key)
+        if call is not None and call.callers == count:
+            return
+        time.sleep(0.001)
+    raise AssertionError(f'{timeout}秒内没有{count}个调用者加入')
+
+def test_concurrent_callers_share_one_call(api):
+    flights = api.SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def extract():
+        calls.append(1)
+        release.wait(5)
+        return {'id': 'video'}
+
+    threads = run_concurrently(8, lambda: results.append(flights.do(('Youtube', 'video', 'default'), extract)))
+    wait_for_callers(flights, ('Youtube', 'video', 'default'), 8)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(result is results[0][0] for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    stats = flights.stats()
+    assert stats['flights'] == 1
+    assert stats['coalesced_callers'] == 7
+    assert stats['in_flight'] == 0
+
+def test_errors_are_shared_and_not_cached(api):
+    flights = api.SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    def call():
+        try:
+            flights.do(('Youtube', 'broken', 'default'), failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = run_concurrently(3, call)
+    wait_for_callers(flights, ('Youtube', 'broken', 'default'), 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
+    # 失败的调用结束后，下一次调用重新执行
+    assert flights.do(('Youtube', 'broken', 'default'), lambda: 'ok') == ('ok', False)
+
+def test_different_keys_run_separately(api):
+    flights = api.SingleFlight()
+    assert flights.do(('Youtube', 'a', 'x'), lambda: 1) == (1, False)
+    assert flights.do(('Youtube', 'a', 'y'), lambda: 2) == (2, False)
+    with pytest.raises(KeyError):
+        flights.do(('Youtube', 'b', 'x'), lambda: {}['missing'])
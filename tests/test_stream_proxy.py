@@ -0,0 +1,46 @@
+from conftest import make_upstream
+
+def test_forwards_range_headers(api, upstream_requests):
+    sent, responses = upstream_requests
+    responses.append(make_upstream(206))
+    headers = {'Range': 'bytes=100-199', 'If-Range': '"v1"', 'Cookie': 'secret'}
+    with api.app.test_request_context('/api/stream/x', headers=headers):
+        api.open_upstream('https://media.invalid/v.mp4', {'User-Agent': 'ua'})
+    url, kwargs = sent[0]
+    assert url == 'https://media.invalid/v.mp4'
+    assert kwargs['stream'] is True
+    # 只转发Range相关的请求头，客户端的其他请求头不发给上游
+    assert kwargs['headers'] == {'User-Agent': 'ua', 'Range': 'bytes=100-199', 'If-Range': '"v1"'}
+
+def test_partial_content_is_relayed(api):
+    body = bytes(range(100))
+    upstream = make_upstream(206, body, {'Content-Range': 'bytes 100-199/1000', 'Content-Length': '100',
+                                         'Content-Type': 'video/webm', 'Set-Cookie': 'x=1'})
+    with api.app.test_request_context('/api/stream/x'):
+        response = api.build_stream_response(upstream, 'video/mp4')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 100-199/1000'
+    assert response.headers['Content-Length'] == '100'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.content_type == 'video/webm'
+    assert 'Set-Cookie' not in response.headers
+    assert b''.join(response.response) == body
+
+def test_error_statuses(api):
+    with api.app.test_request_context('/api/stream/x'):
+        response = api.build_stream_response(make_upstream(416, headers={'Content-Range': 'bytes */1000'}))
+        assert response.status_code == 416
+        assert response.headers['Content-Range'] == 'bytes */1000'
+        _, status = api.build_stream_response(make_upstream(500))
+        assert status == 502
+
+def test_upstream_session_pools_connections(api):
+    adapter = api.upstream_session.get_adapter('https://media.invalid/')
+    assert adapter._pool_maxsize == api.STREAM_POOL_SIZE
+
+def test_stream_through_fake_extractor(client, origin):
+    response = client.get('/api/stream/proxy0001?format=18', headers={'Range': 'bytes=1000-1999'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 1000-1999/{len(origin.payload)}'
+    assert response.data == origin.payload[1000:2000]
+    assert origin.requests[-1][1] == 'bytes=1000-1999'
@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import REPO_DIR, WORKDIR, make_upstream
+
+SIGN_SCRIPT = '''
+import json, sys
+import yt_dlp_api
+print(yt_dlp_api.sign_stream_token(sys.argv[1], json.loads(sys.argv[2])))
+'''
+
+def sign_in_subprocess(video_id, fmt, secret):
+    """在另一个进程中签发令牌，模拟由其他工作进程或实例签发"""
+    env = dict(os.environ, STREAM_TOKEN_SECRET=secret, PYTHONPATH=REPO_DIR,
+               TASK_DB_PATH=os.path.join(WORKDIR, 'signer.db'))
+    output = subprocess.check_output([sys.executable, '-c', SIGN_SCRIPT, video_id, json.dumps(fmt)],
+                                     env=env, cwd=WORKDIR, text=True, timeout=60)
+    return output.strip().splitlines()[-1]
+
+@pytest.fixture
+def media_format():
+    return {
+        'format_id': '18',
+        'url': f'https://rr1.googlevideo.com/videoplayback?id=1&expire={int(time.time()) + 3600}',
+        'http_headers': {'User-Agent': 'yt-dlp-api-test'},
+        'ext': 'mp4',
+        'acodec': 'mp4a.40.2'
+    }
+
+@pytest.fixture
+def no_extraction(api, monkeypatch):
+    def resolve_stream_format(*args, **kwargs):
+        raise AssertionError('令牌有效时不应重新提取')
+    monkeypatch.setattr(api, 'resolve_stream_format', resolve_stream_format)
+
+def test_token_signed_by_another_process(api, client, media_format, upstream_requests, no_extraction):
+    token = sign_in_subprocess('token01', media_format, 'test-secret')
+    payload = api.verify_stream_token(token)
+    assert payload['u'] == media_format['url']
+    assert payload['h'] == media_format['http_headers']
+    assert payload['f'] == '18'
+
+    sent, responses = upstream_requests
+    responses.append(make_upstream(206, b'x' * 100, {'Content-Range': 'bytes 100-199/1000'}))
+    response = client.get(f'/api/stream/token01?token={token}', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['X-Stream-Source'] == 'token'
+    assert sent[0][0] == media_format['url']
+    assert sent[0][1]['headers']['Range'] == 'bytes=100-199'
+
+def test_token_with_other_secret_is_rejected(api, media_format):
+    token = sign_in_subprocess('token01', media_format, 'other-secret')
+    with pytest.raises(api.InvalidStreamToken):
+        api.verify_stream_token(token)
+
+def test_tampered_or_mismatched_token_falls_back_to_extraction(api, client, origin, media_format):
+    body, signature = api.sign_stream_token('token01', media_format).split('.')
+    tampered = api.sign_stream_token('token02', media_format).split('.')[0]
+    with pytest.raises(api.InvalidStreamToken):
+        api.verify_stream_token(f'{tampered}.{signature}')
+    assert api.verify_stream_token(f'{body}.{signature}')['v'] == 'token01'
+
+    # 无效的令牌不中断播放，按普通请求重新提取
+    response = client.get(f'/api/stream/token01?format=18&token={tampered}.{signature}')
+    assert response.status_code == 200
+    assert response.headers['X-Stream-Source'] == 'extract'
+    assert response.data == origin.payload
+    # 令牌只能用于签发时的视频，用于其他视频时同样重新提取
+    response = client.get(f'/api/stream/token02?format=18&token={body}.{signature}')
+    assert response.headers['X-Stream-Source'] == 'extract'
+    assert origin.requests[-1][0].startswith('/media/token02/18')
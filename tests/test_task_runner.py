@@ -0,0 +1,11 @@
+def test_task_runner_resolves_relative_paths_in_launch_directory(api, tmp_path, monkeypatch):
+    # 工作目录中没有yt_dlp_api.py，任务进程只能通过PYTHONPATH导入模块
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TASK_DB_PATH', 'tasks.db')
+    runner, address, _ = api.start_task_runner()
+    try:
+        assert (tmp_path / 'tasks.db').exists()
+        assert (tmp_path / 'downloads').is_dir()
+    finally:
+        runner.terminate()
+        runner.wait(30)
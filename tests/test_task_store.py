@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+def make_task(status='queued', **fields):
+    return dict({'status': status, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, **fields)
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'tasks.db')
+
+def test_updates_stay_in_memory_until_flush(api, db_path):
+    store = api.TaskStore(db_path, ttl=3600)
+    store.create('t1', make_task(url='https://example.com/a'))
+    store.update('t1', status='downloading', progress={'downloaded_bytes': 10})
+    # 另一个连接在写回之前看不到任务
+    assert api.TaskStore(db_path, ttl=3600).get('t1') is None
+
+    store.flush()
+    assert store.stats() == {'hot': 1, 'dirty': 0}
+    store.update('t1', status='completed', filename='a.mp4')
+    store.flush()
+    # 已结束的任务写回后移出内存，之后从数据库读取
+    assert store.stats()['hot'] == 0
+    task = store.get('t1')
+    assert task['status'] == 'completed'
+    assert task['filename'] == 'a.mp4'
+    assert task['progress'] == {'downloaded_bytes': 10}
+
+def test_restart_marks_interrupted_tasks(api, db_path):
+    store = api.TaskStore(db_path, ttl=3600)
+    store.create('running', make_task('downloading'))
+    store.create('done', make_task('completed'))
+    store.flush()
+
+    restarted = api.TaskStore(db_path, ttl=3600)
+    assert restarted.get('running')['status'] == 'error'
+    assert restarted.get('running')['error'] == '服务重启，任务已中断'
+    assert restarted.get('done')['status'] == 'completed'
+
+def test_query_delete_and_prune(api, db_path):
+    store = api.TaskStore(db_path, ttl=3600)
+    for index in range(5):
+        store.create(f't{index}', make_task('completed' if index % 2 else 'queued', index=index))
+    tasks, total = store.query(status='completed', limit=1)
+    assert total == 2
+    assert len(tasks) == 1
+
+    store.delete('t1')
+    assert store.get('t1') is None
+    assert store.query(status='completed')[1] == 1
+
+    # 保留时间为0时已结束的任务全部清理，活跃任务保留
+    store.ttl = 0
+    time.sleep(0.01)
+    assert store.prune() == 1
+    assert store.query()[1] == 3
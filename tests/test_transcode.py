@@ -0,0 +1,32 @@
+import shutil
+
+import pytest
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='需要ffmpeg')
+def test_transcode_streams_ffmpeg_output(api, client, origin):
+    response = client.get('/api/transcode/trans0001?to=flac&format=140')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'audio/flac'
+    assert response.headers['X-Transcode-Mode'] == 'transcode'
+    assert response.data.startswith(b'fLaC')
+    response.close()
+    assert api.ffmpeg_limiter.stats()['running'] == 0
+
+def test_copy_when_upstream_codec_matches(api):
+    command = api.build_transcode_command(api.TRANSCODE_TARGETS['m4a'], copy=True)
+    assert command[command.index('-c:a') + 1] == 'copy'
+    assert command[-1] == 'pipe:1'
+    command = api.build_transcode_command(api.TRANSCODE_TARGETS['mp3'], copy=False)
+    assert command[command.index('-c:a') + 1] == 'libmp3lame'
+
+def test_unknown_target(client):
+    response = client.get('/api/transcode/trans0001?to=wma')
+    assert response.status_code == 400
+    assert 'mp3' in response.get_json()['targets']
+
+def test_rejects_when_ffmpeg_slots_are_busy(api, client, monkeypatch):
+    monkeypatch.setattr(api, 'ffmpeg_limiter', api.FFmpegLimiter(1))
+    api.ffmpeg_limiter.acquire()
+    response = client.get('/api/transcode/trans0001?to=mp3')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
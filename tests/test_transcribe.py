@@ -0,0 +1,57 @@
+import json
+import shutil
+
+import pytest
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='需要ffmpeg')
+def test_stub_backend_end_to_end(client, wait_for_task):
+    body = {'url': 'https://bench.invalid/watch?v=asr000001', 'backend': 'stub', 'model': 'tiny'}
+    response = client.post('/api/transcribe', json=body)
+    assert response.status_code == 200
+    task = wait_for_task(response.get_json()['task_id'])
+    assert task['status'] == 'completed', task.get('error')
+    assert task['backend'] == 'stub'
+    assert task['segments'] and task['segments'][0]['start'] == 0.0
+    assert '[stub tiny' in task['text']
+
+    # 相同的(视频, 模型, 语言)直接返回缓存的结果
+    cached = client.post('/api/transcribe', json=body).get_json()
+    assert cached['cached'] is True
+    assert cached['segments'] == task['segments']
+
+def test_rejects_long_video_before_downloading(api, client, origin, wait_for_task, monkeypatch):
+    monkeypatch.setattr(api, 'TRANSCRIBE_MAX_DURATION', 100)
+    media_requests = len([path for path, _ in origin.requests if '/media/' in path])
+    body = {'url': 'https://bench.invalid/watch?v=asr000002', 'backend': 'stub', 'model': 'tiny'}
+    task = wait_for_task(client.post('/api/transcribe', json=body).get_json()['task_id'])
+    assert task['status'] == 'error'
+    assert '100秒' in task['error']
+    # 假视频时长212秒，超过限制时不应请求任何媒体数据
+    assert len([path for path, _ in origin.requests if '/media/' in path]) == media_requests
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='需要ffmpeg')
+def test_segments_are_streamed_not_stored_while_running(api, client, monkeypatch):
+    writes = []
+    update = api.task_store.update
+
+    def record(task_id, transient=None, **fields):
+        writes.append(fields)
+        update(task_id, transient=transient, **fields)
+
+    monkeypatch.setattr(api.task_store, 'update', record)
+    body = {'url': 'https://bench.invalid/watch?v=asr000003', 'backend': 'stub', 'model': 'base', 'stream': True}
+    response = client.post('/api/transcribe', json=body)
+    lines = [json.loads(line) for line in response.iter_encoded() if line.strip()]
+    response.close()
+    assert [line['type'] for line in lines][0] == 'task'
+    assert any(line['type'] == 'segment' for line in lines)
+    assert lines[-1]['type'] == 'done' and lines[-1]['status'] == 'completed'
+    # 运行中只写进度计数，片段在完成时一次写入
+    assert all('segments' not in fields for fields in writes if fields.get('status') != 'completed')
+    assert any(fields.get('progress', {}).get('segments_done') for fields in writes)
+
+    task_id = lines[0]['task_id']
+    listed = client.get('/api/tasks?limit=500').get_json()['tasks'][task_id]
+    assert 'segments' not in listed and 'text' not in listed
+    listed = client.get('/api/tasks?limit=500&fields=status,segments').get_json()['tasks'][task_id]
+    assert listed['segments'] and listed['status'] == 'completed'
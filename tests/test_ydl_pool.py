@@ -0,0 +1,78 @@
+import pytest
+import yt_dlp
+
+OPTS = {'quiet': True, 'no_warnings': True}
+
+@pytest.fixture
+def pool(api):
+    return api.YDLPool(max_idle=2)
+
+def test_reuses_instance_for_same_options(pool):
+    with pool.lease(dict(OPTS)) as first:
+        pass
+    with pool.lease(dict(OPTS)) as second:
+        pass
+    assert first is second
+    # 不同的cookies身份使用不同的实例
+    with pool.lease(dict(OPTS, cookiefile='/tmp/other.txt')) as other:
+        assert other is not first
+    stats = pool.stats()
+    assert (stats['created'], stats['reused'], stats['idle'], stats['in_use']) == (2, 1, 2, 0)
+
+def test_concurrent_leases_get_separate_instances(pool):
+    with pool.lease(dict(OPTS)) as first, pool.lease(dict(OPTS)) as second:
+        assert first is not second
+    assert pool.stats()['idle'] == 2
+
+def test_progress_hooks_are_per_lease(pool):
+    received = []
+    with pool.lease(dict(OPTS, progress_hooks=[received.append])) as ydl:
+        ydl._progress_hooks[0]({'status': 'downloading'})
+    # 归还后之前请求的回调不再收到事件
+    with pool.lease(dict(OPTS)) as again:
+        assert again is ydl
+        again._progress_hooks[0]({'status': 'finished'})
+    assert received == [{'status': 'downloading'}]
+
+def test_broken_instances_are_discarded(pool):
+    with pytest.raises(yt_dlp.utils.DownloadError):
+        with pool.lease(dict(OPTS)) as kept:
+            raise yt_dlp.utils.DownloadError('video unavailable')
+    with pytest.raises(RuntimeError):
+        with pool.lease(dict(OPTS)) as broken:
+            assert broken is kept
+            raise RuntimeError('state corrupted')
+    with pool.lease(dict(OPTS)) as fresh:
+        assert fresh is not kept
+    assert pool.stats()['discarded'] == 1
+
+def test_idle_limit_and_max_uses(api, pool, monkeypatch):
+    for cookiefile in ('a', 'b', 'c'):
+        with pool.lease(dict(OPTS, cookiefile=cookiefile)):
+            pass
+    assert pool.stats()['idle'] == 2
+    assert pool.stats()['recycled'] == 1
+
+    monkeypatch.setattr(api, 'YDL_POOL_MAX_USES', 1)
+    with pool.lease(dict(OPTS, cookiefile='c')) as used:
+        pass
+    with pool.lease(dict(OPTS, cookiefile='c')) as rebuilt:
+        assert rebuilt is not used
+
+def test_download_options_use_one_off_instances(pool):
+    with pool.lease(dict(OPTS)) as warm:
+        pass
+    for index in range(3):
+        download_opts = dict(OPTS, outtmpl=f'/tmp/artifact-{index}/%(title)s.%(ext)s', format='18')
+        with pool.lease(download_opts) as ydl:
+            assert ydl is not warm
+    # 下载实例不入池，提取实例仍然可以复用
+    with pool.lease(dict(OPTS)) as again:
+        assert again is warm
+    # 只指定format的提取按format复用
+    with pool.lease(dict(OPTS, format='best')) as best:
+        pass
+    with pool.lease(dict(OPTS, format='best')) as best_again:
+        assert best_again is best
+    stats = pool.stats()
+    assert (stats['unpooled'], stats['idle'], stats['recycled'], stats['in_use']) == (3, 2, 0, 0)
@@ -5,31 +5,266 @@ yt-dlp HTTP API 服务器
 提供REST API接口来调用yt-dlp功能
 """
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
 import yt_dlp
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.downloader.fragment import FragmentFD
+import requests
+from requests.adapters import HTTPAdapter
 import os
+import sys
 import threading
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 import tempfile
+import shutil
 import json
+import re
+import time
+import hashlib
+import hmac
+import base64
+import zlib
+import functools
+import contextlib
+import heapq
+import itertools
+import bisect
+import sqlite3
+import atexit
+import signal
+import subprocess
+import importlib
+import importlib.util
+import wave
+import multiprocessing
+from multiprocessing.managers import BaseManager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 # import whisper  # Removed to reduce image size
 import io
 import warnings
+import asr_backends
+import mimetypes
+from urllib.parse import quote, urlsplit
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.wsgi import FileWrapper
 
 # 忽略Whisper的警告信息
 warnings.filterwarnings("ignore", category=UserWarning, module="whisper")
 
 app = Flask(__name__)
 
-# 存储下载任务状态
-download_tasks = {}
-
 # 下载目录
 DOWNLOAD_DIR = "./downloads"
 if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
 
+# 指标采集：热路径只写当前线程自己的分片，不加锁；/metrics抓取时再合并
+METRICS_PREFIX = 'ytdlp_api'
+# HTTP工作进程向任务进程推送本进程指标的间隔（秒）
+METRICS_PUSH_INTERVAL = float(os.environ.get('METRICS_PUSH_INTERVAL', 5))
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def inc(self, *labels, amount=1):
+        shard = self.registry.shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+class Histogram:
+    """分桶直方图，分片中保存各桶计数（最后一桶为+Inf）和总和"""
+
+    def __init__(self, registry, name, buckets):
+        self.registry = registry
+        self.name = name
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self.registry.shard()
+        key = (self.name, labels)
+        entry = shard.get(key)
+        if entry is None:
+            entry = shard[key] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+class MetricsRegistry:
+    """Prometheus文本格式的指标注册表"""
+
+    def __init__(self):
+        self.families = OrderedDict()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._gauges = []
+        # 其他进程推送的指标：来源 -> (推送时间, 计数值, 仪表值)
+        self._published = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        name = f'{METRICS_PREFIX}_{name}'
+        self.families[name] = ('counter', documentation, tuple(labelnames), None)
+        return Counter(self, name)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        name = f'{METRICS_PREFIX}_{name}'
+        self.families[name] = ('histogram', documentation, tuple(labelnames), tuple(buckets))
+        return Histogram(self, name, buckets)
+
+    def gauge(self, name, documentation, labelnames, collect=None):
+        """注册仪表；collect在抓取时调用，返回{标签元组: 数值}，为None时只由其他进程推送"""
+        name = f'{METRICS_PREFIX}_{name}'
+        self.families[name] = ('gauge', documentation, tuple(labelnames), None)
+        if collect is not None:
+            self._gauges.append((name, collect))
+
+    def shard(self):
+        """返回当前线程的分片，首次使用时注册"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        # 已退出线程的分片不会再被写入，并入_retired后丢弃
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = alive
+
+    @staticmethod
+    def _merge(target, values):
+        for key, value in values.items():
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                for i, v in enumerate(value):
+                    current[i] += v
+            else:
+                target[key] = current + value
+
+    def snapshot(self, include_published=False):
+        """合并所有分片，返回(计数值, 仪表值)"""
+        values = {}
+        with self._lock:
+            self._retire_dead_shards()
+            self._merge(values, self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            # dict.copy()在GIL下是原子的，写入线程无需等待
+            self._merge(values, shard.copy())
+        
+        gauges = {}
+        for name, collect in self._gauges:
+            try:
+                for labels, value in collect().items():
+                    gauges[(name, labels)] = value
+            except Exception as e:
+                print(f"指标采集失败 {name}: {e}")
+        
+        if include_published:
+            stale_before = time.time() - 3 * METRICS_PUSH_INTERVAL
+            for pushed_at, published_values, published_gauges in list(self._published.values()):
+                self._merge(values, published_values)
+                # 已退出的进程不再计入仪表，计数值保留以保持单调
+                if pushed_at >= stale_before:
+                    self._merge(gauges, published_gauges)
+        return values, gauges
+
+    def publish(self, source, values, gauges):
+        """接收其他进程推送的指标快照"""
+        self._published[source] = (time.time(), values, gauges)
+
+    def render(self, values, gauges):
+        """按Prometheus文本格式输出"""
+        lines = []
+        for name, (kind, documentation, labelnames, buckets) in self.families.items():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            samples = gauges if kind == 'gauge' else values
+            for (key_name, labels), value in sorted(samples.items(), key=lambda item: item[0]):
+                if key_name != name:
+                    continue
+                pairs = [f'{label}="{format_label_value(v)}"' for label, v in zip(labelnames, labels)]
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(pairs)} {format_metric_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else format_metric_value(bound)
+                    bucket_labels = format_labels(pairs + ['le="' + le + '"'])
+                    lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(pairs)} {format_metric_value(value[-1])}')
+                lines.append(f'{name}_count{format_labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def format_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_metric_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = metrics.histogram(
+    'http_request_duration_seconds', '接口处理耗时（至响应头返回）', ('endpoint', 'method', 'status'))
+EXTRACT_DURATION = metrics.histogram(
+    'extract_info_duration_seconds', 'extract_info耗时，按提取器和结果（ok/bot_wall/error）区分', ('extractor', 'outcome'),
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120))
+STREAM_BYTES = metrics.counter(
+    'stream_bytes_total', '/api/stream代理转发的字节数', ('source',))
+STREAM_THROUGHPUT = metrics.histogram(
+    'stream_throughput_bytes_per_second', '单次/api/stream代理的平均吞吐', ('source',),
+    buckets=(64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2))
+POSTPROCESSOR_DURATION = metrics.histogram(
+    'postprocessor_duration_seconds', '后处理器（ffmpeg合并/转码等）耗时', ('postprocessor',),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+UPSTREAM_THROTTLED = metrics.counter(
+    'upstream_throttled_total', '上游限流次数（rejected为本地预算不足直接拒绝，throttled为上游返回限流）',
+    ('kind', 'extractor', 'reason'))
+COOKIE_IDENTITY_RESULTS = metrics.counter(
+    'cookie_identity_results_total', 'cookies池身份的提取结果（ok/bot_wall/error）', ('identity', 'outcome'))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint, request.method, str(response.status_code))
+    return response
+
 # 默认YouTube cookies（Netscape格式）
 DEFAULT_YOUTUBE_COOKIES = """# Netscape HTTP Cookie File 
 # `http://curl.haxx.se/rfc/cookie_spec.html` 
@@ -59,6 +294,12 @@ DEFAULT_YOUTUBE_COOKIES = """# Netscape HTTP Cookie File
 .youtube.com	TRUE	/	TRUE	0	YSC	UwSy650qzIM 
 .youtube.com	TRUE	/	TRUE	1772784727	__Secure-ROLLOUT_TOKEN	CIDYvPiSwumi4gEQ6cWEquH0iwMY6a_3g5rGjwM%3D"""
 
+def upstream_retry_sleep(n):
+    """第n次重试前等待的秒数"""
+    return min(2 ** n, 30)
+
+UPSTREAM_RETRY_SLEEP = {'http': upstream_retry_sleep, 'fragment': upstream_retry_sleep, 'extractor': upstream_retry_sleep}
+
 def get_ydl_opts_with_cookies(base_opts=None, cookies_data=None):
     """获取包含cookies配置的yt-dlp选项"""
     if base_opts is None:
@@ -71,6 +312,8 @@ def get_ydl_opts_with_cookies(base_opts=None, cookies_data=None):
         'force_ipv4': True,  # 强制使用IPv4
         'socket_timeout': 30,  # 设置socket超时
         'retries': 3,  # 重试次数
+        # 重试之间指数退避，避免立即重试加重限流
+        'retry_sleep_functions': UPSTREAM_RETRY_SLEEP,
         'http_headers': {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         },
@@ -89,12 +332,9 @@ def get_ydl_opts_with_cookies(base_opts=None, cookies_data=None):
             browser = cookies_data.get('browser', 'chrome')
             ydl_opts['cookiesfrombrowser'] = (browser, None, None, None)
         elif cookies_data.get('cookies_text'):
-            # 使用cookies文本内容
+            # 使用cookies文本内容（相同内容共享同一个cookies文件）
             try:
-                # 创建临时cookies文件
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-                    f.write(cookies_data['cookies_text'])
-                    ydl_opts['cookiefile'] = f.name
+                ydl_opts['cookiefile'] = cookie_jars.acquire(cookies_data['cookies_text'])
             except Exception as e:
                 print(f"Warning: Failed to create cookies file: {e}")
         elif cookies_data.get('cookies_file'):
@@ -102,101 +342,2652 @@ def get_ydl_opts_with_cookies(base_opts=None, cookies_data=None):
             if os.path.exists(cookies_data['cookies_file']):
                 ydl_opts['cookiefile'] = cookies_data['cookies_file']
     else:
-        # 如果没有提供cookies_data，使用默认的YouTube cookies
+        # 如果没有提供cookies_data，从cookies池中轮换身份；所有身份都被隔离时不带cookies请求
+        identity = cookie_pool.checkout()
+        if identity:
+            name, cookies_text = identity
+            try:
+                ydl_opts['cookiefile'] = cookie_jars.acquire(cookies_text)
+                # 身份名称参与实例池的复用键，并用于报告提取结果
+                ydl_opts['cookie_identity'] = name
+            except Exception as e:
+                print(f"Warning: Failed to create pooled cookies file: {e}")
+    
+    return ydl_opts
+
+def release_cookiefile(ydl_opts):
+    """释放get_ydl_opts_with_cookies引用的cookies文件（用户自己的cookies文件不受影响）"""
+    cookiefile = ydl_opts.get('cookiefile')
+    if cookiefile:
+        cookie_jars.release(cookiefile)
+
+# cookies文件在引用计数归零后保留的空闲时间（秒）
+COOKIE_JAR_IDLE_TTL = int(os.environ.get('COOKIE_JAR_IDLE_TTL', 600))
+COOKIE_JAR_SWEEP_INTERVAL = 60
+
+class CookieJarManager:
+    """按内容哈希管理cookies文件
+
+    每种cookies内容只写入磁盘一次，在并发请求之间按引用计数共享，
+    引用归零并空闲超过idle_ttl后才删除，请求路径上不再创建和删除文件。
+    """
+
+    def __init__(self, idle_ttl):
+        self.idle_ttl = idle_ttl
+        # 每个进程使用独立的私有目录（权限0700）
+        self.directory = tempfile.mkdtemp(prefix='yt-dlp-api-cookies-')
+        self._jars = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.writes = 0
+        self.evictions = 0
+
+    def acquire(self, cookies_text):
+        """返回该cookies内容对应的文件路径并增加引用计数"""
+        digest = hashlib.sha256(cookies_text.encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, f'{digest}.txt')
+        with self._lock:
+            jar = self._jars.get(path)
+            if jar is None:
+                self._write(path, cookies_text)
+                jar = self._jars[path] = {'refs': 0, 'last_used': 0}
+                self.writes += 1
+            jar['refs'] += 1
+            jar['last_used'] = time.time()
+            self._maybe_sweep()
+        return path
+
+    def release(self, path):
+        """减少引用计数，不属于本管理器的路径直接忽略"""
+        with self._lock:
+            jar = self._jars.get(path)
+            if jar is not None:
+                jar['refs'] = max(jar['refs'] - 1, 0)
+                jar['last_used'] = time.time()
+
+    def owns(self, path):
+        return path in self._jars
+
+    def _write(self, path, cookies_text):
+        # 先写临时文件再原子替换，避免其他进程读到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(cookies_text)
+        os.replace(tmp_path, path)
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep < COOKIE_JAR_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for path, jar in list(self._jars.items()):
+            if jar['refs'] == 0 and now - jar['last_used'] > self.idle_ttl:
+                del self._jars[path]
+                self.evictions += 1
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        """返回cookies文件统计信息"""
+        with self._lock:
+            return {
+                'files': len(self._jars),
+                'in_use': sum(1 for jar in self._jars.values() if jar['refs']),
+                'refs': sum(jar['refs'] for jar in self._jars.values()),
+                'writes': self.writes,
+                'evictions': self.evictions
+            }
+
+cookie_jars = CookieJarManager(COOKIE_JAR_IDLE_TTL)
+atexit.register(cookie_jars.close)
+metrics.gauge('cookie_files', '存活的临时cookies文件数量', (), lambda: {(): cookie_jars.stats()['files']})
+
+# cookies池：目录中每个Netscape格式的cookies文件（*.txt）是一个身份，目录为空时使用内置的默认cookies
+COOKIE_POOL_DIR = os.environ.get('COOKIE_POOL_DIR', './cookies')
+# 重新扫描目录的间隔（秒），新增、修改和删除的文件无需重启即可生效
+COOKIE_POOL_RESCAN_INTERVAL = int(os.environ.get('COOKIE_POOL_RESCAN_INTERVAL', 30))
+# 健康分为提取结果的指数移动平均（成功1，被拦截0），低于MIN_HEALTH的身份只在没有更健康的身份时使用
+COOKIE_HEALTH_ALPHA = float(os.environ.get('COOKIE_HEALTH_ALPHA', 0.2))
+COOKIE_MIN_HEALTH = float(os.environ.get('COOKIE_MIN_HEALTH', 0.5))
+# 身份遇到机器人验证后的隔离时间（秒），连续被拦截时翻倍，直到上限
+COOKIE_QUARANTINE = float(os.environ.get('COOKIE_QUARANTINE', 900))
+COOKIE_MAX_QUARANTINE = float(os.environ.get('COOKIE_MAX_QUARANTINE', 6 * 3600))
+
+def is_netscape_cookies(cookies_text):
+    """至少包含一行7个字段的cookie记录"""
+    for line in cookies_text.splitlines():
+        if line.startswith('#HttpOnly_'):
+            line = line[len('#HttpOnly_'):]
+        if line and not line.startswith('#') and len(line.split('\t')) == 7:
+            return True
+    return False
+
+class CookieIdentity:
+    """cookies池中的一个身份及其健康统计"""
+
+    def __init__(self, name, cookies_text, mtime=None):
+        self.name = name
+        self.cookies_text = cookies_text
+        self.mtime = mtime
+        self.health = 1.0
+        self.last_used = 0.0
+        self.quarantined_until = 0.0
+        self.strikes = 0
+        self.uses = 0
+        self.successes = 0
+        self.bot_walls = 0
+        self.errors = 0
+        self.latency = None
+        self.last_bot_wall = None
+
+    def stats(self, now):
+        quarantine_remaining = max(0.0, self.quarantined_until - now)
+        return {
+            'name': self.name,
+            'state': 'quarantined' if quarantine_remaining else 'active',
+            'health': round(self.health, 3),
+            'quarantine_remaining': round(quarantine_remaining, 1),
+            'uses': self.uses,
+            'successes': self.successes,
+            'bot_walls': self.bot_walls,
+            'errors': self.errors,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'last_used': datetime.fromtimestamp(self.last_used).isoformat() if self.last_used else None,
+            'last_bot_wall': datetime.fromtimestamp(self.last_bot_wall).isoformat() if self.last_bot_wall else None
+        }
+
+class CookiePool:
+    """多身份cookies池：匿名请求按最久未使用的顺序轮换身份，优先使用健康分高的身份
+
+    遇到机器人验证的身份自动隔离一段时间，隔离结束后以最低健康分重新参与轮换。
+    方法只返回cookies内容、不涉及本地文件，因此可以通过任务进程在所有HTTP工作进程之间共享。
+    """
+
+    def __init__(self, directory, default_cookies):
+        self.directory = directory
+        self.default_cookies = default_cookies
+        self._identities = {}
+        self._lock = threading.Lock()
+        self._last_scan = 0.0
+        self.anonymous = 0
+        with self._lock:
+            self._scan()
+
+    def _scan(self):
+        """按文件修改时间增量加载目录，已有身份的健康统计保持不变"""
+        self._last_scan = time.time()
+        found = {}
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            names = []
+        for filename in names:
+            if not filename.endswith('.txt'):
+                continue
+            path = os.path.join(self.directory, filename)
+            name = filename[:-len('.txt')]
+            try:
+                mtime = os.path.getmtime(path)
+                identity = self._identities.get(name)
+                if identity is not None and identity.mtime == mtime:
+                    found[name] = identity
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    cookies_text = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Warning: Failed to load cookies file {path}: {e}")
+                continue
+            if not is_netscape_cookies(cookies_text):
+                print(f"Warning: {path} 不是Netscape格式的cookies文件，已跳过")
+                continue
+            if identity is None:
+                identity = CookieIdentity(name, cookies_text, mtime)
+            else:
+                # 文件更新后视为新的登录状态，解除隔离
+                identity.cookies_text = cookies_text
+                identity.mtime = mtime
+                identity.quarantined_until = 0.0
+                identity.strikes = 0
+                identity.health = max(identity.health, COOKIE_MIN_HEALTH)
+            found[name] = identity
+        if not found:
+            found['default'] = self._identities.get('default') or CookieIdentity('default', self.default_cookies)
+        self._identities = found
+
+    def checkout(self):
+        """选择本次请求使用的身份，返回(身份名称, cookies内容)；所有身份都被隔离时返回None"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_scan >= COOKIE_POOL_RESCAN_INTERVAL:
+                self._scan()
+            available = []
+            for identity in self._identities.values():
+                if identity.quarantined_until:
+                    if now < identity.quarantined_until:
+                        continue
+                    # 隔离结束，以最低健康分试用
+                    identity.quarantined_until = 0.0
+                    identity.health = max(identity.health, COOKIE_MIN_HEALTH)
+                available.append(identity)
+            if not available:
+                self.anonymous += 1
+                return None
+            available.sort(key=lambda identity: identity.last_used)
+            healthy = [identity for identity in available if identity.health >= COOKIE_MIN_HEALTH]
+            identity = healthy[0] if healthy else max(available, key=lambda identity: identity.health)
+            identity.last_used = now
+            identity.uses += 1
+            return identity.name, identity.cookies_text
+
+    def report(self, name, outcome, latency=None):
+        """报告身份的一次提取结果：ok、bot_wall或error（与身份无关的错误不影响健康分）"""
+        now = time.time()
+        with self._lock:
+            identity = self._identities.get(name)
+            if identity is None:
+                return
+            if latency is not None:
+                identity.latency = latency if identity.latency is None else (
+                    identity.latency + COOKIE_HEALTH_ALPHA * (latency - identity.latency))
+            if outcome == 'ok':
+                identity.successes += 1
+                identity.strikes = 0
+                identity.health += COOKIE_HEALTH_ALPHA * (1 - identity.health)
+            elif outcome == 'bot_wall':
+                identity.bot_walls += 1
+                identity.last_bot_wall = now
+                identity.health -= COOKIE_HEALTH_ALPHA * identity.health
+                quarantine = min(COOKIE_MAX_QUARANTINE, COOKIE_QUARANTINE * 2 ** identity.strikes)
+                identity.quarantined_until = max(identity.quarantined_until, now + quarantine)
+                identity.strikes += 1
+                print(f"cookies身份 {name} 遇到机器人验证，隔离{int(quarantine)}秒")
+            else:
+                identity.errors += 1
+
+    def stats(self):
+        """返回cookies池统计信息（只包含身份名称，不包含cookies内容）"""
+        now = time.time()
+        with self._lock:
+            identities = [identity.stats(now) for identity in self._identities.values()]
+            return {
+                'directory': self.directory,
+                'identities': len(identities),
+                'active': sum(1 for identity in identities if identity['state'] == 'active'),
+                'quarantined': sum(1 for identity in identities if identity['state'] == 'quarantined'),
+                'anonymous': self.anonymous,
+                'pool': identities
+            }
+
+def get_cookie_identity(ydl_opts):
+    """cookies池身份名称，调用方自带cookies时为None"""
+    return (ydl_opts or {}).get('cookie_identity')
+
+def report_cookie_identity(name, outcome, latency=None):
+    if name:
+        COOKIE_IDENTITY_RESULTS.inc(name, outcome)
+        cookie_pool.report(name, outcome, latency)
+
+def create_ydl(ydl_opts):
+    """创建YoutubeDL实例；共享的cookies文件只读取，不在退出时写回"""
+    # YoutubeDL可能直接持有传入的字典，复制一份以免修改调用方的选项
+    ydl = SegmentedYoutubeDL(dict(ydl_opts))
+    if cookie_jars.owns(ydl_opts.get('cookiefile')):
+        # 立即加载cookies后取消写回，避免并发请求同时改写同一个文件
+        ydl.cookiejar
+        ydl.params['cookiefile'] = None
+    return ydl
+
+# YoutubeDL实例池配置
+YDL_POOL_MAX_IDLE = int(os.environ.get('YDL_POOL_MAX_IDLE', 8))
+# 实例最长使用时间（秒）和最多使用次数，超过后回收重建
+YDL_POOL_MAX_AGE = int(os.environ.get('YDL_POOL_MAX_AGE', 1800))
+YDL_POOL_MAX_USES = int(os.environ.get('YDL_POOL_MAX_USES', 200))
+
+# 每次借出时单独设置、不参与实例复用键的选项
+PER_REQUEST_YDL_OPTS = ('progress_hooks', 'postprocessor_hooks')
+# 下载才使用的选项：每次下载的输出路径和后处理链都不同，yt-dlp在创建实例时就据此构建后处理器，
+# 带这些选项的实例无法复用，使用不入池的一次性实例，不占用池中提取实例的位置；
+# 只提取不下载时的format取值很少（如/api/stream的best），仍参与复用键
+DOWNLOAD_YDL_OPTS = ('outtmpl', 'paths', 'postprocessors', 'merge_output_format', 'final_ext',
+                     'segment_connections', 'external_downloader', 'download_ranges')
+
+class PooledYDL:
+    """池中的YoutubeDL实例，进度回调通过分发器按次挂载，无需重建实例"""
+
+    def __init__(self, key, ydl_opts):
+        self.key = key
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        opts = {k: v for k, v in ydl_opts.items() if k not in PER_REQUEST_YDL_OPTS}
+        opts['progress_hooks'] = [self._dispatch_progress]
+        opts['postprocessor_hooks'] = [self._dispatch_postprocessor]
+        self.ydl = create_ydl(opts)
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.uses = 0
+
+    def _dispatch_progress(self, d):
+        for hook in self.progress_hooks:
+            hook(d)
+
+    def _dispatch_postprocessor(self, d):
+        for hook in self.postprocessor_hooks:
+            hook(d)
+
+    def expired(self, now):
+        return now - self.created_at > YDL_POOL_MAX_AGE or self.uses >= YDL_POOL_MAX_USES
+
+    def close(self):
+        try:
+            self.ydl.__exit__(None, None, None)
+        except Exception:
+            pass
+
+class YDLPool:
+    """按有效选项复用预初始化的YoutubeDL实例
+
+    复用实例可以保留yt-dlp在实例上缓存的提取器对象和播放器签名等数据。
+    实例借出期间独占使用，归还后按LRU保留最多max_idle个空闲实例。
+    带下载选项的请求使用一次性实例，用完即关闭。
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+        self.discarded = 0
+        self.unpooled = 0
+
+    @staticmethod
+    def is_poolable(ydl_opts):
+        return not any(name in ydl_opts for name in DOWNLOAD_YDL_OPTS)
+
+    @staticmethod
+    def make_key(ydl_opts):
+        """由影响实例状态的选项（cookies身份、player_client等）生成复用键"""
+        opts = {k: v for k, v in ydl_opts.items() if k not in PER_REQUEST_YDL_OPTS}
+        return json.dumps(opts, sort_keys=True, default=repr)
+
+    def _checkout(self, key, pooled=True):
+        now = time.time()
+        with self._lock:
+            if not pooled:
+                self.unpooled += 1
+                self.in_use += 1
+                return None
+            for index in range(len(self._idle) - 1, -1, -1):
+                entry = self._idle[index]
+                if entry.key == key:
+                    del self._idle[index]
+                    if entry.expired(now):
+                        self.recycled += 1
+                        entry.close()
+                        continue
+                    self.reused += 1
+                    self.in_use += 1
+                    return entry
+            self.created += 1
+            self.in_use += 1
+        return None
+
+    def _checkin(self, entry, healthy, pooled=True):
+        entry.last_used = time.time()
+        evicted = []
+        with self._lock:
+            self.in_use -= 1
+            if not pooled:
+                evicted.append(entry)
+            elif not healthy or entry.expired(entry.last_used):
+                if healthy:
+                    self.recycled += 1
+                else:
+                    self.discarded += 1
+                evicted.append(entry)
+            else:
+                self._idle.append(entry)
+                while len(self._idle) > self.max_idle:
+                    evicted.append(self._idle.pop(0))
+                    self.recycled += 1
+        for old in evicted:
+            old.close()
+
+    @contextlib.contextmanager
+    def lease(self, ydl_opts):
+        """借出与选项匹配的实例，本次请求的进度回调只在借出期间生效"""
+        pooled = self.is_poolable(ydl_opts)
+        key = self.make_key(ydl_opts)
+        entry = self._checkout(key, pooled)
+        if entry is None:
+            try:
+                entry = PooledYDL(key, ydl_opts)
+            except BaseException:
+                with self._lock:
+                    self.in_use -= 1
+                raise
+        entry.progress_hooks = list(ydl_opts.get('progress_hooks') or [])
+        entry.postprocessor_hooks = list(ydl_opts.get('postprocessor_hooks') or [])
+        healthy = True
+        try:
+            yield entry.ydl
+        except (yt_dlp.utils.YoutubeDLError, UpstreamThrottled):
+            # 上游预算不足在发出请求之前就被拒绝，实例状态没有变化
+            raise
+        except BaseException:
+            # 非yt-dlp的异常说明实例状态可能已损坏，不再放回池中
+            healthy = False
+            raise
+        finally:
+            entry.progress_hooks = []
+            entry.postprocessor_hooks = []
+            entry.uses += 1
+            self._checkin(entry, healthy, pooled)
+
+    def stats(self):
+        """返回实例池统计信息"""
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'max_idle': self.max_idle,
+                'created': self.created,
+                'reused': self.reused,
+                'recycled': self.recycled,
+                'discarded': self.discarded,
+                'unpooled': self.unpooled
+            }
+
+ydl_pool = YDLPool(YDL_POOL_MAX_IDLE)
+
+# 提取结果缓存配置
+EXTRACT_CACHE_MAX_ENTRIES = int(os.environ.get('EXTRACT_CACHE_MAX_ENTRIES', 128))
+# 格式链接中没有expire参数时使用的默认TTL（秒）
+EXTRACT_CACHE_DEFAULT_TTL = int(os.environ.get('EXTRACT_CACHE_DEFAULT_TTL', 600))
+# 在链接过期前提前失效的安全余量（秒），保证返回给客户端的链接仍有可用时间
+EXTRACT_CACHE_EXPIRE_MARGIN = int(os.environ.get('EXTRACT_CACHE_EXPIRE_MARGIN', 300))
+
+# 匹配googlevideo链接中的expire参数（查询参数或manifest路径形式）
+EXPIRE_PARAM_RE = re.compile(r'[?&/]expire[=/](\d+)')
+
+def get_info_expire_timestamp(info):
+    """返回info中所有格式链接里最早的expire时间戳，没有则返回None"""
+    urls = [info.get('url')] + [f.get('url') for f in info.get('formats') or []]
+    expires = []
+    for url in urls:
+        if not url:
+            continue
+        match = EXPIRE_PARAM_RE.search(url)
+        if match:
+            expires.append(int(match.group(1)))
+    return min(expires) if expires else None
+
+def compute_info_ttl(info):
+    """根据格式链接的expire参数计算缓存TTL（秒）"""
+    expire = get_info_expire_timestamp(info)
+    if expire is None:
+        return EXTRACT_CACHE_DEFAULT_TTL
+    return expire - time.time() - EXTRACT_CACHE_EXPIRE_MARGIN
+
+class ExtractionCache:
+    """extract_info结果的进程内LRU缓存，条目在链接过期前失效
+
+    条目为[过期时间, info, 格式索引]；格式索引在第一次使用时建立，随条目一起释放。
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # id(info) -> 缓存键，用于按info对象找到其所在的条目
+        self._keys_by_info = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bypasses = 0
+
+    def get(self, key, record_stats=True):
+        """查找缓存条目，过期条目视为未命中"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if record_stats:
+                    self.misses += 1
+                return None
+            expires_at, info, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                if record_stats:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if record_stats:
+                self.hits += 1
+            return info
+
+    def put(self, key, info):
+        """写入缓存条目，超出容量时淘汰最久未使用的条目"""
+        ttl = compute_info_ttl(info)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = [time.time() + ttl, info, None]
+            self._keys_by_info[id(info)] = key
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, info, _ = self._entries.pop(key)
+        if self._keys_by_info.get(id(info)) == key:
+            del self._keys_by_info[id(info)]
+
+    def format_index(self, info):
+        """返回挂在info所在缓存条目上的格式索引，第一次使用时建立；info不在缓存中时返回None"""
+        with self._lock:
+            entry = self._entries.get(self._keys_by_info.get(id(info)))
+            if entry is None or entry[1] is not info:
+                return None
+            if entry[2] is not None:
+                return entry[2]
+        index = FormatIndex(info.get('formats'))
+        with self._lock:
+            # 并发建立时保留先写入的索引
+            if entry[2] is None:
+                entry[2] = index
+            return entry[2]
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'bypasses': self.bypasses
+            }
+
+extract_cache = ExtractionCache(EXTRACT_CACHE_MAX_ENTRIES)
+
+@functools.lru_cache(maxsize=1024)
+def resolve_extractor_identity(url):
+    """不发起网络请求，解析URL对应的提取器名称和规范视频ID"""
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.suitable(url):
+            try:
+                video_id = ie.get_temp_id(url)
+            except Exception:
+                video_id = None
+            return ie.ie_key(), video_id or url
+    return 'Generic', url
+
+# 出现这些错误信息说明被YouTube的机器人检测拦截
+BOT_WALL_MARKERS = ("not a bot", "Sign in to confirm", "HTTP Error 429")
+
+def classify_extract_error(error):
+    """把提取异常归类为bot_wall或error"""
+    message = str(error)
+    return 'bot_wall' if any(marker in message for marker in BOT_WALL_MARKERS) else 'error'
+
+# 这些错误说明上游在限流，需要降低请求速率（403在提取时通常也是被拦截）
+THROTTLE_MARKERS = BOT_WALL_MARKERS + ("HTTP Error 403",)
+
+def is_throttle_error(error):
+    message = str(error)
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+# 上游请求预算：每个(类型, 提取器, 出口)一个令牌桶，速率为每秒请求数，突发为桶容量
+GOVERNOR_EXTRACT_RATE = float(os.environ.get('GOVERNOR_EXTRACT_RATE', 2))
+GOVERNOR_EXTRACT_BURST = float(os.environ.get('GOVERNOR_EXTRACT_BURST', 10))
+GOVERNOR_MEDIA_RATE = float(os.environ.get('GOVERNOR_MEDIA_RATE', 50))
+GOVERNOR_MEDIA_BURST = float(os.environ.get('GOVERNOR_MEDIA_BURST', 100))
+# AIMD：被限流时速率乘以DECREASE并冷却，之后每次成功恢复基础速率的INCREASE比例
+GOVERNOR_DECREASE = float(os.environ.get('GOVERNOR_DECREASE', 0.5))
+GOVERNOR_INCREASE = float(os.environ.get('GOVERNOR_INCREASE', 0.05))
+GOVERNOR_MIN_RATE = float(os.environ.get('GOVERNOR_MIN_RATE', 0.05))
+# 被限流后的冷却时间（秒），连续被限流时翻倍，直到上限
+GOVERNOR_COOLDOWN = float(os.environ.get('GOVERNOR_COOLDOWN', 15))
+GOVERNOR_MAX_COOLDOWN = float(os.environ.get('GOVERNOR_MAX_COOLDOWN', 600))
+# 接口请求最多排队等待的时间（秒），超过则直接返回503和Retry-After；后台任务可以等待更久
+GOVERNOR_MAX_WAIT = float(os.environ.get('GOVERNOR_MAX_WAIT', 2))
+GOVERNOR_JOB_MAX_WAIT = float(os.environ.get('GOVERNOR_JOB_MAX_WAIT', 300))
+
+class UpstreamThrottled(Exception):
+    """上游请求预算不足，retry_after秒后再试"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'上游请求过于频繁，请{int(retry_after) + 1}秒后重试')
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """AIMD令牌桶：令牌可以预支为负数，排队的请求按预约顺序等待"""
+
+    def __init__(self, rate, burst):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.penalties = 0
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.last_throttled = None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait):
+        """预约一个令牌，返回需要等待的秒数；等待超过max_wait时不预约，返回None"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            self.rejected += 1
+            return None
+        self.tokens -= 1
+        self.granted += 1
+        return wait
+
+    def retry_after(self):
+        now = time.monotonic()
+        self._refill(now)
+        return max(0.0, self.blocked_until - now, (1 - self.tokens) / self.rate)
+
+    def penalize(self, retry_after=None):
+        """上游限流：乘性降低速率，清空令牌并冷却"""
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(GOVERNOR_MIN_RATE, self.rate * GOVERNOR_DECREASE)
+        self.tokens = min(self.tokens, 0.0)
+        cooldown = min(GOVERNOR_MAX_COOLDOWN, GOVERNOR_COOLDOWN * 2 ** self.penalties)
+        self.blocked_until = max(self.blocked_until, now + max(cooldown, retry_after or 0))
+        self.penalties += 1
+        self.throttled += 1
+        self.last_throttled = time.time()
+
+    def reward(self):
+        """请求成功：加性恢复速率，不超过基础速率"""
+        self.penalties = 0
+        if self.rate < self.base_rate:
+            self._refill(time.monotonic())
+            self.rate = min(self.base_rate, self.rate + self.base_rate * GOVERNOR_INCREASE)
+
+    def stats(self):
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            'rate': round(self.rate, 3),
+            'base_rate': self.base_rate,
+            'burst': self.burst,
+            'tokens': round(self.tokens, 2),
+            'cooldown_remaining': round(max(0.0, self.blocked_until - now), 1),
+            'granted': self.granted,
+            'rejected': self.rejected,
+            'throttled': self.throttled,
+            'last_throttled': datetime.fromtimestamp(self.last_throttled).isoformat() if self.last_throttled else None
+        }
+
+class UpstreamGovernor:
+    """上游请求调速器：按(类型, 提取器, 出口)分别限速，被限流时自适应退避
+
+    类型为extract（元数据提取）或media（媒体数据请求）。方法只做计数不等待，
+    等待由调用方完成，因此可以通过任务进程在所有HTTP工作进程之间共享。
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, kind, extractor, egress):
+        key = (kind, extractor, egress)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.limits[kind])
+        return bucket
+
+    def reserve(self, kind, extractor, egress, max_wait):
+        """返回(是否获得预算, 需要等待或建议重试的秒数)"""
+        with self._lock:
+            bucket = self._bucket(kind, extractor, egress)
+            wait = bucket.reserve(max_wait)
+            if wait is None:
+                return False, bucket.retry_after()
+            return True, wait
+
+    def report(self, kind, extractor, egress, throttled, retry_after=None):
+        """报告一次上游请求的结果"""
+        with self._lock:
+            bucket = self._bucket(kind, extractor, egress)
+            if throttled:
+                bucket.penalize(retry_after)
+            else:
+                bucket.reward()
+
+    def stats(self):
+        with self._lock:
+            return [
+                dict(bucket.stats(), kind=kind, extractor=extractor, egress=egress)
+                for (kind, extractor, egress), bucket in sorted(self._buckets.items())
+            ]
+
+def get_egress_identity(ydl_opts=None):
+    """出口身份：代理或绑定的源地址，不使用时为default；不包含代理的用户名和密码"""
+    ydl_opts = ydl_opts or {}
+    proxy = ydl_opts.get('proxy')
+    if proxy:
+        parts = urlsplit(proxy)
+        return f'{parts.scheme}://{parts.hostname}:{parts.port}' if parts.hostname else 'proxy'
+    return ydl_opts.get('source_address') or 'default'
+
+def acquire_upstream(kind, extractor, egress='default', max_wait=None, is_cancelled=None):
+    """占用一次上游请求预算，需要时排队等待；预算不足以在max_wait内获得时抛出UpstreamThrottled"""
+    max_wait = GOVERNOR_MAX_WAIT if max_wait is None else max_wait
+    granted, wait = upstream_governor.reserve(kind, extractor, egress, max_wait)
+    if not granted:
+        UPSTREAM_THROTTLED.inc(kind, extractor, 'rejected')
+        raise UpstreamThrottled(wait)
+    deadline = time.monotonic() + wait
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if is_cancelled and is_cancelled():
+            raise yt_dlp.utils.DownloadCancelled('任务已取消')
+        time.sleep(min(remaining, 1))
+
+def report_upstream(kind, extractor, egress, throttled, retry_after=None):
+    if throttled:
+        UPSTREAM_THROTTLED.inc(kind, extractor, 'throttled')
+    upstream_governor.report(kind, extractor, egress, throttled, retry_after)
+
+@contextlib.contextmanager
+def governed_upstream(kind, extractor, egress='default', max_wait=None, is_cancelled=None, cookie_identity=None):
+    """在上游预算内执行请求；抛出限流类错误时降低该上游的速率，成功时逐步恢复
+
+    传入cookie_identity时同时向cookies池报告该身份的结果。
+    """
+    acquire_upstream(kind, extractor, egress, max_wait, is_cancelled)
+    try:
+        yield
+    except Exception as e:
+        if is_throttle_error(e):
+            report_upstream(kind, extractor, egress, True)
+        if not isinstance(e, yt_dlp.utils.DownloadCancelled):
+            report_cookie_identity(cookie_identity, classify_extract_error(e))
+        raise
+    else:
+        report_upstream(kind, extractor, egress, False)
+        report_cookie_identity(cookie_identity, 'ok')
+
+def throttled_response(error):
+    response = jsonify({'error': str(error), 'retry_after': int(error.retry_after) + 1})
+    response.headers['Retry-After'] = str(int(error.retry_after) + 1)
+    return response, 503
+
+def timed_extract_info(ydl, url, max_wait=None, is_cancelled=None, **kwargs):
+    """在上游预算内调用ydl.extract_info，并按提取器和结果记录耗时"""
+    extractor = kwargs.get('ie_key') or resolve_extractor_identity(url)[0]
+    with governed_upstream('extract', extractor, get_egress_identity(ydl.params), max_wait, is_cancelled):
+        started = time.perf_counter()
+        outcome = 'ok'
         try:
-            # 创建临时cookies文件使用默认cookies
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-                f.write(DEFAULT_YOUTUBE_COOKIES)
-                ydl_opts['cookiefile'] = f.name
-            print("Using default YouTube cookies for authentication")
+            return ydl.extract_info(url, **kwargs)
         except Exception as e:
-            print(f"Warning: Failed to create default cookies file: {e}")
+            outcome = classify_extract_error(e)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            EXTRACT_DURATION.observe(duration, extractor, outcome)
+            report_cookie_identity(get_cookie_identity(ydl.params), outcome, duration)
+
+def get_cookie_fingerprint(cookies_data):
+    """计算cookies配置的身份指纹，使不同登录身份的提取结果互不共享"""
+    if not cookies_data:
+        payload = 'default:' + DEFAULT_YOUTUBE_COOKIES
+    elif cookies_data.get('use_browser'):
+        payload = 'browser:' + cookies_data.get('browser', 'chrome')
+    elif cookies_data.get('cookies_text'):
+        payload = 'text:' + cookies_data['cookies_text']
+    elif cookies_data.get('cookies_file'):
+        cookies_file = cookies_data['cookies_file']
+        try:
+            mtime = os.path.getmtime(cookies_file)
+        except OSError:
+            mtime = None
+        payload = f'file:{cookies_file}:{mtime}'
+    else:
+        payload = 'none'
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def get_cache_mode():
+    """从查询参数或JSON请求体读取缓存模式（cache=bypass跳过缓存读取）"""
+    cache_mode = request.args.get('cache')
+    if cache_mode is None and request.method == 'POST':
+        cache_mode = (request.get_json(silent=True) or {}).get('cache')
+    return cache_mode
+
+class InFlightCall:
+    """进行中的一次调用，等待者共享其结果或异常"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.callers = 1
+        self.started_at = time.time()
+
+class SingleFlight:
+    """合并同一键的并发调用：只执行一次，其余调用者等待并共享结果"""
+
+    def __init__(self, history_size=50):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.flights = 0
+        self.coalesced = 0
+        self.max_callers = 0
+        # 最近完成的调用及其合并的调用者数量
+        self.recent = deque(maxlen=history_size)
+
+    def do(self, key, fn):
+        """执行fn，或等待同一键上进行中的调用；返回(结果, 是否为共享结果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = InFlightCall()
+            else:
+                call.callers += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.flights += 1
+                self.coalesced += call.callers - 1
+                self.max_callers = max(self.max_callers, call.callers)
+                self.recent.append({
+                    'key': ':'.join(str(part) for part in key),
+                    'callers': call.callers,
+                    'duration': round(time.time() - call.started_at, 3),
+                    'ok': call.error is None
+                })
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        """返回合并统计信息"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'flights': self.flights,
+                'coalesced_callers': self.coalesced,
+                'max_callers': self.max_callers,
+                'recent': list(self.recent)
+            }
+
+extract_flights = SingleFlight()
+
+def extract_info_cached(url, cookies_data=None, cache_mode=None):
+    """带缓存和并发合并的extract_info，返回(info, 缓存状态HIT/MISS/BYPASS/COALESCED)"""
+    extractor, video_id = resolve_extractor_identity(url)
+    cache_key = (extractor, video_id, get_cookie_fingerprint(cookies_data))
     
-    return ydl_opts
+    if cache_mode == 'bypass':
+        extract_cache.record_bypass()
+        cache_status = 'BYPASS'
+    else:
+        info = extract_cache.get(cache_key)
+        if info is not None:
+            return info, 'HIT'
+        cache_status = 'MISS'
+    
+    def extract():
+        # 上一次合并调用可能刚刚写入缓存
+        if cache_mode != 'bypass':
+            cached = extract_cache.get(cache_key, record_stats=False)
+            if cached is not None:
+                return cached
+        
+        base_opts = {
+            'quiet': True,
+            'no_warnings': True,
+        }
+        ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
+        try:
+            with ydl_pool.lease(ydl_opts) as ydl:
+                info = timed_extract_info(ydl, url, download=False)
+        finally:
+            # 释放cookies文件
+            release_cookiefile(ydl_opts)
+        
+        # 在释放合并调用之前写入缓存，避免后来者重复提取
+        if info:
+            extract_cache.put(cache_key, info)
+        return info
+    
+    info, shared = extract_flights.do(cache_key, extract)
+    return info, 'COALESCED' if shared else cache_status
+
+# 任务事件推送配置
+SSE_HEARTBEAT_INTERVAL = int(os.environ.get('SSE_HEARTBEAT_INTERVAL', 15))
+# 下载进度最多每隔PROGRESS_MIN_INTERVAL秒或每变化PROGRESS_MIN_PERCENT个百分点发布一次
+PROGRESS_MIN_INTERVAL = float(os.environ.get('PROGRESS_MIN_INTERVAL', 0.25))
+PROGRESS_MIN_PERCENT = float(os.environ.get('PROGRESS_MIN_PERCENT', 1.0))
+# 每个工作进程同时打开的推送连接（SSE和转录NDJSON流）上限：gthread下每个推送连接一直占用一个线程，
+# 默认最多占用一半线程（WEB_THREADS），其余线程留给普通请求
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', max(int(os.environ.get('WEB_THREADS', 8)) // 2, 1)))
+# 单个推送连接的最长时长（秒），到期后关闭，客户端重新连接后从当前状态继续
+SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', 300))
+
+class TaskSubscription:
+    """一个SSE连接的订阅，只保留每个任务的最新状态，慢客户端不会积压事件"""
+
+    def __init__(self, task_ids=None):
+        self.task_ids = task_ids
+        self._pending = {}
+        self._cond = threading.Condition()
+
+    def wants(self, task_id):
+        return self.task_ids is None or task_id in self.task_ids
+
+    def push(self, task_id, task):
+        with self._cond:
+            self._pending[task_id] = task
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """等待并取出待发送的任务状态，超时返回空字典"""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            pending, self._pending = self._pending, {}
+        return pending
+
+class TaskEventBus:
+    """把任务状态变化推送给订阅者"""
+
+    def __init__(self):
+        # 写时复制的订阅者元组，发布时无需加锁
+        self._subscribers = ()
+        self._lock = threading.Lock()
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, task_ids=None):
+        subscription = TaskSubscription(task_ids)
+        with self._lock:
+            self._subscribers = self._subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+
+    def publish(self, task_id, task):
+        for subscription in self._subscribers:
+            if subscription.wants(task_id):
+                subscription.push(task_id, task)
+
+    def stats(self):
+        return {'subscribers': len(self._subscribers)}
+
+class StreamSlots:
+    """推送连接计数：超过上限时拒绝新连接，避免长连接占满工作线程"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'active': self.active, 'rejected': self.rejected}
+
+# 按工作进程计数，不经过任务进程
+stream_slots = StreamSlots(SSE_MAX_STREAMS)
+
+# 任务存储配置
+TASK_DB_PATH = os.environ.get('TASK_DB_PATH', './tasks.db')
+# 已结束任务的保留时间（秒），超时后被清理
+TASK_TTL = int(os.environ.get('TASK_TTL', 7 * 24 * 3600))
+# 内存中的任务变更批量写回SQLite的间隔（秒）
+TASK_FLUSH_INTERVAL = float(os.environ.get('TASK_FLUSH_INTERVAL', 1.0))
+TASK_PRUNE_INTERVAL = int(os.environ.get('TASK_PRUNE_INTERVAL', 600))
+
+ACTIVE_TASK_STATUSES = ('queued', 'downloading', 'cancelling')
+FINISHED_TASK_STATUSES = ('completed', 'error', 'cancelled')
+
+class TaskStore:
+    """SQLite（WAL模式）持久化的任务存储
+
+    活跃任务常驻内存，进度更新只修改内存并标记为脏数据，
+    由后台线程批量写回数据库，进度回调不会阻塞在磁盘IO上。
+    """
+
+    def __init__(self, db_path, ttl):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._hot = {}
+        self._dirty = set()
+        self._deleted = set()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._flusher = None
+        self._last_prune = 0
+        
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+            CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at);
+        """)
+        self._conn.commit()
+        self._recover_interrupted()
+
+    def _recover_interrupted(self):
+        # 上次进程退出时仍在进行的任务已无法继续，标记为错误
+        with self._db_lock:
+            placeholders = ','.join('?' * len(ACTIVE_TASK_STATUSES))
+            rows = self._conn.execute(
+                f'SELECT task_id, data FROM tasks WHERE status IN ({placeholders})',
+                ACTIVE_TASK_STATUSES
+            ).fetchall()
+            for task_id, data in rows:
+                task = json.loads(data)
+                task['status'] = 'error'
+                task['error'] = '服务重启，任务已中断'
+                self._conn.execute(
+                    'UPDATE tasks SET status = ?, updated_at = ?, data = ? WHERE task_id = ?',
+                    ('error', time.time(), json.dumps(task), task_id)
+                )
+            self._conn.commit()
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='task-store-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(TASK_FLUSH_INTERVAL)
+            try:
+                self.flush()
+                if time.time() - self._last_prune >= TASK_PRUNE_INTERVAL:
+                    self.prune()
+            except Exception as e:
+                print(f"任务存储写回失败: {e}")
+
+    def _load(self, task_id):
+        with self._db_lock:
+            row = self._conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create(self, task_id, task):
+        """创建任务"""
+        with self._lock:
+            self._hot[task_id] = task
+            self._dirty.add(task_id)
+            self._deleted.discard(task_id)
+            self._ensure_flusher()
+            snapshot = dict(task) if task_events.has_subscribers() else None
+        if snapshot is not None:
+            task_events.publish(task_id, snapshot)
+
+    def get(self, task_id):
+        """返回任务的副本，不存在返回None"""
+        with self._lock:
+            task = self._hot.get(task_id)
+            if task is not None:
+                return dict(task)
+            if task_id in self._deleted:
+                return None
+        return self._load(task_id)
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+    def update(self, task_id, transient=None, **fields):
+        """更新任务字段（只修改内存，稍后批量写回）
+
+        transient中的字段只推送给订阅者，不写入任务行。
+        """
+        with self._lock:
+            task = self._hot.get(task_id)
+            if task is None:
+                task = self._load(task_id)
+                if task is None:
+                    return
+                self._hot[task_id] = task
+            task.update(fields)
+            self._dirty.add(task_id)
+            snapshot = dict(task, **(transient or {})) if task_events.has_subscribers() else None
+        if snapshot is not None:
+            task_events.publish(task_id, snapshot)
+
+    def delete(self, task_id):
+        """删除任务"""
+        with self._lock:
+            self._hot.pop(task_id, None)
+            self._dirty.discard(task_id)
+            self._deleted.add(task_id)
+
+    def flush(self):
+        """把脏数据批量写回数据库，并从内存中移出已结束的任务"""
+        with self._lock:
+            now = time.time()
+            rows = [
+                (task_id, task['status'], task['created_at'], now, json.dumps(task))
+                for task_id, task in ((task_id, self._hot[task_id]) for task_id in self._dirty)
+            ]
+            deleted = [(task_id,) for task_id in self._deleted]
+            self._dirty.clear()
+            self._deleted.clear()
+        
+        if rows or deleted:
+            with self._db_lock:
+                self._conn.executemany('INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?)', rows)
+                self._conn.executemany('DELETE FROM tasks WHERE task_id = ?', deleted)
+                self._conn.commit()
+        
+        with self._lock:
+            for task_id, status, _, _, _ in rows:
+                if status in FINISHED_TASK_STATUSES and task_id not in self._dirty:
+                    self._hot.pop(task_id, None)
+
+    def prune(self):
+        """删除超过保留时间的已结束任务"""
+        self._last_prune = time.time()
+        placeholders = ','.join('?' * len(FINISHED_TASK_STATUSES))
+        with self._db_lock:
+            cursor = self._conn.execute(
+                f'DELETE FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?',
+                FINISHED_TASK_STATUSES + (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def query(self, status=None, since=None, limit=50, offset=0):
+        """按状态和创建时间分页查询任务，返回(任务列表, 匹配总数)"""
+        self.flush()
+        conditions = []
+        params = []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if since:
+            conditions.append('created_at >= ?')
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._db_lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM tasks {where}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT task_id, data FROM tasks {where} ORDER BY created_at DESC LIMIT ? OFFSET ?',
+                params + [limit, offset]
+            ).fetchall()
+        return [(task_id, json.loads(data)) for task_id, data in rows], total
+
+    def stats(self):
+        """返回内存中的任务数量"""
+        with self._lock:
+            return {
+                'hot': len(self._hot),
+                'dirty': len(self._dirty)
+            }
+
+def build_progress(d):
+    """从yt-dlp进度回调中提取任务进度字段"""
+    downloaded = d.get('downloaded_bytes', 0)
+    total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+    progress = {
+        'downloaded_bytes': downloaded,
+        'total_bytes': d.get('total_bytes', 0),
+        'speed': d.get('speed', 0),
+        'eta': d.get('eta', 0),
+        'percent': round(downloaded * 100 / total, 1) if total else None
+    }
+    if d.get('segments_total'):
+        # 多连接分段下载：连接数、已完成分段数和进行中分段的进度
+        progress.update({name: d[name] for name in ('connections', 'segments_done', 'segments_total', 'segments')})
+    elif d.get('fragment_count'):
+        progress.update(fragment_index=d.get('fragment_index'), fragment_count=d['fragment_count'])
+    return progress
+
+def progress_hook_with_task_id(d, task_id):
+    """带任务ID的进度回调函数（只更新内存，不直接写盘）"""
+    if not task_id:
+        return
+    if d['status'] == 'downloading':
+        task_store.update(task_id, status='downloading', progress=build_progress(d))
+    elif d['status'] == 'finished':
+        # 单个文件下载完成后可能还有合并/后处理，最终状态由download_video设置；
+        # 节流可能跳过了最后几次downloading回调，这里用完成时的数据刷新进度
+        if d.get('downloaded_bytes') is not None:
+            task_store.update(task_id, filename=d.get('filename'), progress=build_progress(d))
+        else:
+            task_store.update(task_id, filename=d.get('filename'))
+
+class ProgressThrottle:
+    """合并高频进度回调，按时间间隔或百分比变化发布
+
+    每个下载任务一个实例，只在该任务的下载线程中调用，无需加锁。
+    """
+
+    def __init__(self, task_id, artifact_id=None):
+        self.task_id = task_id
+        self.artifact_id = artifact_id
+        self._last_time = 0
+        self._last_percent = None
+
+    def __call__(self, d):
+        if d['status'] == 'downloading':
+            now = time.time()
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            percent = d.get('downloaded_bytes', 0) * 100 / total if total else None
+            due = now - self._last_time >= PROGRESS_MIN_INTERVAL
+            if not due and percent is not None and self._last_percent is not None:
+                due = abs(percent - self._last_percent) >= PROGRESS_MIN_PERCENT
+            if not due:
+                return
+            self._last_time = now
+            self._last_percent = percent
+        # 同一产物的所有任务共享这一次下载的进度
+        task_ids = download_store.tasks(self.artifact_id) if self.artifact_id else [self.task_id]
+        for task_id in task_ids:
+            progress_hook_with_task_id(d, task_id)
+
+class PostprocessorTimer:
+    """后处理回调：记录每个后处理器（ffmpeg合并/转码等）的耗时"""
+
+    def __init__(self):
+        self._started = {}
+
+    def __call__(self, d):
+        name = d.get('postprocessor') or 'unknown'
+        if d.get('status') == 'started':
+            self._started[name] = time.perf_counter()
+        elif d.get('status') == 'finished' and name in self._started:
+            POSTPROCESSOR_DURATION.observe(time.perf_counter() - self._started.pop(name), name)
+
+# 分段下载：每个任务默认的并行连接数和所有任务共用的连接上限（连接数小于2时使用yt-dlp原有的单连接下载）
+DOWNLOAD_CONNECTIONS = int(os.environ.get('DOWNLOAD_CONNECTIONS', 4))
+DOWNLOAD_MAX_CONNECTIONS = int(os.environ.get('DOWNLOAD_MAX_CONNECTIONS', 16))
+# 分段大小：逐段分配给空闲连接，慢连接不会拖住整个文件；小于两段的文件不分段
+DOWNLOAD_SEGMENT_SIZE = int(os.environ.get('DOWNLOAD_SEGMENT_SIZE', 8 * 1024 * 1024))
+DOWNLOAD_SEGMENT_CHUNK = 256 * 1024
+
+class ConnectionBudget:
+    """全局下载连接上限：任务按请求的连接数尽量分配，剩余不足2个时退回单连接下载（不占用预算）"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.segmented = 0
+        self.fallbacks = 0
+
+    def acquire(self, requested):
+        """返回分配到的连接数，不足2个时返回0"""
+        with self._lock:
+            granted = min(requested, self.limit - self.in_use)
+            if granted < 2:
+                self.fallbacks += 1
+                return 0
+            self.in_use += granted
+            self.segmented += 1
+            return granted
+
+    def release(self, granted):
+        with self._lock:
+            self.in_use -= granted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'segmented': self.segmented,
+                'fallbacks': self.fallbacks
+            }
+
+class SegmentedHttpFD(HttpFD):
+    """多连接分段下载单文件格式：预先分配完整文件，各连接按Range请求分段并写入各自的位置
+
+    进度回调只在调用download的线程中触发（取消检查会在回调中抛出异常），分段线程只更新计数。
+    不满足条件（体积未知、文件太小、限速、上游不支持Range）时退回HttpFD。
+    """
+
+    def real_download(self, filename, info_dict):
+        connections = self.params.get('segment_connections') or 1
+        if connections < 2 or self.params.get('ratelimit') or self.params.get('test'):
+            return super().real_download(filename, info_dict)
+        headers = dict(info_dict.get('http_headers') or {})
+        extractor = info_dict.get('extractor_key') or 'Generic'
+        egress = get_egress_identity(self.params)
+        size = info_dict.get('filesize') or self._probe_size(info_dict['url'], headers, extractor, egress)
+        if not size or size < DOWNLOAD_SEGMENT_SIZE * 2:
+            return super().real_download(filename, info_dict)
+        
+        tmpfilename = self.temp_name(filename)
+        self.report_destination(filename)
+        with open(tmpfilename, 'wb') as f:
+            f.truncate(size)
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    # 预先分配磁盘空间，空间不足时在开始前失败，文件也不会碎片化
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except OSError:
+                    pass
+        
+        segments = [(start, min(start + DOWNLOAD_SEGMENT_SIZE, size) - 1) for start in range(0, size, DOWNLOAD_SEGMENT_SIZE)]
+        downloaded = [0] * len(segments)
+        pending = iter(range(len(segments)))
+        pending_lock = threading.Lock()
+        stop = threading.Event()
+        
+        def next_segment():
+            with pending_lock:
+                return next(pending, None)
+        
+        retries = self.params.get('retries') or 0
+        
+        def fetch_segment(index):
+            start, end = segments[index]
+            for attempt in range(retries, -1, -1):
+                offset = start + downloaded[index]
+                try:
+                    response = self._request_range(info_dict['url'], headers, offset, end, extractor, egress, stop.is_set)
+                    with response, open(tmpfilename, 'r+b') as f:
+                        f.seek(offset)
+                        for chunk in response.iter_content(DOWNLOAD_SEGMENT_CHUNK):
+                            if stop.is_set():
+                                return
+                            f.write(chunk)
+                            downloaded[index] += len(chunk)
+                    if start + downloaded[index] > end:
+                        return
+                    raise yt_dlp.utils.DownloadError('分段数据不完整')
+                except (requests.RequestException, yt_dlp.utils.DownloadError) as e:
+                    if not attempt or stop.is_set():
+                        raise
+                    self.to_screen(f'[download] 分段{index}下载失败，重试（剩余{attempt}次）: {e}')
+                    time.sleep(min(2 ** (retries - attempt), 30))
+        
+        def worker():
+            while not stop.is_set():
+                index = next_segment()
+                if index is None:
+                    return
+                fetch_segment(index)
+        
+        started = time.time()
+        executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix='segment')
+        futures = [executor.submit(worker) for _ in range(connections)]
+        running = set(futures)
+        try:
+            while True:
+                # 只等待仍在运行的连接，已结束的连接不会让循环空转
+                done, running = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # 分段重试耗尽时立即失败
+                    future.result()
+                elapsed = time.time() - started
+                total_downloaded = sum(downloaded)
+                speed = total_downloaded / elapsed if elapsed else None
+                self._hook_progress({
+                    'status': 'downloading',
+                    'filename': filename,
+                    'tmpfilename': tmpfilename,
+                    'downloaded_bytes': total_downloaded,
+                    'total_bytes': size,
+                    'speed': speed,
+                    'eta': int((size - total_downloaded) / speed) if speed else None,
+                    'elapsed': elapsed,
+                    'connections': connections,
+                    'segments_total': len(segments),
+                    'segments_done': sum(1 for index, (start, end) in enumerate(segments)
+                                         if downloaded[index] > end - start),
+                    'segments': [
+                        {'index': index, 'downloaded': downloaded[index], 'size': end - start + 1}
+                        for index, (start, end) in enumerate(segments) if 0 < downloaded[index] <= end - start
+                    ]
+                }, info_dict)
+                if not running:
+                    break
+        except BaseException:
+            stop.set()
+            executor.shutdown(wait=True)
+            try:
+                os.unlink(tmpfilename)
+            except OSError:
+                pass
+            raise
+        executor.shutdown(wait=True)
+        
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            'status': 'finished',
+            'filename': filename,
+            'downloaded_bytes': size,
+            'total_bytes': size,
+            'elapsed': time.time() - started,
+            'connections': connections,
+            'segments_total': len(segments),
+            'segments_done': len(segments),
+            'segments': []
+        }, info_dict)
+        return True
+
+    def _request_range(self, url, headers, start, end, extractor, egress, is_cancelled=None):
+        """发起一次Range请求：占用媒体请求预算，使用与下载相同的代理和超时，并确认上游返回的正是请求的区间"""
+        acquire_upstream('media', extractor, egress, GOVERNOR_JOB_MAX_WAIT, is_cancelled)
+        proxy = self.params.get('proxy')
+        response = download_session.get(
+            url, headers=dict(headers, Range=f'bytes={start}-{end}'), stream=True,
+            timeout=self.params.get('socket_timeout') or STREAM_UPSTREAM_TIMEOUT,
+            proxies={'http': proxy, 'https': proxy} if proxy else None)
+        report_upstream('media', extractor, egress, response.status_code == 429)
+        if response.status_code != 206:
+            response.close()
+            raise yt_dlp.utils.DownloadError(f'分段请求返回HTTP {response.status_code}')
+        # 上游返回的起始位置与请求不一致时写入的数据会错位
+        match = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+        if not match or int(match.group(1)) != start:
+            response.close()
+            raise yt_dlp.utils.DownloadError(f'分段请求返回的Content-Range与请求的起始位置{start}不一致')
+        return response
+
+    def _probe_size(self, url, headers, extractor, egress):
+        """用1字节的Range请求确认上游支持分段并读取文件总大小"""
+        try:
+            with self._request_range(url, headers, 0, 0, extractor, egress) as response:
+                total = response.headers['Content-Range'].rsplit('/', 1)[1]
+                return int(total) if total != '*' else None
+        except (requests.RequestException, yt_dlp.utils.DownloadError, ValueError):
+            pass
+        return None
+
+class SegmentedYoutubeDL(yt_dlp.YoutubeDL):
+    """设置了segment_connections时，单文件格式使用多连接分段下载，DASH/HLS分片按同样的连接数并发下载
+
+    连接数在每个文件真正开始下载时从全局连接预算中分配，下载结束后归还。
+    """
+
+    def dl(self, name, info, subtitle=False, test=False):
+        requested = self.params.get('segment_connections') or 1
+        if requested < 2 or subtitle or test or name == '-' or not info.get('url'):
+            return super().dl(name, info, subtitle, test)
+        fd_class = get_suitable_downloader(info, self.params)
+        if fd_class is not HttpFD and not (fd_class and issubclass(fd_class, FragmentFD)):
+            return super().dl(name, info, subtitle, test)
+        granted = connection_budget.acquire(requested)
+        if not granted:
+            return super().dl(name, info, subtitle, test)
+        try:
+            if fd_class is HttpFD:
+                fd = SegmentedHttpFD(self, dict(self.params, segment_connections=granted))
+            else:
+                fd = fd_class(self, dict(self.params, concurrent_fragment_downloads=granted))
+            for hook in self._progress_hooks:
+                fd.add_progress_hook(hook)
+            new_info = self._copy_infodict(info)
+            if new_info.get('http_headers') is None:
+                new_info['http_headers'] = self._calc_headers(new_info)
+            return fd.download(name, new_info, subtitle)
+        finally:
+            connection_budget.release(granted)
+
+connection_budget = ConnectionBudget(DOWNLOAD_MAX_CONNECTIONS)
+
+def get_download_connections(data):
+    """读取请求体中的connections（每个任务的并行连接数），不超过全局上限"""
+    connections = data.get('connections')
+    if connections is None:
+        return DOWNLOAD_CONNECTIONS
+    try:
+        connections = int(connections)
+    except (TypeError, ValueError):
+        raise ValueError('connections必须是整数')
+    if connections < 1:
+        raise ValueError('connections必须大于0')
+    return min(connections, DOWNLOAD_MAX_CONNECTIONS)
+
+# 同时运行的ffmpeg进程上限（转码、封装转换、合并和转录预处理共用）
+FFMPEG_MAX_PROCESSES = int(os.environ.get('FFMPEG_MAX_PROCESSES', os.cpu_count() or 2))
+
+class FFmpegLimiter:
+    """全局ffmpeg并发限制：超过上限的任务排队等待空位，不再同时抢占CPU"""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self._semaphore = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.started = 0
+
+    def acquire(self, is_cancelled=None):
+        """等待一个空位；等待期间任务被取消时抛出DownloadCancelled"""
+        with self._lock:
+            self.waiting += 1
+        try:
+            while not self._semaphore.acquire(timeout=1):
+                if is_cancelled and is_cancelled():
+                    raise yt_dlp.utils.DownloadCancelled('任务已取消')
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.running += 1
+            self.started += 1
+
+    def try_acquire(self):
+        """不等待，没有空位时返回False（实时转码不排队）"""
+        if not self._semaphore.acquire(blocking=False):
+            return False
+        with self._lock:
+            self.running += 1
+            self.started += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.running -= 1
+        self._semaphore.release()
+
+    @contextlib.contextmanager
+    def slot(self, is_cancelled=None):
+        self.acquire(is_cancelled)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {'slots': self.slots, 'running': self.running, 'waiting': self.waiting, 'started': self.started}
+
+class FFmpegSlotHook:
+    """后处理回调：ffmpeg后处理器开始前占用一个空位，结束后释放
+
+    后处理器出错时yt-dlp不会触发finished回调，下载结束时需调用release()归还空位。
+    """
+
+    def __init__(self, limiter, is_cancelled=None):
+        self.limiter = limiter
+        self.is_cancelled = is_cancelled
+        self.held = False
+
+    def __call__(self, d):
+        if not (d.get('postprocessor') or '').startswith('FFmpeg'):
+            return
+        if d.get('status') == 'started' and not self.held:
+            self.limiter.acquire(self.is_cancelled)
+            self.held = True
+        elif d.get('status') == 'finished':
+            self.release()
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.limiter.release()
+
+# 去重下载存储：每个产物一个目录，目录名由产物键的哈希决定
+DOWNLOAD_STORE_DIR = os.path.join(DOWNLOAD_DIR, 'store')
+ARTIFACT_MANIFEST = 'artifact.json'
+# 不影响下载产物内容的选项，不参与产物键计算
+NON_ARTIFACT_OPTIONS = frozenset((
+    'outtmpl', 'paths', 'quiet', 'no_warnings', 'noprogress', 'verbose', 'ratelimit', 'throttledratelimit',
+    'retries', 'fragment_retries', 'socket_timeout', 'concurrent_fragment_downloads', 'http_chunk_size',
+    'proxy', 'source_address', 'cookiefile', 'cookiesfrombrowser', 'progress_hooks', 'postprocessor_hooks',
+    'segment_connections'
+))
+
+# 下载存储的容量上限（MB，0表示不限制）；超过高水位时在后台按最近访问时间淘汰到低水位
+DOWNLOAD_QUOTA_MB = int(os.environ.get('DOWNLOAD_QUOTA_MB', 2048))
+DOWNLOAD_HIGH_WATERMARK = float(os.environ.get('DOWNLOAD_HIGH_WATERMARK', 0.9))
+DOWNLOAD_LOW_WATERMARK = float(os.environ.get('DOWNLOAD_LOW_WATERMARK', 0.75))
+STORAGE_SWEEP_INTERVAL = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 60))
+
+def touch_artifact(artifact_id):
+    """记录产物被访问（清单文件的修改时间即最近访问时间）"""
+    try:
+        os.utime(os.path.join(DOWNLOAD_STORE_DIR, artifact_id, ARTIFACT_MANIFEST))
+    except OSError:
+        pass
+
+def select_formats(info, format_spec=None):
+    """按yt-dlp的格式选择规则解析格式表达式，返回实际会下载的格式列表（合并下载时为多个），无法解析时返回空列表"""
+    formats = info.get('formats') or ([info] if info.get('url') else [])
+    if not formats:
+        return []
+    try:
+        with ydl_pool.lease({'quiet': True, 'no_warnings': True}) as ydl:
+            selector = ydl.build_format_selector(format_spec or ydl._default_format_spec(info))
+            # 与yt-dlp的process_video_result构造的选择上下文一致
+            selected = next(iter(selector({
+                'formats': formats,
+                'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+                'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                                       or all(f.get('acodec') == 'none' for f in formats)),
+            })), None)
+    except Exception:
+        return []
+    if selected is None:
+        return []
+    return selected.get('requested_formats') or [selected]
+
+def get_artifact_id(url, options=None, info=None):
+    """计算下载产物ID：提取器 + 视频ID + 实际下载的格式 + 后处理链及其他影响输出的选项
+
+    提供info时按解析后的格式ID计算，best、bv*+ba和显式的格式ID选中同一格式时共用一个产物；
+    没有info或无法解析时退回请求的格式表达式。
+    """
+    extractor, video_id = resolve_extractor_identity(url)
+    options = options or {}
+    selected = select_formats(info, options.get('format')) if info else []
+    key = {
+        'extractor': extractor,
+        'id': video_id,
+        'format': '+'.join(str(f.get('format_id')) for f in selected) if selected else options.get('format') or 'default',
+        'postprocessors': options.get('postprocessors') or [],
+        'options': {name: value for name, value in options.items()
+                    if name not in NON_ARTIFACT_OPTIONS and name not in ('format', 'postprocessors')}
+    }
+    payload = json.dumps(key, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+class DownloadStore:
+    """按产物ID去重的下载存储
+
+    已完成的产物由目录中的清单文件记录，重复请求直接完成；
+    下载中的产物记录附着的任务，后来的请求附着到进行中的下载，不再重复传输。
+    配置了容量上限时，按最近访问时间淘汰已完成的产物，下载中和排队中的产物不会被淘汰。
+    """
+
+    def __init__(self, directory, quota_bytes=0):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # 产物ID -> 附着的任务ID列表，第一个为执行下载的任务
+        self._inflight = {}
+        self._leaders = {}
+        self._lock = threading.Lock()
+        # 扫描和淘汰互斥，不阻塞认领
+        self._space_lock = threading.Lock()
+        self.hits = 0
+        self.attached = 0
+        self.downloads = 0
+        self.quota_bytes = quota_bytes
+        # 产物ID -> [占用字节数, 最近访问时间]；完成和淘汰时增量更新，清理线程定期完整扫描校准
+        self._index = {}
+        self.used_bytes = 0
+        self.artifacts = 0
+        self.scans = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.rejections = 0
+        if quota_bytes:
+            threading.Thread(target=self._sweep_loop, name='storage-sweeper', daemon=True).start()
+
+    def artifact_dir(self, artifact_id):
+        return os.path.join(self.directory, artifact_id)
+
+    def lookup(self, artifact_id):
+        """返回已完成产物的清单，文件不存在时返回None"""
+        try:
+            with open(os.path.join(self.artifact_dir(artifact_id), ARTIFACT_MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('filename') and not os.path.exists(manifest['filename']):
+            return None
+        return manifest
+
+    def claim(self, artifact_id, task_id, needed=0):
+        """为任务认领产物：'completed'表示已存在，'attached'表示附着到进行中的下载，'download'表示需要下载，
+        'full'表示需要下载但淘汰后仍放不下needed字节（产物已认领，由调用方放弃）
+        """
+        with self._lock:
+            manifest = self.lookup(artifact_id)
+            if manifest is not None:
+                self.hits += 1
+                touch_artifact(artifact_id)
+                if artifact_id in self._index:
+                    self._index[artifact_id][1] = time.time()
+                task_store.update(task_id, status='completed', artifact_id=artifact_id, deduplicated=True,
+                                  filename=manifest['filename'], progress={'percent': 100.0})
+                return 'completed', manifest['filename']
+            
+            task_ids = self._inflight.get(artifact_id)
+            if task_ids is not None:
+                self.attached += 1
+                leader_id = self._leaders[artifact_id]
+                leader = task_store.get(leader_id) or {}
+                task_ids.append(task_id)
+                task_store.update(task_id, status=leader.get('status', 'queued'), progress=leader.get('progress', {}),
+                                  artifact_id=artifact_id, attached_to=leader_id)
+                return 'attached', leader_id
+            
+            self.downloads += 1
+            self._inflight[artifact_id] = [task_id]
+            self._leaders[artifact_id] = task_id
+            task_store.update(task_id, artifact_id=artifact_id)
+        # 在认领锁之外检查空间，淘汰时需要再次获取认领锁
+        if not self.ensure_space(needed):
+            return 'full', task_id
+        return 'download', task_id
+
+    def tasks(self, artifact_id):
+        """返回附着在进行中下载上的任务ID"""
+        with self._lock:
+            return list(self._inflight.get(artifact_id, ()))
+
+    def detach(self, artifact_id, task_id):
+        """任务取消时脱离进行中的下载，返回(执行下载的任务ID, 剩余任务数)；不在下载中返回None"""
+        with self._lock:
+            task_ids = self._inflight.get(artifact_id)
+            if task_ids is None or task_id not in task_ids:
+                return None
+            task_ids.remove(task_id)
+            return self._leaders[artifact_id], len(task_ids)
+
+    def update(self, artifact_id, **fields):
+        """更新所有附着任务的字段"""
+        with self._lock:
+            for task_id in self._inflight.get(artifact_id, ()):
+                task_store.update(task_id, **fields)
+
+    def complete(self, artifact_id, filename):
+        """写入产物清单，并把所有附着的任务标记为完成"""
+        manifest = {
+            'artifact_id': artifact_id,
+            'filename': filename,
+            'size': os.path.getsize(filename) if filename and os.path.isfile(filename) else None,
+            'completed_at': datetime.now().isoformat()
+        }
+        manifest_path = os.path.join(self.artifact_dir(artifact_id), ARTIFACT_MANIFEST)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        size = self._dir_size(self.artifact_dir(artifact_id))
+        with self._space_lock:
+            previous = self._index.get(artifact_id)
+            self._index[artifact_id] = [size, time.time()]
+            self.used_bytes += size - (previous[0] if previous else 0)
+            self.artifacts = len(self._index)
+        with self._lock:
+            for task_id in self._inflight.pop(artifact_id, ()):
+                task_store.update(task_id, status='completed', filename=filename)
+            self._leaders.pop(artifact_id, None)
+
+    def abandon(self, artifact_id, **fields):
+        """下载失败或被取消：结束所有仍附着的任务"""
+        with self._lock:
+            for task_id in self._inflight.pop(artifact_id, ()):
+                task_store.update(task_id, **fields)
+            self._leaders.pop(artifact_id, None)
+
+    @staticmethod
+    def _dir_size(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return size
+
+    def _scan(self):
+        """返回每个产物目录的(产物ID, 占用字节数, 最近访问时间)"""
+        artifacts = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            size = self._dir_size(entry.path)
+            try:
+                last_access = os.path.getmtime(os.path.join(entry.path, ARTIFACT_MANIFEST))
+            except OSError:
+                # 没有清单的是下载中或失败残留的目录
+                last_access = entry.stat().st_mtime
+            artifacts.append((entry.name, size, last_access))
+        return artifacts
+
+    def _evict(self, artifact_id):
+        # 在认领锁内删除清单，之后的lookup不会再命中该产物
+        with self._lock:
+            if artifact_id in self._inflight:
+                return False
+            try:
+                os.unlink(os.path.join(self.artifact_dir(artifact_id), ARTIFACT_MANIFEST))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                return False
+        shutil.rmtree(self.artifact_dir(artifact_id), ignore_errors=True)
+        return True
+
+    def ensure_space(self, needed=0, rescan=False):
+        """超过高水位时淘汰最久未访问的产物直到低水位，返回能否再容纳needed字节
+
+        请求路径上只使用增量维护的占用计数；rescan=True（清理线程）时先完整扫描目录校准计数，
+        包括下载中的部分文件和在外部被删除的文件。
+        """
+        if not self.quota_bytes:
+            return True
+        with self._space_lock:
+            if rescan:
+                artifacts = self._scan()
+                self._index = {artifact_id: [size, last_access] for artifact_id, size, last_access in artifacts}
+                self.used_bytes = sum(size for _, size, _ in artifacts)
+                self.scans += 1
+            if self.used_bytes + needed > self.quota_bytes * DOWNLOAD_HIGH_WATERMARK:
+                target = self.quota_bytes * DOWNLOAD_LOW_WATERMARK - needed
+                with self._lock:
+                    pinned = set(self._inflight)
+                for artifact_id, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+                    if self.used_bytes <= target:
+                        break
+                    if artifact_id in pinned or not self._evict(artifact_id):
+                        continue
+                    print(f"淘汰下载产物 {artifact_id}（{size} 字节）")
+                    del self._index[artifact_id]
+                    self.used_bytes -= size
+                    self.evictions += 1
+                    self.evicted_bytes += size
+            self.artifacts = len(self._index)
+            fits = self.used_bytes + needed <= self.quota_bytes
+            if not fits:
+                self.rejections += 1
+            return fits
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.ensure_space(rescan=True)
+            except Exception as e:
+                print(f"下载存储清理失败: {e}")
+            time.sleep(STORAGE_SWEEP_INTERVAL)
+
+    def usage(self):
+        """返回磁盘占用情况（增量维护的计数，清理线程定期扫描校准）"""
+        return {
+            'quota_bytes': self.quota_bytes or None,
+            'used_bytes': self.used_bytes,
+            'used_percent': round(self.used_bytes * 100 / self.quota_bytes, 1) if self.quota_bytes else None,
+            'artifacts': self.artifacts,
+            'scans': self.scans,
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes,
+            'rejections': self.rejections
+        }
+
+    def stats(self):
+        """返回去重和磁盘占用统计信息"""
+        with self._lock:
+            stats = {
+                'in_flight': len(self._inflight),
+                'attached_tasks': sum(len(task_ids) - 1 for task_ids in self._inflight.values() if task_ids),
+                'hits': self.hits,
+                'attached': self.attached,
+                'downloads': self.downloads
+            }
+        stats['storage'] = self.usage()
+        return stats
+
+def get_downloaded_filename(ydl, info):
+    """返回后处理完成后的最终文件路径"""
+    requested = info.get('requested_downloads') or []
+    if requested and requested[-1].get('filepath'):
+        return requested[-1]['filepath']
+    return ydl.prepare_filename(info)
+
+def download_video(url, task_id, options=None, cookies_data=None, artifact_id=None):
+    """后台下载视频（由下载调度器的工作线程执行）"""
+    def check_cancelled(d):
+        # 在进度/后处理回调中响应取消请求
+        if download_scheduler.is_cancelled(task_id):
+            raise yt_dlp.utils.DownloadCancelled('任务已取消')
+    
+    ydl_opts = {
+        'outtmpl': f'{DOWNLOAD_DIR}/%(title)s.%(ext)s',
+    }
+    
+    # 合并用户自定义选项
+    if options:
+        ydl_opts.update(options)
+    if artifact_id:
+        # 产物目录由产物ID决定，不同视频同名也不会互相覆盖
+        ydl_opts['outtmpl'] = os.path.join(download_store.artifact_dir(artifact_id), '%(title)s.%(ext)s')
+    
+    ydl_opts.setdefault('segment_connections', DOWNLOAD_CONNECTIONS)
+    
+    # 任务真正开始时才引用cookies文件，排队中的任务不占用
+    ydl_opts = get_ydl_opts_with_cookies(ydl_opts, cookies_data)
+    ydl_opts['progress_hooks'] = [check_cancelled, ProgressThrottle(task_id, artifact_id)]
+    # 先等待ffmpeg空位再计时，后处理耗时不包含排队时间
+    ffmpeg_slot = FFmpegSlotHook(ffmpeg_limiter, lambda: download_scheduler.is_cancelled(task_id))
+    ydl_opts['postprocessor_hooks'] = [check_cancelled, ffmpeg_slot, PostprocessorTimer()]
+    
+    def set_status(**fields):
+        if artifact_id:
+            download_store.update(artifact_id, **fields)
+        else:
+            task_store.update(task_id, **fields)
+    
+    try:
+        # 后台任务在上游预算内排队等待，不直接失败
+        with governed_upstream('extract', resolve_extractor_identity(url)[0], get_egress_identity(ydl_opts),
+                               GOVERNOR_JOB_MAX_WAIT, lambda: download_scheduler.is_cancelled(task_id),
+                               get_cookie_identity(ydl_opts)):
+            with ydl_pool.lease(ydl_opts) as ydl:
+                set_status(status='downloading')
+                info = ydl.extract_info(url, download=True)
+                filename = get_downloaded_filename(ydl, info) if info else None
+        if artifact_id:
+            download_store.complete(artifact_id, filename)
+            download_store.ensure_space()
+        else:
+            task_store.update(task_id, status='completed', filename=filename)
+            
+    except Exception as e:
+        cancelled = download_scheduler.is_cancelled(task_id)
+        if cancelled:
+            fields = {'status': 'cancelled'}
+        else:
+            fields = {'status': 'error', 'error': str(e)}
+        if artifact_id:
+            download_store.abandon(artifact_id, **fields)
+        if cancelled or not artifact_id:
+            # 被取消的任务已脱离产物，需要单独更新
+            task_store.update(task_id, **fields)
+    finally:
+        ffmpeg_slot.release()
+        # 释放cookies文件
+        release_cookiefile(ydl_opts)
+
+# 下载工作线程数量与等待队列上限
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 2))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get('DOWNLOAD_QUEUE_SIZE', 100))
+
+# 任务类型的默认优先级（数值越小越先执行）
+TASK_PRIORITIES = {
+    'audio_only': 0,
+    'video': 1,
+    'transcribe': 1
+}
+
+class DownloadQueueFull(Exception):
+    """下载队列已满"""
+
+class StorageFull(DownloadQueueFull):
+    """淘汰后下载存储仍没有足够的空间"""
+
+class DownloadScheduler:
+    """固定大小的下载工作线程池，按优先级从有界队列中取任务"""
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._heap = []
+        self._seq = 0
+        self._running = set()
+        self._cancelled = set()
+        self._threads = []
+        self._draining = False
+        self._cond = threading.Condition()
+
+    def _ensure_workers(self):
+        # 首次提交任务时才启动工作线程
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker_loop, name=f'download-worker-{len(self._threads)}')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, task_id, kind, args, priority=(0,)):
+        """提交JOB_RUNNERS中kind类型的任务，队列已满时抛出DownloadQueueFull"""
+        with self._cond:
+            if self._draining:
+                raise DownloadQueueFull('服务正在关闭，请稍后重试')
+            if len(self._heap) >= self.max_queue:
+                raise DownloadQueueFull('下载队列已满，请稍后重试')
+            self._ensure_workers()
+            self._seq += 1
+            heapq.heappush(self._heap, (tuple(priority), self._seq, task_id, kind, args))
+            self._cond.notify()
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._draining:
+                    self._cond.wait()
+                _, _, task_id, kind, args = heapq.heappop(self._heap)
+                self._running.add(task_id)
+            try:
+                JOB_RUNNERS[kind](*args)
+            except Exception as e:
+                print(f"下载任务异常: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(task_id)
+                    self._cancelled.discard(task_id)
+                    self._cond.notify_all()
+
+    def drain(self, timeout):
+        """停止领取新任务并等待进行中的任务完成，返回是否在超时前全部完成"""
+        deadline = time.time() + timeout
+        with self._cond:
+            self._draining = True
+            while self._running and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+            return not self._running
+
+    def queue_position(self, task_id):
+        """返回任务在等待队列中的位置（从1开始），不在队列中返回None"""
+        with self._cond:
+            ordered = sorted(self._heap, key=lambda item: (item[0], item[1]))
+        for position, item in enumerate(ordered, 1):
+            if item[2] == task_id:
+                return position
+        return None
+
+    def cancel(self, task_id):
+        """取消任务，返回'queued'/'running'表示被取消时所处的状态，找不到返回None"""
+        with self._cond:
+            for index, item in enumerate(self._heap):
+                if item[2] == task_id:
+                    self._heap.pop(index)
+                    heapq.heapify(self._heap)
+                    return 'queued'
+            if task_id in self._running:
+                self._cancelled.add(task_id)
+                return 'running'
+        return None
+
+    def is_cancelled(self, task_id):
+        return task_id in self._cancelled
 
-def progress_hook(d):
-    """下载进度回调函数"""
-    task_id = d.get('task_id')
-    if task_id and task_id in download_tasks:
-        if d['status'] == 'downloading':
-            download_tasks[task_id]['status'] = 'downloading'
-            download_tasks[task_id]['progress'] = {
-                'downloaded_bytes': d.get('downloaded_bytes', 0),
-                'total_bytes': d.get('total_bytes', 0),
-                'speed': d.get('speed', 0),
-                'eta': d.get('eta', 0)
+    def stats(self):
+        """返回调度器状态"""
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'running': len(self._running),
+                'queued': len(self._heap),
+                'max_queue': self.max_queue
             }
-        elif d['status'] == 'finished':
-            download_tasks[task_id]['status'] = 'completed'
-            download_tasks[task_id]['filename'] = d.get('filename')
 
-def download_worker(task_id, url, format_id, cookies_data=None):
-    """下载工作线程"""
+# 语音转录配置：ASR后端可选whisper、faster-whisper或stub（不做识别，用于测试流水线）
+TRANSCRIBE_BACKEND = os.environ.get('TRANSCRIBE_BACKEND', 'whisper')
+TRANSCRIBE_DEFAULT_MODEL = os.environ.get('TRANSCRIBE_MODEL', 'base')
+TRANSCRIBE_MODELS = ('tiny', 'base', 'small', 'medium', 'large')
+# 音频按约TRANSCRIBE_WINDOW秒切分，切点落在窗口边界附近的静音处
+TRANSCRIBE_WINDOW = int(os.environ.get('TRANSCRIBE_WINDOW', 30))
+TRANSCRIBE_PROCESSES = int(os.environ.get('TRANSCRIBE_PROCESSES', 2))
+TRANSCRIBE_MAX_DURATION = int(os.environ.get('TRANSCRIBE_MAX_DURATION', 4 * 3600))
+TRANSCRIPT_CACHE_DIR = os.path.join(DOWNLOAD_DIR, 'transcripts')
+SILENCE_RE = re.compile(r'silence_(start|end): (-?[\d.]+)')
+
+transcribe_pool = None
+transcribe_pool_lock = threading.Lock()
+
+def get_transcribe_pool():
+    """懒创建转录进程池；spawn方式启动，模型在每个工作进程中首次使用时加载一次"""
+    global transcribe_pool
+    with transcribe_pool_lock:
+        if transcribe_pool is None:
+            transcribe_pool = ProcessPoolExecutor(TRANSCRIBE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return transcribe_pool
+
+def get_transcript_cache_path(url, model, language, backend):
+    """转录结果缓存文件：按(提取器, 视频ID, 模型, 语言, 后端)区分"""
+    extractor, video_id = resolve_extractor_identity(url)
+    payload = json.dumps([extractor, video_id, model, language or 'auto', backend])
+    return os.path.join(TRANSCRIPT_CACHE_DIR, hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32] + '.json')
+
+def load_cached_transcript(url, model, language, backend):
+    try:
+        with open(get_transcript_cache_path(url, model, language, backend), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def prepare_transcribe_audio(source, wav_path, is_cancelled=None):
+    """一次ffmpeg转换为16kHz单声道wav，同时检测静音区间，返回(时长, 静音区间列表)"""
+    with ffmpeg_limiter.slot(is_cancelled):
+        started = time.perf_counter()
+        result = subprocess.run(
+            ['ffmpeg', '-nostdin', '-hide_banner', '-y', '-i', source, '-vn', '-ac', '1', '-ar', '16000',
+             '-af', 'silencedetect=noise=-35dB:d=0.3', wav_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace'
+        )
+        POSTPROCESSOR_DURATION.observe(time.perf_counter() - started, 'TranscribePrepare')
+    if result.returncode != 0:
+        raise RuntimeError(f'音频转换失败: {result.stderr.strip()[-300:]}')
+    
+    with wave.open(wav_path, 'rb') as audio:
+        duration = audio.getnframes() / float(audio.getframerate())
+    silences = []
+    silence_start = None
+    for kind, value in SILENCE_RE.findall(result.stderr):
+        if kind == 'start':
+            silence_start = float(value)
+        elif silence_start is not None:
+            silences.append((silence_start, float(value)))
+            silence_start = None
+    if silence_start is not None:
+        silences.append((silence_start, duration))
+    return duration, silences
+
+def plan_transcribe_windows(duration, silences, window):
+    """在每个窗口边界±window/4范围内选最近的静音中点切分，找不到静音时直接在边界切分"""
+    midpoints = [(start + end) / 2 for start, end in silences]
+    cuts = [0.0]
+    while duration - cuts[-1] > window * 1.5:
+        target = cuts[-1] + window
+        nearby = [point for point in midpoints if abs(point - target) <= window / 4]
+        cuts.append(min(nearby, key=lambda point: abs(point - target)) if nearby else target)
+    cuts.append(duration)
+    return list(zip(cuts, cuts[1:]))
+
+def write_transcribe_window(source, path, start, end):
+    """从wav文件中截取一个窗口"""
+    with wave.open(source, 'rb') as audio:
+        rate = audio.getframerate()
+        audio.setpos(int(start * rate))
+        frames = audio.readframes(int((end - start) * rate))
+        params = audio.getparams()
+    with wave.open(path, 'wb') as window:
+        window.setparams(params)
+        window.writeframes(frames)
+
+def transcribe_audio(url, task_id, options=None, cookies_data=None):
+    """后台转录任务：提取一次音频，按静音切分窗口，在进程池中并行转录，片段完成即写入任务"""
+    options = options or {}
+    backend = options.get('backend') or TRANSCRIBE_BACKEND
+    model = options.get('model') or TRANSCRIBE_DEFAULT_MODEL
+    language = options.get('language')
+    
+    def check_cancelled(d=None):
+        if download_scheduler.is_cancelled(task_id):
+            raise yt_dlp.utils.DownloadCancelled('任务已取消')
+    
+    workdir = tempfile.mkdtemp(prefix='yt-dlp-api-transcribe-')
+    ydl_opts = get_ydl_opts_with_cookies({
+        'format': 'bestaudio/best',
+        'outtmpl': os.path.join(workdir, 'source.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'progress_hooks': [check_cancelled]
+    }, cookies_data)
+    pending = {}
     try:
-        download_tasks[task_id]['status'] = 'downloading'
+        task_store.update(task_id, status='downloading', progress={'stage': 'extracting_audio'})
+        with governed_upstream('extract', resolve_extractor_identity(url)[0], get_egress_identity(ydl_opts),
+                               GOVERNOR_JOB_MAX_WAIT, lambda: download_scheduler.is_cancelled(task_id),
+                               get_cookie_identity(ydl_opts)):
+            with ydl_pool.lease(ydl_opts) as ydl:
+                # 先只提取元数据检查时长，超长的视频不下载音频
+                info = ydl.extract_info(url, download=False)
+                if (info.get('duration') or 0) > TRANSCRIBE_MAX_DURATION:
+                    raise ValueError(f'视频时长超过{TRANSCRIBE_MAX_DURATION}秒限制')
+                info = ydl.process_ie_result(info, download=True)
+                source = get_downloaded_filename(ydl, info)
+        check_cancelled()
         
-        base_opts = {
-            'format': format_id,
-            'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),
-            'progress_hooks': [lambda d: progress_hook_with_task_id(d, task_id)],
-        }
+        wav_path = os.path.join(workdir, 'audio.wav')
+        duration, silences = prepare_transcribe_audio(source, wav_path, lambda: download_scheduler.is_cancelled(task_id))
+        os.unlink(source)
+        windows = plan_transcribe_windows(duration, silences, TRANSCRIBE_WINDOW)
+        task_store.update(task_id, title=info.get('title'), duration=info.get('duration') or round(duration, 3),
+                          progress={'stage': 'transcribing', 'windows_done': 0, 'windows_total': len(windows), 'percent': 0.0})
         
-        ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
+        pool = get_transcribe_pool()
+        next_windows = iter(enumerate(windows))
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            download_tasks[task_id]['filename'] = ydl.prepare_filename(info)
-            download_tasks[task_id]['status'] = 'completed'
-            
+        def submit_next():
+            # 同时只准备少量窗口文件，长音频不会一次性占满临时目录
+            item = next(next_windows, None)
+            if item is None:
+                return
+            index, (start, end) = item
+            path = os.path.join(workdir, f'window-{index:05d}.wav')
+            write_transcribe_window(wav_path, path, start, end)
+            future = pool.submit(asr_backends.transcribe_window, backend, model, path, language, start)
+            pending[future] = index
+        
+        for _ in range(TRANSCRIBE_PROCESSES * 2):
+            submit_next()
+        
+        segments = []
+        languages = []
+        windows_done = 0
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                result = future.result()
+                segments.extend(result['segments'])
+                if result.get('language'):
+                    languages.append(result['language'])
+                windows_done += 1
+            check_cancelled()
+            for _ in done:
+                submit_next()
+            # 运行中只持久化进度计数；已完成的片段只推送给订阅者，完成时一次写入任务
+            task_store.update(task_id, progress={
+                'stage': 'transcribing',
+                'windows_done': windows_done,
+                'windows_total': len(windows),
+                'segments_done': len(segments),
+                'percent': round(windows_done * 100 / len(windows), 1)
+            }, transient={'segments': list(segments)} if task_events.has_subscribers() else None)
+        
+        segments.sort(key=lambda segment: segment['start'])
+        result = {
+            'title': info.get('title'),
+            'duration': info.get('duration') or round(duration, 3),
+            # 各窗口分别检测语言，取出现最多的
+            'language': language or (max(set(languages), key=languages.count) if languages else None),
+            'text': ' '.join(segment['text'] for segment in segments if segment['text']),
+            'segments': segments,
+            'model_used': model,
+            'backend': backend
+        }
+        cache_path = get_transcript_cache_path(url, model, language, backend)
+        os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+        with open(cache_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(cache_path + '.tmp', cache_path)
+        task_store.update(task_id, status='completed', progress={'stage': 'completed', 'percent': 100.0}, **result)
+    
     except Exception as e:
-        download_tasks[task_id]['status'] = 'error'
-        download_tasks[task_id]['error'] = str(e)
+        for future in pending:
+            future.cancel()
+        if download_scheduler.is_cancelled(task_id):
+            task_store.update(task_id, status='cancelled')
+        else:
+            task_store.update(task_id, status='error', error=str(e))
     finally:
-        # 清理临时cookies文件
-        if 'cookiefile' in ydl_opts:
-            try:
-                os.unlink(ydl_opts['cookiefile'])
-            except:
-                pass
+        release_cookiefile(ydl_opts)
+        shutil.rmtree(workdir, ignore_errors=True)
 
-def progress_hook_with_task_id(d, task_id):
-    """带任务ID的进度回调函数"""
-    if task_id and task_id in download_tasks:
-        if d['status'] == 'downloading':
-            download_tasks[task_id]['status'] = 'downloading'
-            download_tasks[task_id]['progress'] = {
-                'downloaded_bytes': d.get('downloaded_bytes', 0),
-                'total_bytes': d.get('total_bytes', 0),
-                'speed': d.get('speed', 0),
-                'eta': d.get('eta', 0)
-            }
-        elif d['status'] == 'finished':
-            download_tasks[task_id]['status'] = 'completed'
-            download_tasks[task_id]['filename'] = d.get('filename')
+# 调度器可执行的任务类型
+JOB_RUNNERS = {
+    'download': download_video,
+    'transcribe': transcribe_audio
+}
+
+# 生产模式下由serve()设置：HTTP工作进程通过该地址连接独立的任务进程
+TASK_RUNNER_ADDRESS = os.environ.get('TASK_RUNNER_ADDRESS')
+TASK_RUNNER_AUTHKEY = os.environ.get('TASK_RUNNER_AUTHKEY', '')
+# 以生产模式直接运行脚本时，主进程只负责启动任务进程和gunicorn；任务存储、下载存储等子系统只在任务进程中创建，
+# 否则主进程中没有进行中下载记录的下载存储可能淘汰任务进程正在写入的产物
+SERVE_MASTER = (__name__ == '__main__' and os.environ.get('FLASK_ENV') == 'production'
+                and importlib.util.find_spec('gunicorn') is not None)
+# 任务进程退出前等待进行中下载完成的最长时间（秒）；
+# 容器的停止宽限期需要大于WEB_GRACEFUL_TIMEOUT + DOWNLOAD_DRAIN_TIMEOUT，否则下载会被SIGKILL中断
+DOWNLOAD_DRAIN_TIMEOUT = int(os.environ.get('DOWNLOAD_DRAIN_TIMEOUT', 60))
+
+class TaskRunnerManager(BaseManager):
+    """在HTTP工作进程和任务进程之间共享任务存储、下载调度器和事件总线"""
+
+def register_task_runner_types(task_store=None, download_scheduler=None, task_events=None, metrics=None, download_store=None,
+                               ffmpeg_limiter=None, upstream_governor=None, cookie_pool=None, connection_budget=None):
+    """注册任务子系统的代理类型；任务进程传入本地对象，HTTP工作进程不传"""
+    def provider(obj):
+        return (lambda: obj) if obj is not None else None
+    
+    TaskRunnerManager.register('task_store', provider(task_store), exposed=(
+        'create', 'get', 'update', 'delete', 'query', 'stats', '__contains__'))
+    TaskRunnerManager.register('download_scheduler', provider(download_scheduler), exposed=(
+        'submit', 'queue_position', 'cancel', 'is_cancelled', 'stats'))
+    TaskRunnerManager.register('task_events', provider(task_events), exposed=(
+        'subscribe', 'unsubscribe', 'has_subscribers', 'stats'),
+        method_to_typeid={'subscribe': 'TaskSubscription'})
+    TaskRunnerManager.register('TaskSubscription', exposed=('drain',), create_method=False)
+    TaskRunnerManager.register('metrics', provider(metrics), exposed=('snapshot', 'publish'))
+    TaskRunnerManager.register('download_store', provider(download_store), exposed=(
+        'claim', 'tasks', 'detach', 'abandon', 'lookup', 'ensure_space', 'usage', 'stats'))
+    TaskRunnerManager.register('ffmpeg_limiter', provider(ffmpeg_limiter), exposed=('try_acquire', 'release', 'stats'))
+    TaskRunnerManager.register('upstream_governor', provider(upstream_governor), exposed=('reserve', 'report', 'stats'))
+    TaskRunnerManager.register('cookie_pool', provider(cookie_pool), exposed=('checkout', 'report', 'stats'))
+    TaskRunnerManager.register('connection_budget', provider(connection_budget), exposed=('stats',))
 
-def download_video(url, task_id, options=None):
-    """后台下载视频"""
+def connect_task_runner(address, authkey, attempts=30):
+    """连接任务进程，返回任务存储、下载调度器、事件总线、指标注册表、下载存储、ffmpeg并发限制、上游调速器、cookies池和下载连接预算的代理"""
+    register_task_runner_types()
+    manager = TaskRunnerManager(address=address, authkey=authkey.encode('utf-8'))
+    for attempt in range(attempts):
+        try:
+            manager.connect()
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            if attempt == attempts - 1:
+                raise
+            time.sleep(1)
+    return (manager.task_store(), manager.download_scheduler(), manager.task_events(),
+            manager.metrics(), manager.download_store(), manager.ffmpeg_limiter(), manager.upstream_governor(),
+            manager.cookie_pool(), manager.connection_budget())
+
+def push_metrics_forever(runner_metrics):
+    """定期把本进程的指标推送到任务进程，由任务进程汇总所有工作进程"""
+    source = f'web-{os.getpid()}'
+    while True:
+        time.sleep(METRICS_PUSH_INTERVAL)
+        try:
+            runner_metrics.publish(source, *metrics.snapshot())
+        except Exception as e:
+            print(f"推送指标失败: {e}")
+
+if TASK_RUNNER_ADDRESS:
+    # HTTP工作进程：任务在独立的任务进程中执行，工作进程重启不影响进行中的下载
+    (task_store, download_scheduler, task_events, runner_metrics, download_store,
+     ffmpeg_limiter, upstream_governor, cookie_pool, connection_budget) = connect_task_runner(TASK_RUNNER_ADDRESS, TASK_RUNNER_AUTHKEY)
+    threading.Thread(target=push_metrics_forever, args=(runner_metrics,), daemon=True).start()
+elif __name__ == '__mp_main__' or SERVE_MASTER:
+    # 转录进程池以spawn方式启动时会把主脚本作为__mp_main__重新导入，这些子进程和生产模式的主进程中不创建任务子系统
+    runner_metrics = None
+else:
+    task_events = TaskEventBus()
+    task_store = TaskStore(TASK_DB_PATH, TASK_TTL)
+    atexit.register(task_store.flush)
+    download_scheduler = DownloadScheduler(DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE)
+    download_store = DownloadStore(DOWNLOAD_STORE_DIR, DOWNLOAD_QUOTA_MB * 1024 * 1024)
+    ffmpeg_limiter = FFmpegLimiter(FFMPEG_MAX_PROCESSES)
+    upstream_governor = UpstreamGovernor({
+        'extract': (GOVERNOR_EXTRACT_RATE, GOVERNOR_EXTRACT_BURST),
+        'media': (GOVERNOR_MEDIA_RATE, GOVERNOR_MEDIA_BURST)
+    })
+    cookie_pool = CookiePool(COOKIE_POOL_DIR, DEFAULT_YOUTUBE_COOKIES)
+    runner_metrics = None
+
+def collect_download_counts():
+    stats = download_scheduler.stats()
+    return {('active',): stats['running'], ('queued',): stats['queued']}
+
+# 下载调度器所在的进程负责采集下载数量，HTTP工作进程只登记指标
+metrics.gauge('downloads', '下载任务数量（active执行中，queued排队中）', ('state',),
+              None if TASK_RUNNER_ADDRESS else collect_download_counts)
+
+def collect_ffmpeg_counts():
+    stats = ffmpeg_limiter.stats()
+    return {('running',): stats['running'], ('waiting',): stats['waiting']}
+
+metrics.gauge('ffmpeg_processes', 'ffmpeg进程数量（running运行中，waiting等待空位）', ('state',),
+              None if TASK_RUNNER_ADDRESS else collect_ffmpeg_counts)
+
+def collect_upstream_rates():
+    return {(bucket['kind'], bucket['extractor'], bucket['egress']): bucket['rate'] for bucket in upstream_governor.stats()}
+
+metrics.gauge('upstream_rate', '上游请求预算的当前速率（每秒请求数，被限流后按AIMD调整）', ('kind', 'extractor', 'egress'),
+              None if TASK_RUNNER_ADDRESS else collect_upstream_rates)
+
+def collect_cookie_health():
+    return {(identity['name'],): identity['health'] for identity in cookie_pool.stats()['pool']}
+
+metrics.gauge('cookie_identity_health', 'cookies池身份的健康分（0-1）', ('identity',),
+              None if TASK_RUNNER_ADDRESS else collect_cookie_health)
+
+def collect_download_connections():
+    return {(): connection_budget.stats()['in_use']}
+
+metrics.gauge('download_connections', '分段下载占用的上游连接数', (),
+              None if TASK_RUNNER_ADDRESS else collect_download_connections)
+
+def run_task_runner():
+    """任务进程入口：执行下载任务，并把任务子系统提供给HTTP工作进程"""
+    register_task_runner_types(task_store, download_scheduler, task_events, metrics, download_store, ffmpeg_limiter,
+                               upstream_governor, cookie_pool, connection_budget)
+    manager = TaskRunnerManager(
+        address=os.environ['TASK_RUNNER_LISTEN'],
+        authkey=os.environ['TASK_RUNNER_AUTHKEY'].encode('utf-8')
+    )
+    server = manager.get_server()
+    
+    def handle_term(signum, frame):
+        print("任务进程收到退出信号，等待进行中的下载完成...")
+        if not download_scheduler.drain(DOWNLOAD_DRAIN_TIMEOUT):
+            print("等待超时，未完成的下载将在下次启动时标记为中断")
+        raise SystemExit(0)
+    
+    signal.signal(signal.SIGTERM, handle_term)
+    print(f"📦 任务进程已启动: {os.environ['TASK_RUNNER_LISTEN']}")
+    server.serve_forever()
+
+def get_task_priority(task_type, url, cookies_data=None, requested_priority=None, format_spec=None, info=None):
+    """计算任务优先级：音频先于视频，已知体积小的先于大的
+
+    体积按format_spec实际选中的格式计算（合并下载时为各格式之和）；没有传入info时只查提取缓存，
+    缓存未命中时体积未知，排在同优先级已知体积的任务之后。
+    """
+    priority = TASK_PRIORITIES.get(task_type, 1)
+    if requested_priority is not None:
+        try:
+            priority = int(requested_priority)
+        except (TypeError, ValueError):
+            pass
+    
+    if info is None:
+        extractor, video_id = resolve_extractor_identity(url)
+        info = extract_cache.get((extractor, video_id, get_cookie_fingerprint(cookies_data)), record_stats=False)
+    size_hint = get_selected_size(info, format_spec) if info else None
+    return (priority, size_hint or float('inf'))
+
+def get_selected_size(info, format_spec=None):
+    """返回格式表达式选中的格式的体积之和，任一格式体积未知时返回None"""
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in select_formats(info, format_spec)]
+    if not sizes or not all(sizes):
+        return None
+    return sum(sizes)
+
+def enqueue_download(task_id, url, options, task_type, cookies_data=None, requested_priority=None):
+    """把下载任务放入调度队列，返回响应中的状态字段；相同产物已存在或正在下载时不再重复下载"""
     try:
-        ydl_opts = {
-            'outtmpl': f'{DOWNLOAD_DIR}/%(title)s.%(ext)s',
-            'progress_hooks': [progress_hook],
-        }
-        
-        # 合并用户自定义选项
-        if options:
-            ydl_opts.update(options)
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # 添加task_id到进度回调
-            for hook in ydl_opts['progress_hooks']:
-                hook.__defaults__ = (task_id,) if hook.__defaults__ is None else hook.__defaults__ + (task_id,)
-            
-            download_tasks[task_id]['status'] = 'downloading'
-            ydl.download([url])
-            
+        # 产物键和排序体积按实际会下载的格式计算；提取结果进入缓存，通常已被/api/info等请求预热
+        info, _ = extract_info_cached(url, cookies_data)
     except Exception as e:
-        download_tasks[task_id]['status'] = 'error'
-        download_tasks[task_id]['error'] = str(e)
+        # 提取失败时按请求的格式表达式计算，错误由下载任务报告
+        print(f"解析下载格式失败，按请求的格式计算产物键: {e}")
+        info = None
+    artifact_id = get_artifact_id(url, options, info)
+    priority = get_task_priority(task_type, url, cookies_data, requested_priority, options.get('format'), info)
+    # 已知体积时按体积预留，否则只要求未超出容量上限；空间检查随认领一起完成
+    size_hint = priority[1] if priority[1] != float('inf') else 0
+    claim, detail = download_store.claim(artifact_id, task_id, size_hint)
+    if claim == 'completed':
+        return {
+            'task_id': task_id,
+            'status': 'completed',
+            'deduplicated': True,
+            'filename': detail
+        }
+    if claim == 'attached':
+        return {
+            'task_id': task_id,
+            'status': task_store.get(task_id)['status'],
+            'attached_to': detail,
+            'queue_position': download_scheduler.queue_position(detail)
+        }
+    
+    try:
+        if claim == 'full':
+            raise StorageFull('下载存储空间不足，请稍后重试')
+        download_scheduler.submit(task_id, 'download', (url, task_id, options, cookies_data, artifact_id), priority)
+    except DownloadQueueFull as e:
+        # 认领后附着上来的任务也一并失败
+        download_store.abandon(artifact_id, status='error', error=str(e))
+        task_store.delete(task_id)
+        raise
+    return {
+        'task_id': task_id,
+        'status': 'queued',
+        'queue_position': download_scheduler.queue_position(task_id)
+    }
+
+# 元数据响应（/api/info、/api/formats）允许客户端和CDN缓存的最长时间（秒），不超过链接的剩余有效期
+METADATA_MAX_AGE = int(os.environ.get('METADATA_MAX_AGE', 60))
+# 使用orjson编码元数据响应（需要安装orjson），大的格式列表编码更快
+FAST_JSON = os.environ.get('FAST_JSON', '').lower() in ('1', 'true', 'yes')
+
+orjson = None
+if FAST_JSON:
+    try:
+        import orjson
+    except ImportError:
+        print("⚠️ 未安装orjson，FAST_JSON不生效，使用标准json编码")
+
+# fields=可以选择的字段；不在其中的字段（如请求头、分片列表）不对外返回
+INFO_FIELDS = (
+    'id', 'title', 'duration', 'uploader', 'uploader_id', 'channel', 'channel_id', 'upload_date', 'view_count',
+    'like_count', 'description', 'thumbnail', 'webpage_url', 'extractor', 'is_live', 'tags', 'categories', 'chapters'
+)
+FORMAT_FIELDS = (
+    'format_id', 'format_note', 'ext', 'protocol', 'resolution', 'width', 'height', 'fps', 'vcodec', 'acodec',
+    'tbr', 'vbr', 'abr', 'asr', 'audio_channels', 'quality', 'filesize', 'filesize_approx', 'dynamic_range',
+    'language', 'url'
+)
+
+def parse_fields(value):
+    """解析fields=参数（逗号分隔，点号表示嵌套，如title,formats.format_id），返回字段树，未指定时返回None"""
+    if isinstance(value, (list, tuple)):
+        value = ','.join(value)
+    if not value:
+        return None
+    tree = {}
+    for path in str(value).split(','):
+        parts = [part for part in path.strip().split('.') if part]
+        if not parts:
+            continue
+        node = tree
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return tree or None
+
+def project_fields(data, tree):
+    """按字段树裁剪数据；列表按元素逐个裁剪，不存在的字段忽略"""
+    if tree is None or tree is True:
+        return data
+    if isinstance(data, list):
+        return [project_fields(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {key: project_fields(data[key], sub) for key, sub in tree.items() if key in data}
+
+def get_fields():
+    """从查询参数或JSON请求体读取fields参数"""
+    fields = request.args.get('fields')
+    if fields is None and request.method == 'POST':
+        fields = (request.get_json(silent=True) or {}).get('fields')
+    return parse_fields(fields)
+
+def encode_json(data):
+    """编码响应体；启用FAST_JSON时使用orjson，遇到orjson不支持的类型时回退到标准编码"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return app.json.dumps(data).encode('utf-8')
+
+def metadata_response(data, max_age=0, private=False):
+    """构造元数据响应：ETag由响应内容生成，If-None-Match匹配时返回304，不再重复传输"""
+    body = encode_json(data)
+    response = Response(body, content_type='application/json')
+    response.set_etag(hashlib.sha1(body).hexdigest())
+    if max_age > 0:
+        response.headers['Cache-Control'] = f"{'private' if private else 'public'}, max-age={int(max_age)}"
+    else:
+        # 每次都需要向服务器验证，内容没变时只返回304
+        response.headers['Cache-Control'] = f"{'private, ' if private else ''}no-cache"
+    return response.make_conditional(request)
+
+def get_metadata_max_age(info):
+    """元数据的缓存时间不超过其中链接的剩余有效期"""
+    return max(0, min(METADATA_MAX_AGE, compute_info_ttl(info)))
+
+def build_info_result(info, fields=None):
+    """提取/api/info返回的关键信息字段；指定fields时返回所有格式并按字段裁剪"""
+    if fields is not None:
+        result = {key: info.get(key) for key in INFO_FIELDS}
+        result['formats'] = [{key: f.get(key) for key in FORMAT_FIELDS} for f in info.get('formats') or []]
+        return project_fields(result, fields)
+    return {
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        'uploader': info.get('uploader'),
+        'upload_date': info.get('upload_date'),
+        'view_count': info.get('view_count'),
+        'description': info.get('description', '')[:200] + '...' if info.get('description') else None,
+        'formats': [{
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'quality': f.get('quality'),
+            'filesize': f.get('filesize'),
+            'url': f.get('url')
+        } for f in info.get('formats', [])[:5]]  # 未指定fields时只返回前5个格式
+    }
 
 @app.route('/api/info', methods=['GET', 'POST'])
 def get_video_info():
@@ -224,44 +3015,310 @@ def get_video_info():
         return jsonify({'error': '缺少URL参数'}), 400
     
     try:
-        base_opts = {
-            'quiet': True,
-            'no_warnings': True,
-        }
+        info, cache_status = extract_info_cached(url, cookies_data, get_cache_mode())
         
-        ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
+        response = metadata_response(build_info_result(info, get_fields()), get_metadata_max_age(info),
+                                     private=bool(cookies_data))
+        response.headers['X-Cache'] = cache_status
+        return response
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # 返回关键信息
-            result = {
-                'title': info.get('title'),
-                'duration': info.get('duration'),
-                'uploader': info.get('uploader'),
-                'upload_date': info.get('upload_date'),
-                'view_count': info.get('view_count'),
-                'description': info.get('description', '')[:200] + '...' if info.get('description') else None,
-                'formats': [{
-                    'format_id': f.get('format_id'),
-                    'ext': f.get('ext'),
-                    'quality': f.get('quality'),
-                    'filesize': f.get('filesize'),
-                    'url': f.get('url')
-                } for f in info.get('formats', [])[:5]]  # 只返回前5个格式
+    except UpstreamThrottled as e:
+        return throttled_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# 批量获取信息的并发上限
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+BATCH_DEFAULT_CONCURRENCY = int(os.environ.get('BATCH_DEFAULT_CONCURRENCY', 4))
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 5000))
+
+@app.route('/api/info/batch', methods=['POST'])
+def get_video_info_batch():
+    """并发获取多个视频的信息，按完成顺序以NDJSON逐行返回"""
+    data = request.get_json() or {}
+    urls = data.get('urls')
+    if not urls or not isinstance(urls, list):
+        return jsonify({'error': '缺少urls参数'}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'error': f'单次最多{BATCH_MAX_URLS}个URL'}), 400
+    
+    cookies_data = data.get('cookies')
+    cache_mode = data.get('cache')
+    try:
+        concurrency = int(data.get('concurrency', BATCH_DEFAULT_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency参数格式错误'}), 400
+    concurrency = min(max(concurrency, 1), BATCH_MAX_CONCURRENCY)
+    
+    def resolve(url):
+        info, cache_status = extract_info_cached(url, cookies_data, cache_mode)
+        return build_info_result(info), cache_status
+    
+    def generate():
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            futures = {executor.submit(resolve, url): (index, url) for index, url in enumerate(urls)}
+            for future in as_completed(futures):
+                index, url = futures[future]
+                line = {'index': index, 'url': url}
+                try:
+                    line['info'], line['cache'] = future.result()
+                except UpstreamThrottled as e:
+                    # 与单条接口的503相同，告知客户端多久后重试该条目
+                    line['error'] = str(e)
+                    line['retry_after'] = int(e.retry_after) + 1
+                except Exception as e:
+                    line['error'] = str(e)
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+        finally:
+            # 客户端提前断开时取消尚未开始的提取
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    return Response(generate(), content_type='application/x-ndjson')
+
+# 播放列表分页配置
+PLAYLIST_PAGE_SIZE = int(os.environ.get('PLAYLIST_PAGE_SIZE', 50))
+PLAYLIST_MAX_PAGE_SIZE = int(os.environ.get('PLAYLIST_MAX_PAGE_SIZE', 500))
+# 翻页会话的保留时间（秒）和数量上限：会话保存已定位到下一页的条目迭代器，
+# 请求下一页时直接继续读取，不重新提取、也不从头跳过前面的条目
+PLAYLIST_CURSOR_TTL = int(os.environ.get('PLAYLIST_CURSOR_TTL', 300))
+PLAYLIST_CURSOR_MAX = int(os.environ.get('PLAYLIST_CURSOR_MAX', 64))
+
+def open_playlist(ydl, url):
+    """返回播放列表/频道的原始提取结果，条目保持为惰性序列，不逐个解析"""
+    ie_result = timed_extract_info(ydl, url, download=False, process=False)
+    # 频道等URL可能先重定向到实际的播放列表页面
+    for _ in range(5):
+        if not ie_result or ie_result.get('_type') not in ('url', 'url_transparent'):
+            break
+        ie_result = timed_extract_info(ydl, ie_result['url'], download=False, process=False, ie_key=ie_result.get('ie_key'))
+    if not ie_result or ie_result.get('_type') != 'playlist':
+        raise ValueError('该URL不是播放列表或频道')
+    return ie_result
+
+def iter_playlist_entries(playlist, start=0, stop=None):
+    """从start开始惰性迭代播放列表条目，只拉取需要的分页"""
+    entries = playlist.get('entries') or []
+    if isinstance(entries, yt_dlp.utils.PagedList):
+        return iter_paged_entries(entries, start, stop)
+    return itertools.islice(entries, start, stop)
+
+def iter_paged_entries(entries, start=0, stop=None):
+    """逐页读取PagedList：从start所在的页开始，每次只取一页，不一次性构建剩余的全部条目"""
+    pagesize = entries._pagesize
+    index = start
+    while stop is None or index < stop:
+        page_end = (index // pagesize + 1) * pagesize
+        if stop is not None:
+            page_end = min(page_end, stop)
+        page = entries.getslice(index, page_end)
+        yield from page
+        if len(page) < page_end - index:
+            return
+        index = page_end
+
+class PlaylistSession:
+    """一次播放列表翻页的状态：独占的YoutubeDL实例（生成器条目翻页时仍会用它请求后续分页）、播放列表信息和条目迭代器"""
+
+    def __init__(self, ydl, playlist, entries):
+        self.ydl = ydl
+        self.playlist = playlist
+        self.entries = entries
+        self.expires = time.time() + PLAYLIST_CURSOR_TTL
+
+    def close(self):
+        try:
+            self.ydl.__exit__(None, None, None)
+        except Exception:
+            pass
+
+class PlaylistCursorCache:
+    """按(URL, cookies身份, 位置)保存翻页会话
+
+    取出的会话由当前请求独占，读完一页后以新的位置放回；过期或超过数量上限的会话被关闭。
+    会话只在当前进程中，下一页请求落到其他工作进程或会话过期时退回重新提取。
+    """
+
+    def __init__(self, ttl, max_sessions):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def take(self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None and session.expires < time.time():
+                self.expired += 1
+                session.close()
+                session = None
+            if session is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return session
+
+    def put(self, key, session):
+        if self.ttl <= 0 or self.max_sessions <= 0:
+            session.close()
+            return
+        session.expires = time.time() + self.ttl
+        evicted = []
+        with self._lock:
+            previous = self._sessions.pop(key, None)
+            if previous is not None:
+                evicted.append(previous)
+            self._sessions[key] = session
+            now = time.time()
+            for old_key in list(self._sessions):
+                if len(self._sessions) <= self.max_sessions and self._sessions[old_key].expires >= now:
+                    break
+                evicted.append(self._sessions.pop(old_key))
+        for old in evicted:
+            old.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired
             }
-            
-            return jsonify(result)
-            
+
+playlist_cursors = PlaylistCursorCache(PLAYLIST_CURSOR_TTL, PLAYLIST_CURSOR_MAX)
+
+def open_playlist_session(url, ydl_opts, cursor):
+    """新建翻页会话并定位到cursor；使用不入池的实例，会话存续期间不占用池中的提取实例"""
+    ydl = create_ydl(ydl_opts)
+    try:
+        playlist = open_playlist(ydl, url)
+        return PlaylistSession(ydl, playlist, iter_playlist_entries(playlist, cursor))
+    except BaseException:
+        ydl.__exit__(None, None, None)
+        raise
+
+def build_playlist_header(playlist):
+    """提取播放列表的关键信息字段"""
+    return {
+        'id': playlist.get('id'),
+        'title': playlist.get('title'),
+        'uploader': playlist.get('uploader') or playlist.get('channel'),
+        'playlist_count': playlist.get('playlist_count')
+    }
+
+def build_playlist_entry(entry):
+    """提取扁平条目的关键信息字段"""
+    return {
+        'id': entry.get('id'),
+        'title': entry.get('title'),
+        'url': entry.get('url') or entry.get('webpage_url'),
+        'duration': entry.get('duration'),
+        'uploader': entry.get('uploader') or entry.get('channel'),
+        'view_count': entry.get('view_count')
+    }
+
+@app.route('/api/playlist', methods=['GET', 'POST'])
+def get_playlist_entries():
+    """分页或以NDJSON流式返回播放列表/频道的条目（扁平提取）"""
+    if request.method == 'GET':
+        params = request.args
+        url = params.get('url')
+        cookies_data = None
+        # 支持通过查询参数传递简单的cookies配置
+        if params.get('use_browser'):
+            cookies_data = {
+                'use_browser': True,
+                'browser': params.get('browser', 'chrome')
+            }
+        elif params.get('cookies_from_browser'):
+            cookies_data = {
+                'use_browser': True,
+                'browser': params.get('cookies_from_browser', 'chrome')
+            }
+    else:  # POST
+        params = request.get_json() or {}
+        url = params.get('url')
+        cookies_data = params.get('cookies')
+    
+    if not url:
+        return jsonify({'error': '缺少URL参数'}), 400
+    
+    try:
+        cursor = max(int(params.get('cursor') or 0), 0)
+        page_size = min(max(int(params.get('page_size', PLAYLIST_PAGE_SIZE)), 1), PLAYLIST_MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'cursor/page_size参数格式错误'}), 400
+    stream = str(params.get('stream', '')).lower() in ('1', 'true', 'yes')
+    
+    base_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+    }
+    
+    if stream:
+        def generate():
+            ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
+            try:
+                with ydl_pool.lease(ydl_opts) as ydl:
+                    playlist = open_playlist(ydl, url)
+                    yield json.dumps(dict(build_playlist_header(playlist), type='playlist'), ensure_ascii=False) + '\n'
+                    for index, entry in enumerate(iter_playlist_entries(playlist, cursor), cursor):
+                        line = dict(build_playlist_entry(entry), type='entry', index=index)
+                        yield json.dumps(line, ensure_ascii=False) + '\n'
+            except Exception as e:
+                yield json.dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+            finally:
+                # 释放cookies文件
+                release_cookiefile(ydl_opts)
+        
+        return Response(generate(), content_type='application/x-ndjson')
+    
+    fingerprint = get_cookie_fingerprint(cookies_data)
+    session = playlist_cursors.take((url, fingerprint, cursor))
+    ydl_opts = None
+    try:
+        if session is None:
+            ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
+            session = open_playlist_session(url, ydl_opts, cursor)
+        # 多取一个条目用于判断是否还有下一页
+        entries = list(itertools.islice(session.entries, page_size + 1))
+        
+        has_more = len(entries) > page_size
+        playlist = session.playlist
+        if has_more:
+            # 多取的条目放回迭代器开头，下一页从它开始
+            session.entries = itertools.chain(entries[page_size:], session.entries)
+            playlist_cursors.put((url, fingerprint, cursor + page_size), session)
+        else:
+            session.close()
+        session = None
+        result = build_playlist_header(playlist)
+        result.update({
+            'entries': [build_playlist_entry(entry) for entry in entries[:page_size]],
+            'cursor': cursor,
+            'page_size': page_size,
+            'next_cursor': cursor + page_size if has_more else None
+        })
+        return jsonify(result)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
-        # 清理临时cookies文件
-        if 'cookiefile' in ydl_opts:
-            try:
-                os.unlink(ydl_opts['cookiefile'])
-            except:
-                pass
+        if session is not None:
+            session.close()
+        # 释放cookies文件（实例创建时已读取cookies）
+        if ydl_opts is not None:
+            release_cookiefile(ydl_opts)
 
 @app.route('/api/download', methods=['POST'])
 def start_download():
@@ -274,49 +3331,312 @@ def start_download():
     options = data.get('options', {})
     cookies_data = data.get('cookies')
     
+    try:
+        options = dict(options or {}, segment_connections=get_download_connections(data))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     # 生成任务ID
     task_id = str(uuid.uuid4())
     
-    # 合并cookies配置到options中
-    options = get_ydl_opts_with_cookies(options, cookies_data)
-    
     # 初始化任务状态
-    download_tasks[task_id] = {
-        'status': 'pending',
+    task_store.create(task_id, {
+        'status': 'queued',
         'url': url,
+        'type': 'video',
         'created_at': datetime.now().isoformat(),
         'progress': {},
         'filename': None,
         'error': None
-    }
+    })
     
-    # 启动后台下载线程
-    thread = threading.Thread(target=download_video, args=(url, task_id, options))
-    thread.daemon = True
-    thread.start()
+    # 放入下载队列
+    try:
+        result = enqueue_download(task_id, url, options, 'video', cookies_data, data.get('priority'))
+    except DownloadQueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 503
     
-    return jsonify({
-        'task_id': task_id,
-        'status': 'pending',
-        'message': '下载任务已创建'
-    })
+    result['message'] = '下载任务已创建'
+    return jsonify(result)
 
 @app.route('/api/status/<task_id>', methods=['GET'])
 def get_download_status(task_id):
     """获取下载状态"""
-    if task_id not in download_tasks:
+    task = task_store.get(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    return jsonify(download_tasks[task_id])
+    if task['status'] == 'queued':
+        task['queue_position'] = download_scheduler.queue_position(task.get('attached_to') or task_id)
+    elif task['status'] == 'completed' and task.get('filename'):
+        task['file_url'] = f'/api/files/{task_id}'
+    task['storage'] = download_store.usage()
+    return jsonify(task)
+
+@app.route('/api/status/<task_id>', methods=['DELETE'])
+def cancel_download(task_id):
+    """取消排队中或正在进行的下载任务"""
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    leader_id = task_id
+    detached = None
+    if task.get('artifact_id'):
+        detached = download_store.detach(task['artifact_id'], task_id)
+        if detached is not None:
+            leader_id, remaining = detached
+            if remaining:
+                # 还有其他任务在等待同一产物，下载继续，只结束当前任务
+                task_store.update(task_id, status='cancelled')
+                return jsonify({
+                    'task_id': task_id,
+                    'status': 'cancelled',
+                    'message': '任务已取消'
+                })
+    
+    # 没有任务再等待该产物，取消实际执行下载的任务
+    cancelled_from = download_scheduler.cancel(leader_id)
+    if cancelled_from is None and detached is None:
+        return jsonify({'error': '任务已结束，无法取消', 'status': task['status']}), 409
+    
+    if cancelled_from == 'queued' and task.get('artifact_id'):
+        download_store.abandon(task['artifact_id'], status='cancelled')
+    if cancelled_from == 'running' and leader_id == task_id:
+        # 正在下载的任务会在下一次进度回调时中止
+        status = 'cancelling'
+    else:
+        status = 'cancelled'
+    task_store.update(task_id, status=status)
+    
+    return jsonify({
+        'task_id': task_id,
+        'status': status,
+        'message': '任务已取消'
+    })
+
+def format_sse(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_task_events(subscription, initial_tasks, close_when_finished=False):
+    """生成SSE事件流：先发送当前状态，之后推送变化，空闲时发送心跳，超过SSE_MAX_DURATION后关闭"""
+    deadline = time.monotonic() + SSE_MAX_DURATION
+    try:
+        for task_id, task in initial_tasks:
+            yield format_sse('task', dict(task, task_id=task_id))
+            if close_when_finished and task['status'] in FINISHED_TASK_STATUSES:
+                return
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # EventSource收到连接关闭后会自动重连
+                yield format_sse('timeout', {'max_duration': SSE_MAX_DURATION})
+                return
+            pending = subscription.drain(min(SSE_HEARTBEAT_INTERVAL, remaining))
+            if not pending:
+                yield ': keepalive\n\n'
+                continue
+            for task_id, task in pending.items():
+                yield format_sse('task', dict(task, task_id=task_id))
+                if close_when_finished and task['status'] in FINISHED_TASK_STATUSES:
+                    return
+    finally:
+        task_events.unsubscribe(subscription)
+
+def stream_slots_full_response():
+    response = jsonify({'error': f'推送连接已达上限（{SSE_MAX_STREAMS}个），请稍后重试或改用轮询/api/status',
+                        'retry_after': SSE_HEARTBEAT_INTERVAL})
+    response.headers['Retry-After'] = str(SSE_HEARTBEAT_INTERVAL)
+    return response, 503
+
+def hold_stream_slot(response):
+    """连接关闭时归还推送连接名额（生成器未开始迭代时finally不会执行，不能依赖它释放）"""
+    response.call_on_close(stream_slots.release)
+    return response
+
+def sse_response(generator):
+    response = Response(generator, content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return hold_stream_slot(response)
+
+@app.route('/api/status/<task_id>/events', methods=['GET'])
+def task_status_events(task_id):
+    """以SSE推送单个任务的状态和进度，任务结束后关闭连接"""
+    if not stream_slots.try_acquire():
+        return stream_slots_full_response()
+    # 先订阅再读取当前状态，避免错过两者之间的更新
+    subscription = task_events.subscribe({task_id})
+    task = task_store.get(task_id)
+    if task is None:
+        task_events.unsubscribe(subscription)
+        stream_slots.release()
+        return jsonify({'error': '任务不存在'}), 404
+    return sse_response(stream_task_events(subscription, [(task_id, task)], close_when_finished=True))
+
+@app.route('/api/events', methods=['GET'])
+def all_task_events():
+    """以SSE推送多个任务的状态和进度（task_ids参数为空时推送所有任务）"""
+    if not stream_slots.try_acquire():
+        return stream_slots_full_response()
+    task_ids = request.args.get('task_ids')
+    task_ids = set(task_ids.split(',')) if task_ids else None
+    subscription = task_events.subscribe(task_ids)
+    initial_tasks = []
+    for task_id in task_ids or ():
+        task = task_store.get(task_id)
+        if task is not None:
+            initial_tasks.append((task_id, task))
+    return sse_response(stream_task_events(subscription, initial_tasks))
+
+def parse_since(value):
+    """把since参数（ISO时间或Unix时间戳）转换为与created_at可比较的ISO字符串"""
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(float(value)).isoformat()
+    except ValueError:
+        return datetime.fromisoformat(value).isoformat()
+
+# 任务列表默认省略的字段
+TASK_LIST_OMITTED_FIELDS = ('segments', 'text')
 
 @app.route('/api/tasks', methods=['GET'])
 def list_tasks():
-    """列出所有任务"""
-    return jsonify({
-        'tasks': download_tasks,
-        'total': len(download_tasks)
+    """分页列出任务，支持status和since过滤"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'limit/offset/since参数格式错误'}), 400
+    
+    tasks, total = task_store.query(
+        status=request.args.get('status'),
+        since=since,
+        limit=limit,
+        offset=offset
+    )
+    # fields作用于每个任务，分页字段总是返回
+    fields = get_fields()
+    if fields is None:
+        # 转录结果可能很大，列表中默认不返回，需要时通过fields显式指定
+        tasks = [(task_id, {key: value for key, value in task.items() if key not in TASK_LIST_OMITTED_FIELDS})
+                 for task_id, task in tasks]
+    next_offset = offset + len(tasks)
+    return metadata_response({
+        'tasks': {task_id: project_fields(task, fields) for task_id, task in tasks},
+        'total': total,
+        'limit': limit,
+        'offset': offset,
+        'next_offset': next_offset if next_offset < total else None,
+        'storage': download_store.usage()
     })
 
+# 下载文件按块读取的大小（仅在服务器不支持sendfile时使用）
+FILE_CHUNK_SIZE = 256 * 1024
+
+def get_file_etag(st):
+    """由inode、大小和修改时间生成强ETag（不含引号）"""
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+def is_if_range_valid(etag, last_modified):
+    """If-Range与当前文件匹配（或未提供）时才按Range返回部分内容"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return last_modified <= if_range.date
+    return True
+
+def iter_file_range(f, length):
+    """从当前位置读取length字节"""
+    try:
+        while length > 0:
+            chunk = f.read(min(FILE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def send_artifact(path, download_name, as_attachment=True):
+    """发送本地文件：支持Range/206、ETag/Last-Modified及条件请求；由服务器的wsgi.file_wrapper走sendfile零拷贝"""
+    f = open(path, 'rb')
+    try:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        etag = get_file_etag(st)
+        last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+        
+        headers = {
+            'ETag': f'"{etag}"',
+            'Last-Modified': http_date(last_modified),
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': 'private, max-age=3600'
+        }
+        disposition = 'attachment' if as_attachment else 'inline'
+        headers['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(download_name)}"
+        content_type = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            f.close()
+            return Response(status=304, headers=headers)
+        
+        start, stop, status = 0, size, 200
+        byte_range = request.range
+        # 只支持单个区间；多区间请求返回完整文件
+        if byte_range is not None and len(byte_range.ranges) == 1 and is_if_range_valid(etag, last_modified):
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                f.close()
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            start, stop = bounds
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        
+        length = stop - start
+        headers['Content-Length'] = str(length)
+        f.seek(start)
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        server = request.environ.get('SERVER_SOFTWARE', '')
+        # gunicorn按当前文件偏移和Content-Length调用sendfile；其他服务器读到文件末尾，部分请求需自行截断
+        if file_wrapper is not None and (stop == size or server.startswith('gunicorn')):
+            body = file_wrapper(f, FILE_CHUNK_SIZE)
+        elif stop == size:
+            body = FileWrapper(f, FILE_CHUNK_SIZE)
+        else:
+            body = iter_file_range(f, length)
+        return Response(body, status=status, headers=headers, content_type=content_type, direct_passthrough=True)
+    except BaseException:
+        f.close()
+        raise
+
+@app.route('/api/files/<task_id>', methods=['GET'])
+def download_task_file(task_id):
+    """下载已完成任务的文件"""
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({'error': '任务不存在'}), 404
+    if task['status'] != 'completed':
+        return jsonify({'error': '任务尚未完成', 'status': task['status']}), 409
+    
+    filename = task.get('filename')
+    # 只允许下载目录中的文件
+    download_root = os.path.realpath(DOWNLOAD_DIR)
+    if not filename or not os.path.realpath(filename).startswith(download_root + os.sep) or not os.path.isfile(filename):
+        return jsonify({'error': '文件不存在或已被清理'}), 410
+    
+    if task.get('artifact_id'):
+        touch_artifact(task['artifact_id'])
+    as_attachment = request.args.get('disposition', 'attachment') != 'inline'
+    return send_artifact(filename, os.path.basename(filename), as_attachment)
+
 @app.route('/api/formats', methods=['GET', 'POST'])
 def get_available_formats():
     """获取可用的下载格式"""
@@ -343,22 +3663,22 @@ def get_available_formats():
         return jsonify({'error': '缺少URL参数'}), 400
     
     try:
-        base_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'listformats': True
-        }
+        # listformats只会向标准输出打印格式表，与其他端点共享同一份提取结果
+        info, cache_status = extract_info_cached(url, cookies_data, get_cache_mode())
+        formats = info.get('formats', [])
         
-        ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            formats = info.get('formats', [])
-            
+        fields = get_fields()
+        if fields is not None:
+            # 按fields裁剪，可选择FORMAT_FIELDS中的任意字段
+            result = project_fields({
+                'title': info.get('title'),
+                'formats': [{key: f.get(key) for key in FORMAT_FIELDS} for f in formats]
+            }, fields)
+        else:
             # 格式化输出
-            result = []
-            for f in formats:
-                result.append({
+            result = {
+                'title': info.get('title'),
+                'formats': [{
                     'format_id': f.get('format_id'),
                     'ext': f.get('ext'),
                     'resolution': f.get('resolution'),
@@ -368,26 +3688,264 @@ def get_available_formats():
                     'vcodec': f.get('vcodec'),
                     'acodec': f.get('acodec'),
                     'format_note': f.get('format_note')
-                })
-            
-            return jsonify({
-                'title': info.get('title'),
-                'formats': result
-            })
-            
+                } for f in formats]
+            }
+        
+        response = metadata_response(result, get_metadata_max_age(info), private=bool(cookies_data))
+        response.headers['X-Cache'] = cache_status
+        return response
+        
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        # 清理临时cookies文件
-        if 'cookiefile' in ydl_opts:
+
+# 客户端可声明接受的音频编码 -> yt-dlp格式中acodec的前缀
+AUDIO_CODECS = {
+    'opus': ('opus',),
+    'aac': ('mp4a', 'aac'),
+    'mp3': ('mp3',),
+    'vorbis': ('vorbis',),
+    'flac': ('flac',),
+}
+AUDIO_CODEC_ALIASES = {'m4a': 'aac', 'mp4a': 'aac', 'ogg': 'vorbis'}
+# 没有可直接封装的格式时转码的目标（FFmpegExtractAudio的preferredcodec）
+AUDIO_TRANSCODE_TARGETS = {'opus': 'opus', 'aac': 'm4a', 'mp3': 'mp3', 'vorbis': 'vorbis', 'flac': 'flac'}
+
+def parse_accept_codecs(value):
+    """解析客户端接受的编码列表（列表或逗号分隔字符串），保持客户端的偏好顺序；'*'表示任意编码"""
+    if isinstance(value, str):
+        value = value.split(',')
+    codecs = []
+    for codec in value or []:
+        codec = str(codec).strip().lower()
+        codec = AUDIO_CODEC_ALIASES.get(codec, codec)
+        if codec != '*' and codec not in AUDIO_CODECS:
+            raise ValueError(f'不支持的音频编码: {codec}')
+        if codec not in codecs:
+            codecs.append(codec)
+    return codecs
+
+# 视频编码族 -> yt-dlp格式中vcodec的前缀
+VIDEO_CODECS = {
+    'avc1': ('avc1', 'avc', 'h264'),
+    'hevc': ('hev1', 'hvc1', 'hevc', 'h265'),
+    'vp9': ('vp9', 'vp09'),
+    'av01': ('av01', 'av1'),
+    'vp8': ('vp8',),
+}
+VIDEO_CODEC_ALIASES = {'h264': 'avc1', 'avc': 'avc1', 'h265': 'hevc', 'av1': 'av01'}
+# 可直接按字节范围播放的协议（不是HLS/DASH清单）
+PROGRESSIVE_PROTOCOLS = ('http', 'https')
+
+def get_codec_family(codec, families):
+    """把yt-dlp的编码字符串（如avc1.64001F、mp4a.40.2）归类为编码族，未知时返回None"""
+    codec = (codec or '').lower()
+    for family, prefixes in families.items():
+        if codec.startswith(prefixes):
+            return family
+    return None
+
+def parse_name_list(value, families=None, aliases=None):
+    """解析逗号分隔字符串或列表，保持顺序；给出families时校验并归一化编码名"""
+    if isinstance(value, str):
+        value = value.split(',')
+    names = []
+    for name in value or []:
+        name = str(name).strip().lower()
+        if not name:
+            continue
+        if families is not None:
+            name = (aliases or {}).get(name, name)
+            if name not in families:
+                raise ValueError(f'不支持的编码: {name}')
+        if name not in names:
+            names.append(name)
+    return names
+
+def parse_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+class FormatPolicy:
+    """声明式格式选择策略
+
+    高度、码率和协议是硬性条件；编码和封装是偏好，按列出的顺序优先选择，strict时也作为硬性条件。
+    数值未知的格式不会被高度和码率条件排除。
+    """
+
+    PARAMS = ('max_height', 'min_height', 'max_bitrate', 'vcodec', 'acodec', 'ext', 'protocol', 'progressive', 'strict')
+
+    def __init__(self, max_height=None, min_height=None, max_bitrate=None, vcodec=(), acodec=(), ext=(),
+                 protocols=(), strict=False):
+        self.max_height = max_height
+        self.min_height = min_height
+        self.max_bitrate = max_bitrate
+        self.vcodec = list(vcodec)
+        self.acodec = list(acodec)
+        self.ext = list(ext)
+        self.protocols = tuple(protocols)
+        self.strict = strict
+
+    @classmethod
+    def from_params(cls, params):
+        """从查询参数或请求体构造策略，参数不合法时抛出ValueError"""
+        def number(name):
+            value = params.get(name)
+            if value in (None, ''):
+                return None
             try:
-                os.unlink(ydl_opts['cookiefile'])
-            except:
-                pass
+                return float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'参数{name}必须是数字')
+        
+        protocols = parse_name_list(params.get('protocol'))
+        if parse_bool(params.get('progressive', '')):
+            protocols = [p for p in protocols if p in PROGRESSIVE_PROTOCOLS] or list(PROGRESSIVE_PROTOCOLS)
+        return cls(
+            max_height=number('max_height'),
+            min_height=number('min_height'),
+            max_bitrate=number('max_bitrate'),
+            vcodec=parse_name_list(params.get('vcodec'), VIDEO_CODECS, VIDEO_CODEC_ALIASES),
+            acodec=parse_name_list(params.get('acodec'), AUDIO_CODECS, AUDIO_CODEC_ALIASES),
+            ext=parse_name_list(params.get('ext')),
+            protocols=protocols,
+            strict=parse_bool(params.get('strict', ''))
+        )
+
+    @staticmethod
+    def _preference(value, preferred):
+        # 列出的越靠前越好，未列出的排在所有列出的之后
+        return -preferred.index(value) if value in preferred else -len(preferred)
+
+    def accepts(self, entry):
+        if self.protocols and entry['protocol'] not in self.protocols:
+            return False
+        if self.max_bitrate is not None and entry['bitrate'] and entry['bitrate'] > self.max_bitrate:
+            return False
+        if entry['kind'] != 'audio' and entry['height']:
+            if self.max_height is not None and entry['height'] > self.max_height:
+                return False
+            if self.min_height is not None and entry['height'] < self.min_height:
+                return False
+        if self.strict:
+            if self.vcodec and entry['kind'] != 'audio' and entry['vcodec'] not in self.vcodec:
+                return False
+            if self.acodec and entry['kind'] != 'video' and entry['acodec'] not in self.acodec:
+                return False
+            if self.ext and entry['ext'] not in self.ext:
+                return False
+        return True
+
+    def rank(self, entry):
+        """排序键：编码偏好 > 封装偏好 > 高度 > 帧率 > 码率"""
+        return (
+            self._preference(entry['vcodec'], self.vcodec) if entry['kind'] != 'audio' else 0,
+            self._preference(entry['acodec'], self.acodec) if entry['kind'] != 'video' else 0,
+            self._preference(entry['ext'], self.ext),
+            entry['height'] or 0,
+            entry['fps'] or 0,
+            entry['bitrate'] or 0
+        )
+
+DEFAULT_FORMAT_POLICY = FormatPolicy()
+
+class FormatIndex:
+    """一个视频的格式索引：提取结果只遍历一次，按纯音频/音视频合一/纯视频分组并规范化编码、封装、高度、码率和协议"""
+
+    def __init__(self, formats):
+        self.entries = {'audio': [], 'muxed': [], 'video': []}
+        for fmt in formats or []:
+            vcodec, acodec = fmt.get('vcodec'), fmt.get('acodec')
+            if vcodec == 'none' and acodec == 'none':
+                # 故事板等非媒体格式
+                continue
+            kind = 'audio' if vcodec == 'none' else 'video' if acodec == 'none' else 'muxed'
+            if kind == 'audio':
+                bitrate = fmt.get('abr') or fmt.get('tbr')
+            else:
+                bitrate = fmt.get('tbr') or fmt.get('vbr')
+            self.entries[kind].append({
+                'format': fmt,
+                'kind': kind,
+                'vcodec': get_codec_family(vcodec, VIDEO_CODECS),
+                'acodec': get_codec_family(acodec, AUDIO_CODECS),
+                'ext': fmt.get('ext'),
+                'height': fmt.get('height'),
+                'fps': fmt.get('fps'),
+                'bitrate': bitrate,
+                'protocol': fmt.get('protocol') or 'https'
+            })
+
+    def best(self, kind, policy=DEFAULT_FORMAT_POLICY):
+        """返回满足策略的排序最高的格式，排序相同时取先出现的，没有时返回None"""
+        best, best_rank = None, None
+        for entry in self.entries[kind]:
+            if not policy.accepts(entry):
+                continue
+            rank = policy.rank(entry)
+            if best is None or rank > best_rank:
+                best, best_rank = entry['format'], rank
+        return best
+
+    def best_streams(self, policy=DEFAULT_FORMAT_POLICY):
+        """返回(最佳音频, 最佳视频)；视频优先选音视频合一的格式，没有时选纯视频"""
+        return self.best('audio', policy), self.best('muxed', policy) or self.best('video', policy)
+
+def get_format_index(info):
+    """返回info的格式索引：info来自提取缓存时索引挂在缓存条目上，只建立一次；否则临时建立"""
+    index = extract_cache.format_index(info)
+    return index if index is not None else FormatIndex(info.get('formats'))
+
+def get_format_policy():
+    """从查询参数或JSON请求体读取格式选择策略，参数不合法时抛出ValueError"""
+    params = request.args.to_dict()
+    if request.method == 'POST':
+        params.update(request.get_json(silent=True) or {})
+    if not any(params.get(name) not in (None, '') for name in FormatPolicy.PARAMS):
+        return DEFAULT_FORMAT_POLICY
+    return FormatPolicy.from_params(params)
+
+def negotiate_audio_format(info, accept_codecs):
+    """在纯音频格式中选出客户端可直接播放的格式：先按客户端的编码偏好，再按码率
+
+    返回(格式, 编码)，没有匹配的格式时返回(None, None)。
+    """
+    fmt = get_format_index(info).best('audio', FormatPolicy(acodec=accept_codecs, strict=True))
+    if fmt is None:
+        return None, None
+    return fmt, get_codec_family(fmt.get('acodec'), AUDIO_CODECS)
+
+def build_audio_options(url, accept_codecs, cookies_data=None):
+    """根据客户端接受的编码生成下载选项，返回(选项, 协商结果)
+
+    有匹配的格式时只转换封装、复制音频流；否则转码为客户端偏好的第一个编码。
+    """
+    if '*' in accept_codecs:
+        # 任意编码都可以：直接取最佳音频，只在需要时转换为纯音频封装
+        return {
+            'format': 'bestaudio/best',
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'best'}]
+        }, {'mode': 'remux', 'codec': None}
+    
+    info, _ = extract_info_cached(url, cookies_data)
+    fmt, codec = negotiate_audio_format(info, accept_codecs)
+    if fmt is not None:
+        prefix = AUDIO_CODECS[codec][0]
+        return {
+            # 下载时格式ID失效则退回同编码的最佳音频，保证仍可直接封装
+            'format': f"{fmt['format_id']}/bestaudio[acodec^={prefix}]",
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'best'}]
+        }, {'mode': 'remux', 'codec': codec, 'format_id': fmt['format_id'], 'abr': fmt.get('abr')}
+    
+    target = accept_codecs[0]
+    postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': AUDIO_TRANSCODE_TARGETS[target]}
+    if target != 'flac':
+        postprocessor['preferredquality'] = '192'
+    return {'format': 'bestaudio/best', 'postprocessors': [postprocessor]}, {'mode': 'transcode', 'codec': target}
 
 @app.route('/api/audio', methods=['POST'])
 def download_audio_only():
-    """仅下载音频"""
+    """仅下载音频：声明accept_codecs时协商编码，优先只转换封装不重新编码"""
     data = request.get_json()
     if not data or 'url' not in data:
         return jsonify({'error': '缺少URL参数'}), 400
@@ -395,44 +3953,61 @@ def download_audio_only():
     url = data['url']
     cookies_data = data.get('cookies')
     
-    # 音频专用选项
-    audio_options = {
-        'format': 'bestaudio/best',
-        'outtmpl': f'{DOWNLOAD_DIR}/%(title)s.%(ext)s',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }]
-    }
+    try:
+        accept_codecs = parse_accept_codecs(data.get('accept_codecs'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'codecs': list(AUDIO_CODECS)}), 400
+    try:
+        connections = get_download_connections(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # 合并cookies配置
-    audio_options = get_ydl_opts_with_cookies(audio_options, cookies_data)
+    if accept_codecs:
+        try:
+            audio_options, negotiation = build_audio_options(url, accept_codecs, cookies_data)
+        except UpstreamThrottled as e:
+            return throttled_response(e)
+        except Exception as e:
+            return jsonify({'error': f'获取音频格式失败: {str(e)}'}), 500
+    else:
+        # 未声明编码时保持原有行为：转码为192kbps的mp3
+        audio_options = {
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }]
+        }
+        negotiation = {'mode': 'transcode', 'codec': 'mp3'}
+    audio_options['segment_connections'] = connections
     
     # 生成任务ID
     task_id = str(uuid.uuid4())
     
     # 初始化任务状态
-    download_tasks[task_id] = {
-        'status': 'pending',
+    task_store.create(task_id, {
+        'status': 'queued',
         'url': url,
         'type': 'audio_only',
         'created_at': datetime.now().isoformat(),
         'progress': {},
         'filename': None,
+        'audio': negotiation,
         'error': None
-    }
+    })
     
-    # 启动后台下载线程
-    thread = threading.Thread(target=download_video, args=(url, task_id, audio_options))
-    thread.daemon = True
-    thread.start()
+    # 放入下载队列
+    try:
+        result = enqueue_download(task_id, url, audio_options, 'audio_only', cookies_data, data.get('priority'))
+    except DownloadQueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 503
     
-    return jsonify({
-        'task_id': task_id,
-        'status': 'pending',
-        'message': '音频下载任务已创建'
-    })
+    result['audio'] = negotiation
+    result['message'] = '音频下载任务已创建'
+    return jsonify(result)
 
 @app.route('/api/stream-links', methods=['GET', 'POST'])
 def get_stream_links():
@@ -460,176 +4035,451 @@ def get_stream_links():
         return jsonify({'error': '缺少URL参数'}), 400
     
     try:
-        base_opts = {
-            'quiet': True,
-            'no_warnings': True,
+        policy = get_format_policy()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        info, cache_status = extract_info_cached(url, cookies_data, get_cache_mode())
+        
+        # 按策略选择最佳音频流和视频流（优先音视频合一，没有时选纯视频）
+        best_audio, best_video = get_format_index(info).best_streams(policy)
+        
+        result = {
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'uploader': info.get('uploader'),
+            'thumbnail': info.get('thumbnail'),
+            'audio_stream': {
+                'url': best_audio.get('url') if best_audio else None,
+                'format_id': best_audio.get('format_id') if best_audio else None,
+                'ext': best_audio.get('ext') if best_audio else None,
+                'abr': best_audio.get('abr') if best_audio else None,
+                'acodec': best_audio.get('acodec') if best_audio else None,
+                'filesize': best_audio.get('filesize') if best_audio else None
+            } if best_audio else None,
+            'video_stream': {
+                'url': best_video.get('url') if best_video else None,
+                'format_id': best_video.get('format_id') if best_video else None,
+                'ext': best_video.get('ext') if best_video else None,
+                'resolution': best_video.get('resolution') if best_video else None,
+                'height': best_video.get('height') if best_video else None,
+                'width': best_video.get('width') if best_video else None,
+                'vcodec': best_video.get('vcodec') if best_video else None,
+                'acodec': best_video.get('acodec') if best_video else None,
+                'fps': best_video.get('fps') if best_video else None,
+                'filesize': best_video.get('filesize') if best_video else None
+            } if best_video else None
         }
         
-        ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
+        response = jsonify(result)
+        response.headers['X-Cache'] = cache_status
+        return response
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # 获取所有格式
-            formats = info.get('formats', [])
-            
-            # 找到最佳音频流
-            best_audio = None
-            for f in formats:
-                if f.get('acodec') != 'none' and f.get('vcodec') == 'none':  # 纯音频
-                    if not best_audio or (f.get('abr', 0) > best_audio.get('abr', 0)):
-                        best_audio = f
-            
-            # 找到最佳视频流（带音频）
-            best_video = None
-            for f in formats:
-                if f.get('vcodec') != 'none' and f.get('acodec') != 'none':  # 视频+音频
-                    if not best_video or (f.get('height', 0) > best_video.get('height', 0)):
-                        best_video = f
-            
-            # 如果没有找到带音频的视频，找最佳纯视频
-            if not best_video:
-                for f in formats:
-                    if f.get('vcodec') != 'none':  # 纯视频
-                        if not best_video or (f.get('height', 0) > best_video.get('height', 0)):
-                            best_video = f
-            
-            result = {
-                'title': info.get('title'),
-                'duration': info.get('duration'),
-                'uploader': info.get('uploader'),
-                'thumbnail': info.get('thumbnail'),
-                'audio_stream': {
-                    'url': best_audio.get('url') if best_audio else None,
-                    'format_id': best_audio.get('format_id') if best_audio else None,
-                    'ext': best_audio.get('ext') if best_audio else None,
-                    'abr': best_audio.get('abr') if best_audio else None,
-                    'acodec': best_audio.get('acodec') if best_audio else None,
-                    'filesize': best_audio.get('filesize') if best_audio else None
-                } if best_audio else None,
-                'video_stream': {
-                    'url': best_video.get('url') if best_video else None,
-                    'format_id': best_video.get('format_id') if best_video else None,
-                    'ext': best_video.get('ext') if best_video else None,
-                    'resolution': best_video.get('resolution') if best_video else None,
-                    'height': best_video.get('height') if best_video else None,
-                    'width': best_video.get('width') if best_video else None,
-                    'vcodec': best_video.get('vcodec') if best_video else None,
-                    'acodec': best_video.get('acodec') if best_video else None,
-                    'fps': best_video.get('fps') if best_video else None,
-                    'filesize': best_video.get('filesize') if best_video else None
-                } if best_video else None
-            }
-            
-            return jsonify(result)
-            
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+# 上游媒体连接池与转发配置
+STREAM_POOL_SIZE = int(os.environ.get('STREAM_POOL_SIZE', 32))
+STREAM_CHUNK_MIN = int(os.environ.get('STREAM_CHUNK_MIN', 64 * 1024))
+STREAM_CHUNK_MAX = int(os.environ.get('STREAM_CHUNK_MAX', 1024 * 1024))
+STREAM_UPSTREAM_TIMEOUT = int(os.environ.get('STREAM_UPSTREAM_TIMEOUT', 30))
+
+# 转发给上游的客户端请求头
+FORWARD_REQUEST_HEADERS = ('Range', 'If-Range')
+# 从上游透传给客户端的响应头
+PASSTHROUGH_RESPONSE_HEADERS = ('Content-Range', 'Content-Length', 'Accept-Ranges', 'Last-Modified', 'ETag')
+
+DEFAULT_STREAM_HEADERS = {
+    'User-Agent': 'yt-dlp/2023.09.24',
+    'Accept': '*/*',
+}
+
+def create_upstream_session(pool_size=STREAM_POOL_SIZE):
+    """创建带keep-alive连接池的上游会话，所有流式请求共享"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+upstream_session = create_upstream_session()
+# 分段下载在任务进程中使用独立的连接池，大小与全局连接上限一致
+download_session = create_upstream_session(DOWNLOAD_MAX_CONNECTIONS)
+
+def open_upstream(media_url, headers=None, forward_range=True):
+    """通过共享连接池打开上游媒体流，并转发客户端的Range请求头（转码时输出与上游字节不对应，不转发）"""
+    request_headers = dict(headers or DEFAULT_STREAM_HEADERS)
+    for name in FORWARD_REQUEST_HEADERS:
+        if forward_range and name in request.headers:
+            request_headers[name] = request.headers[name]
+    return upstream_session.get(media_url, headers=request_headers, stream=True, timeout=STREAM_UPSTREAM_TIMEOUT)
+
+def open_governed_upstream(extractor, media_url, headers=None, forward_range=True):
+    """在媒体请求预算内打开上游；上游返回429时按Retry-After退避（403可能只是令牌链接过期，由调用方判断）"""
+    acquire_upstream('media', extractor)
+    upstream = open_upstream(media_url, headers, forward_range)
+    if upstream.status_code == 429:
+        try:
+            retry_after = float(upstream.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        report_upstream('media', extractor, 'default', True, retry_after)
+    elif upstream.status_code != 403:
+        report_upstream('media', extractor, 'default', False)
+    return upstream
+
+def relay_upstream(upstream, source='extract'):
+    """转发上游数据，读取快时增大块大小，读取慢时减小块大小"""
+    chunk_size = STREAM_CHUNK_MIN
+    relay_started = time.time()
+    relayed = 0
+    try:
+        while True:
+            started = time.time()
+            chunk = upstream.raw.read(chunk_size)
+            if not chunk:
+                break
+            elapsed = time.time() - started
+            relayed += len(chunk)
+            STREAM_BYTES.inc(source, amount=len(chunk))
+            yield chunk
+            if len(chunk) == chunk_size and elapsed < 0.05:
+                chunk_size = min(chunk_size * 2, STREAM_CHUNK_MAX)
+            elif elapsed > 0.5:
+                chunk_size = max(chunk_size // 2, STREAM_CHUNK_MIN)
+    except Exception as e:
+        print(f"流式下载错误: {e}")
     finally:
-        # 清理临时cookies文件
-        if cookies_data and cookies_data.get('cookies_text') and 'cookiefile' in ydl_opts:
-            try:
-                os.unlink(ydl_opts['cookiefile'])
-            except:
-                pass
+        # 客户端断开（例如拖动进度条）时释放上游连接
+        upstream.close()
+        duration = time.time() - relay_started
+        if relayed and duration > 0:
+            STREAM_THROUGHPUT.observe(relayed / duration, source)
+
+def build_stream_response(upstream, content_type=None, source='extract'):
+    """根据上游响应构造代理响应，透传200/206状态及Content-Range/Content-Length"""
+    if upstream.status_code == 416:
+        upstream.close()
+        response = Response(status=416)
+        if 'Content-Range' in upstream.headers:
+            response.headers['Content-Range'] = upstream.headers['Content-Range']
+        return response
+    if upstream.status_code not in (200, 206):
+        upstream.close()
+        return jsonify({'error': f'上游返回错误状态码: {upstream.status_code}'}), 502
+    
+    upstream_type = upstream.headers.get('Content-Type', '')
+    if upstream_type.startswith(('video/', 'audio/')):
+        content_type = upstream_type
+    
+    response = Response(relay_upstream(upstream, source), status=upstream.status_code, content_type=content_type or 'video/mp4')
+    for name in PASSTHROUGH_RESPONSE_HEADERS:
+        if name in upstream.headers:
+            response.headers[name] = upstream.headers[name]
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def get_stream_content_type(ext):
+    """根据扩展名返回Content-Type"""
+    content_type = 'video/mp4'
+    if ext == 'webm':
+        content_type = 'video/webm'
+    elif ext == 'm4a':
+        content_type = 'audio/mp4'
+    elif ext == 'mp3':
+        content_type = 'audio/mpeg'
+    return content_type
+
+# 播放令牌签名密钥；多实例部署时必须通过环境变量设置为相同的值（单实例的生产模式由serve()生成并传给所有工作进程）
+STREAM_TOKEN_SECRET = os.environ.get('STREAM_TOKEN_SECRET', '').encode('utf-8') or os.urandom(32)
+
+class InvalidStreamToken(Exception):
+    """播放令牌格式或签名无效"""
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+def sign_stream_token(video_id, fmt):
+    """生成HMAC签名的播放令牌，绑定上游格式URL、请求头和过期时间"""
+    match = EXPIRE_PARAM_RE.search(fmt.get('url', ''))
+    expire = int(match.group(1)) if match else int(time.time()) + EXTRACT_CACHE_DEFAULT_TTL
+    payload = {
+        'v': video_id,
+        'f': fmt.get('format_id'),
+        'u': fmt.get('url', ''),
+        'h': fmt.get('http_headers') or {},
+        'x': fmt.get('ext'),
+        'a': fmt.get('acodec'),
+        'exp': expire
+    }
+    body = _b64encode(zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8')))
+    signature = _b64encode(hmac.new(STREAM_TOKEN_SECRET, body, hashlib.sha256).digest())
+    return (body + b'.' + signature).decode('ascii')
+
+def verify_stream_token(token):
+    """校验播放令牌签名并返回载荷（不检查是否过期）"""
+    try:
+        body, signature = token.encode('ascii').split(b'.')
+        expected = _b64encode(hmac.new(STREAM_TOKEN_SECRET, body, hashlib.sha256).digest())
+        if not hmac.compare_digest(signature, expected):
+            raise InvalidStreamToken('播放令牌签名无效')
+        return json.loads(zlib.decompress(_b64decode(body)))
+    except InvalidStreamToken:
+        raise
+    except Exception:
+        raise InvalidStreamToken('播放令牌格式错误')
+
+def resolve_stream_format(video_id, format_id, policy=DEFAULT_FORMAT_POLICY):
+    """重新提取视频并返回要代理的格式及其扩展名，找不到时抛出LookupError"""
+    # 构建YouTube URL
+    youtube_url = f"https://www.youtube.com/watch?v={video_id}"
+    
+    # 配置yt-dlp选项
+    ydl_opts = {
+        'format': format_id,
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,
+    }
+    
+    with ydl_pool.lease(ydl_opts) as ydl:
+        # 获取视频信息
+        info = timed_extract_info(ydl, youtube_url, download=False)
+    
+    if not info:
+        raise LookupError('无法获取视频信息')
+    
+    # 获取最佳格式的URL；客户端给出选择策略时以策略为准
+    if 'url' in info and policy is DEFAULT_FORMAT_POLICY:
+        return info, info.get('ext')
+    if 'formats' in info and info['formats']:
+        # 按策略选择，优先音视频合一
+        index = get_format_index(info)
+        best_format = index.best('muxed', policy) or index.best('video', policy) or index.best('audio', policy)
+        
+        if not best_format or 'url' not in best_format:
+            raise LookupError('无法找到可用的视频流')
+        return best_format, best_format.get('ext') or info.get('ext')
+    raise LookupError('无法找到视频URL')
+
+def open_format_upstream(video_id, format_id, token=None, forward_range=True, policy=DEFAULT_FORMAT_POLICY):
+    """打开要代理的上游格式：令牌有效时直接使用，令牌无效、过期或上游返回403时重新提取
+
+    返回(上游响应, 格式信息{ext, acodec}, 来源token/extract)；找不到格式时抛出LookupError。
+    """
+    extractor = resolve_extractor_identity(f"https://www.youtube.com/watch?v={video_id}")[0]
+    payload = None
+    if token:
+        try:
+            payload = verify_stream_token(token)
+            if payload.get('v') != video_id:
+                raise InvalidStreamToken('播放令牌与视频ID不匹配')
+        except InvalidStreamToken as e:
+            # 令牌无效（例如密钥已更换）时不中断播放，按普通请求重新提取
+            print(f"忽略无效的播放令牌: {e}")
+            payload = None
+    if payload:
+        format_id = payload.get('f') or format_id
+        
+        # 令牌有效时直接代理，无需重新提取
+        if payload['exp'] > time.time():
+            upstream = open_governed_upstream(extractor, payload['u'], payload['h'], forward_range)
+            if upstream.status_code != 403:
+                return upstream, {'ext': payload.get('x'), 'acodec': payload.get('a')}, 'token'
+            upstream.close()
+        # 令牌已过期或上游返回403，回退到重新提取
+    
+    best_format, ext = resolve_stream_format(video_id, format_id, policy)
+    upstream = open_governed_upstream(extractor, best_format['url'], best_format.get('http_headers'), forward_range)
+    if upstream.status_code == 403:
+        # 刚提取的链接也被拒绝，说明被上游拦截
+        report_upstream('media', extractor, 'default', True)
+    return upstream, {'ext': ext, 'acodec': best_format.get('acodec')}, 'extract'
 
 @app.route('/api/stream/<path:video_id>', methods=['GET'])
 def stream_video(video_id):
-    """直接流式传输视频内容"""
+    """直接流式传输视频内容（支持Range请求和签名播放令牌）"""
     try:
         # 从查询参数获取格式信息
         format_id = request.args.get('format', 'best')
         
-        # 构建YouTube URL
-        youtube_url = f"https://www.youtube.com/watch?v={video_id}"
+        try:
+            policy = get_format_policy()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # 配置yt-dlp选项
-        ydl_opts = {
-            'format': format_id,
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-        }
+        try:
+            upstream, fmt, source = open_format_upstream(video_id, format_id, request.args.get('token'), policy=policy)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # 获取视频信息
-            info = ydl.extract_info(youtube_url, download=False)
-            
-            if not info:
-                return jsonify({'error': '无法获取视频信息'}), 404
-            
-            # 获取最佳格式的URL
-            if 'url' in info:
-                video_url = info['url']
-            elif 'formats' in info and info['formats']:
-                # 选择最佳格式
-                formats = info['formats']
-                best_format = None
-                for fmt in formats:
-                    if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none':
-                        best_format = fmt
-                        break
-                if not best_format and formats:
-                    best_format = formats[-1]
-                
-                if best_format and 'url' in best_format:
-                    video_url = best_format['url']
-                else:
-                    return jsonify({'error': '无法找到可用的视频流'}), 404
-            else:
-                return jsonify({'error': '无法找到视频URL'}), 404
-            
-            # 使用yt-dlp内置的下载功能获取视频数据
-            def generate():
-                try:
-                    # 创建临时的yt-dlp实例用于流式下载
-                    stream_opts = {
-                        'format': format_id,
-                        'quiet': True,
-                        'no_warnings': True,
-                    }
-                    
-                    with yt_dlp.YoutubeDL(stream_opts) as stream_ydl:
-                        # 直接获取视频数据流
-                        headers = {
-                            'User-Agent': 'yt-dlp/2023.09.24',
-                            'Accept': '*/*',
-                        }
-                        
-                        import requests
-                        response = requests.get(video_url, headers=headers, stream=True, timeout=30)
-                        
-                        if response.status_code == 200:
-                            for chunk in response.iter_content(chunk_size=8192):
-                                if chunk:
-                                    yield chunk
-                        else:
-                            yield b''
-                            
-                except Exception as e:
-                    print(f"流式下载错误: {e}")
-                    yield b''
-            
-            # 设置适当的Content-Type
-            content_type = 'video/mp4'
-            if 'ext' in info:
-                ext = info['ext']
-                if ext == 'webm':
-                    content_type = 'video/webm'
-                elif ext == 'm4a':
-                    content_type = 'audio/mp4'
-                elif ext == 'mp3':
-                    content_type = 'audio/mpeg'
-            
-            flask_response = Response(generate(), content_type=content_type)
-            flask_response.headers['Cache-Control'] = 'no-cache'
-            flask_response.headers['Accept-Ranges'] = 'bytes'
-            
-            return flask_response
+        response = build_stream_response(upstream, get_stream_content_type(fmt['ext']), source)
+        if isinstance(response, Response):
+            response.headers['X-Stream-Source'] = source
+        return response
             
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         return jsonify({'error': f'视频流失败: {str(e)}'}), 500
 
+# 实时转码的输出目标：输出编码、转码参数、可流式输出的封装参数和Content-Type
+# 上游音频已是输出编码时只转换封装（-c:a copy）
+TRANSCODE_TARGETS = {
+    'mp3': {'codec': 'mp3', 'encode': ['-c:a', 'libmp3lame', '-b:a', '192k'], 'mux': ['-f', 'mp3'],
+            'content_type': 'audio/mpeg'},
+    'aac': {'codec': 'aac', 'encode': ['-c:a', 'aac', '-b:a', '160k'], 'mux': ['-f', 'adts'],
+            'content_type': 'audio/aac'},
+    'm4a': {'codec': 'aac', 'encode': ['-c:a', 'aac', '-b:a', '160k'],
+            'mux': ['-f', 'ipod', '-movflags', 'frag_keyframe+empty_moov+default_base_moof'],
+            'content_type': 'audio/mp4'},
+    'opus': {'codec': 'opus', 'encode': ['-c:a', 'libopus', '-b:a', '128k'], 'mux': ['-f', 'ogg'],
+             'content_type': 'audio/ogg'},
+    'webm': {'codec': 'opus', 'encode': ['-c:a', 'libopus', '-b:a', '128k'], 'mux': ['-f', 'webm'],
+             'content_type': 'audio/webm'},
+    'flac': {'codec': 'flac', 'encode': ['-c:a', 'flac'], 'mux': ['-f', 'flac'],
+             'content_type': 'audio/flac'},
+}
+
+def build_transcode_command(target, copy):
+    """ffmpeg从标准输入读取上游数据，向标准输出写出可流式播放的封装，不落盘"""
+    codec_args = ['-c:a', 'copy'] if copy else target['encode']
+    return ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', '-map', '0:a:0', '-vn',
+            *codec_args, *target['mux'], '-flush_packets', '1', 'pipe:1']
+
+def feed_transcoder(upstream, stdin):
+    """把上游数据写入ffmpeg：ffmpeg处理不过来时管道写满，写入阻塞，不再继续读取上游"""
+    try:
+        while True:
+            chunk = upstream.raw.read(STREAM_CHUNK_MIN)
+            if not chunk:
+                break
+            stdin.write(chunk)
+    except (BrokenPipeError, ValueError, OSError):
+        # ffmpeg已退出或响应已结束
+        pass
+    except Exception as e:
+        print(f"转码输入错误: {e}")
+    finally:
+        upstream.close()
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+def collect_stderr(stream, lines):
+    for line in stream:
+        lines.append(line)
+
+class TranscodeRelay:
+    """转发ffmpeg输出
+
+    客户端读取慢时不再读取ffmpeg输出，ffmpeg写满管道后停止读取输入，写入线程随之停止读取上游，
+    内存占用只有管道缓冲区。close()可重复调用：响应还没开始迭代就被关闭时也能结束ffmpeg并归还空位。
+    """
+
+    def __init__(self, process, feeder, stderr_lines, first_chunk):
+        self.process = process
+        self.feeder = feeder
+        self.stderr_lines = stderr_lines
+        self.first_chunk = first_chunk
+        self.relayed = 0
+        self.started = time.time()
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            chunk = self.first_chunk
+            while chunk:
+                self.relayed += len(chunk)
+                STREAM_BYTES.inc('transcode', amount=len(chunk))
+                yield chunk
+                chunk = os.read(self.process.stdout.fileno(), STREAM_CHUNK_MAX)
+            if self.process.wait() != 0:
+                print(f"转码失败: {''.join(self.stderr_lines).strip()[-300:]}")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # 客户端断开时结束ffmpeg，写入线程随之因管道关闭退出并释放上游连接
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        self.feeder.join()
+        ffmpeg_limiter.release()
+        duration = time.time() - self.started
+        if self.relayed and duration > 0:
+            STREAM_THROUGHPUT.observe(self.relayed / duration, 'transcode')
+
+@app.route('/api/transcode/<path:video_id>', methods=['GET'])
+def transcode_stream(video_id):
+    """实时转码/转换封装：上游数据经ffmpeg管道直接输出为分块响应，不写入磁盘"""
+    target_name = request.args.get('to', 'mp3').lower()
+    target = TRANSCODE_TARGETS.get(target_name)
+    if target is None:
+        return jsonify({'error': f'不支持的输出格式: {target_name}', 'targets': list(TRANSCODE_TARGETS)}), 400
+    format_id = request.args.get('format', 'bestaudio/best')
+    
+    if not ffmpeg_limiter.try_acquire():
+        response = jsonify({'error': 'ffmpeg进程已达上限，请稍后重试'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    process = None
+    try:
+        try:
+            upstream, fmt, source = open_format_upstream(video_id, format_id, request.args.get('token'), forward_range=False)
+        except LookupError as e:
+            ffmpeg_limiter.release()
+            return jsonify({'error': str(e)}), 404
+        except UpstreamThrottled as e:
+            ffmpeg_limiter.release()
+            return throttled_response(e)
+        if upstream.status_code != 200:
+            upstream.close()
+            ffmpeg_limiter.release()
+            return jsonify({'error': f'上游返回错误状态码: {upstream.status_code}'}), 502
+        
+        acodec = (fmt.get('acodec') or '').lower()
+        copy = bool(acodec) and get_codec_family(acodec, AUDIO_CODECS) == target['codec']
+        process = subprocess.Popen(build_transcode_command(target, copy), stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=False)
+        stderr_lines = deque(maxlen=20)
+        threading.Thread(target=collect_stderr, args=(io.TextIOWrapper(process.stderr, errors='replace'), stderr_lines),
+                         daemon=True).start()
+        feeder = threading.Thread(target=feed_transcoder, args=(upstream, process.stdin), daemon=True)
+        feeder.start()
+        
+        # 等到ffmpeg输出第一块数据再返回响应头，启动失败时仍可返回错误状态码
+        relay = TranscodeRelay(process, feeder, stderr_lines, os.read(process.stdout.fileno(), STREAM_CHUNK_MAX))
+        if not relay.first_chunk:
+            relay.close()
+            return jsonify({'error': f"转码失败: {''.join(stderr_lines).strip()[-300:]}"}), 502
+    except Exception as e:
+        if process is not None:
+            process.kill()
+            process.wait()
+        ffmpeg_limiter.release()
+        return jsonify({'error': f'转码失败: {str(e)}'}), 500
+    
+    response = Response(iter(relay), content_type=target['content_type'])
+    response.call_on_close(relay.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Stream-Source'] = source
+    response.headers['X-Transcode-Mode'] = 'copy' if copy else 'transcode'
+    return response
+
 @app.route('/api/playable-links', methods=['GET', 'POST'])
 def get_playable_links():
     """获取可直接播放的视频链接（通过代理）"""
@@ -656,94 +4506,206 @@ def get_playable_links():
         return jsonify({'error': '缺少URL参数'}), 400
     
     try:
-        base_opts = {
-            'quiet': True,
-            'no_warnings': True,
+        policy = get_format_policy()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        info, cache_status = extract_info_cached(url, cookies_data, get_cache_mode())
+        
+        # 提取视频ID
+        video_id = info.get('id', '')
+        
+        # 按策略选择最佳音频流和视频流（优先音视频合一，没有时选纯视频）
+        best_audio, best_video = get_format_index(info).best_streams(policy)
+        
+        # 获取服务器基础URL
+        base_url = request.url_root.rstrip('/')
+        
+        result = {
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'uploader': info.get('uploader'),
+            'thumbnail': info.get('thumbnail'),
+            'audio_stream': {
+                'playable_url': f"{base_url}/api/stream/{video_id}?format={best_audio.get('format_id', 'bestaudio')}&token={sign_stream_token(video_id, best_audio)}" if best_audio else None,
+                'original_url': best_audio.get('url') if best_audio else None,
+                'format_id': best_audio.get('format_id') if best_audio else None,
+                'ext': best_audio.get('ext') if best_audio else None,
+                'abr': best_audio.get('abr') if best_audio else None,
+                'acodec': best_audio.get('acodec') if best_audio else None,
+                'filesize': best_audio.get('filesize') if best_audio else None
+            } if best_audio else None,
+            'video_stream': {
+                'playable_url': f"{base_url}/api/stream/{video_id}?format={best_video.get('format_id', 'best')}&token={sign_stream_token(video_id, best_video)}" if best_video else None,
+                'original_url': best_video.get('url') if best_video else None,
+                'format_id': best_video.get('format_id') if best_video else None,
+                'ext': best_video.get('ext') if best_video else None,
+                'resolution': best_video.get('resolution') if best_video else None,
+                'height': best_video.get('height') if best_video else None,
+                'width': best_video.get('width') if best_video else None,
+                'vcodec': best_video.get('vcodec') if best_video else None,
+                'acodec': best_video.get('acodec') if best_video else None,
+                'fps': best_video.get('fps') if best_video else None,
+                'filesize': best_video.get('filesize') if best_video else None
+            } if best_video else None
         }
         
-        ydl_opts = get_ydl_opts_with_cookies(base_opts, cookies_data)
+        response = jsonify(result)
+        response.headers['X-Cache'] = cache_status
+        return response
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # 提取视频ID
-            video_id = info.get('id', '')
-            
-            # 获取所有格式
-            formats = info.get('formats', [])
-            
-            # 找到最佳音频流
-            best_audio = None
-            for f in formats:
-                if f.get('acodec') != 'none' and f.get('vcodec') == 'none':  # 纯音频
-                    if not best_audio or (f.get('abr', 0) > best_audio.get('abr', 0)):
-                        best_audio = f
-            
-            # 找到最佳视频流（带音频）
-            best_video = None
-            for f in formats:
-                if f.get('vcodec') != 'none' and f.get('acodec') != 'none':  # 视频+音频
-                    if not best_video or (f.get('height', 0) > best_video.get('height', 0)):
-                        best_video = f
-            
-            # 如果没有找到带音频的视频，找最佳纯视频
-            if not best_video:
-                for f in formats:
-                    if f.get('vcodec') != 'none':  # 纯视频
-                        if not best_video or (f.get('height', 0) > best_video.get('height', 0)):
-                            best_video = f
-            
-            # 获取服务器基础URL
-            base_url = request.url_root.rstrip('/')
-            
-            result = {
-                'title': info.get('title'),
-                'duration': info.get('duration'),
-                'uploader': info.get('uploader'),
-                'thumbnail': info.get('thumbnail'),
-                'audio_stream': {
-                    'playable_url': f"{base_url}/api/stream/{video_id}?format={best_audio.get('format_id', 'bestaudio')}" if best_audio else None,
-                    'original_url': best_audio.get('url') if best_audio else None,
-                    'format_id': best_audio.get('format_id') if best_audio else None,
-                    'ext': best_audio.get('ext') if best_audio else None,
-                    'abr': best_audio.get('abr') if best_audio else None,
-                    'acodec': best_audio.get('acodec') if best_audio else None,
-                    'filesize': best_audio.get('filesize') if best_audio else None
-                } if best_audio else None,
-                'video_stream': {
-                    'playable_url': f"{base_url}/api/stream/{video_id}?format={best_video.get('format_id', 'best')}" if best_video else None,
-                    'original_url': best_video.get('url') if best_video else None,
-                    'format_id': best_video.get('format_id') if best_video else None,
-                    'ext': best_video.get('ext') if best_video else None,
-                    'resolution': best_video.get('resolution') if best_video else None,
-                    'height': best_video.get('height') if best_video else None,
-                    'width': best_video.get('width') if best_video else None,
-                    'vcodec': best_video.get('vcodec') if best_video else None,
-                    'acodec': best_video.get('acodec') if best_video else None,
-                    'fps': best_video.get('fps') if best_video else None,
-                    'filesize': best_video.get('filesize') if best_video else None
-                } if best_video else None
-            }
-            
-            return jsonify(result)
-            
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def stream_transcript_segments(subscription, task_id, task):
+    """以NDJSON逐行输出转录片段：窗口完成即输出，任务结束时输出完整结果，超过SSE_MAX_DURATION后关闭"""
+    deadline = time.monotonic() + SSE_MAX_DURATION
+    try:
+        yield json.dumps({'type': 'task', 'task_id': task_id, 'status': task['status']}, ensure_ascii=False) + '\n'
+        # 运行中的片段不写入任务行，随每个窗口的推送累计下发，中途连接的客户端在下一个窗口完成时收到之前的片段；
+        # 窗口并行完成，片段不按时间顺序到达，最终结果会重新排序，按内容去重而不是按下标
+        sent = set()
+        while True:
+            for segment in task.get('segments') or []:
+                key = (segment['start'], segment['end'], segment['text'])
+                if key not in sent:
+                    sent.add(key)
+                    yield json.dumps(dict(segment, type='segment'), ensure_ascii=False) + '\n'
+            if task['status'] in FINISHED_TASK_STATUSES:
+                final = {key: task.get(key) for key in ('status', 'title', 'duration', 'language', 'text', 'model_used', 'error')}
+                yield json.dumps(dict(final, type='done', task_id=task_id), ensure_ascii=False) + '\n'
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # 客户端重新请求即可继续，已完成的片段会再次输出
+                yield json.dumps({'type': 'timeout', 'task_id': task_id, 'max_duration': SSE_MAX_DURATION}) + '\n'
+                return
+            pending = subscription.drain(min(SSE_HEARTBEAT_INTERVAL, remaining))
+            if task_id in pending:
+                task = pending[task_id]
+            else:
+                # 心跳行，防止代理因空闲断开连接
+                yield '\n'
     finally:
-        # 清理临时cookies文件
-        if cookies_data and cookies_data.get('cookies_text') and 'cookiefile' in ydl_opts:
-            try:
-                os.unlink(ydl_opts['cookiefile'])
-            except:
-                pass
+        task_events.unsubscribe(subscription)
+
+def transcript_stream_response(task_id):
+    if not stream_slots.try_acquire():
+        return stream_slots_full_response()
+    # 先订阅再读取当前状态，避免错过两者之间的更新
+    subscription = task_events.subscribe({task_id})
+    task = task_store.get(task_id)
+    if task is None:
+        task_events.unsubscribe(subscription)
+        stream_slots.release()
+        return jsonify({'error': '任务不存在'}), 404
+    response = Response(stream_transcript_segments(subscription, task_id, task), content_type='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
+    return hold_stream_slot(response)
 
 @app.route('/api/transcribe', methods=['GET', 'POST'])
 def transcribe_video():
-    """转录视频音频为文字 - 当前不可用"""
+    """把视频音频转录为文字：结果有缓存时直接返回，否则创建排队的转录任务"""
+    if request.method == 'GET':
+        data = request.args.to_dict()
+        cookies_data = None
+        if request.args.get('use_browser'):
+            cookies_data = {
+                'use_browser': True,
+                'browser': request.args.get('browser', 'chrome')
+            }
+    else:  # POST
+        data = request.get_json() or {}
+        cookies_data = data.get('cookies')
+    
+    url = data.get('url')
+    if not url:
+        return jsonify({'error': '缺少URL参数'}), 400
+    
+    backend = data.get('backend') or TRANSCRIBE_BACKEND
+    model = data.get('model') or TRANSCRIBE_DEFAULT_MODEL
+    language = data.get('language')
+    if language == 'auto':
+        language = None
+    stream = str(data.get('stream', '')).lower() in ('1', 'true', 'yes')
+    
+    if backend not in asr_backends.ASR_BACKENDS:
+        return jsonify({'error': f'不支持的转录后端: {backend}', 'backends': list(asr_backends.ASR_BACKENDS)}), 400
+    if backend != 'stub' and model not in TRANSCRIBE_MODELS:
+        return jsonify({'error': f'不支持的模型: {model}', 'models': list(TRANSCRIBE_MODELS)}), 400
+    if not asr_backends.ASR_BACKENDS[backend].available():
+        return jsonify({
+            'error': f'转录后端{backend}未安装，请安装对应依赖或设置TRANSCRIBE_BACKEND',
+            'message': 'Transcription backend is not installed'
+        }), 503
+    
+    cached = load_cached_transcript(url, model, language, backend)
+    if cached is not None:
+        return jsonify(dict(cached, status='completed', cached=True))
+    
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, {
+        'status': 'queued',
+        'url': url,
+        'type': 'transcribe',
+        'created_at': datetime.now().isoformat(),
+        'progress': {},
+        'error': None
+    })
+    
+    priority = get_task_priority('transcribe', url, cookies_data, data.get('priority'), 'bestaudio/best')
+    options = {'backend': backend, 'model': model, 'language': language}
+    try:
+        download_scheduler.submit(task_id, 'transcribe', (url, task_id, options, cookies_data), priority)
+    except DownloadQueueFull as e:
+        task_store.delete(task_id)
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    if stream:
+        return transcript_stream_response(task_id)
+    return jsonify({
+        'task_id': task_id,
+        'status': 'queued',
+        'queue_position': download_scheduler.queue_position(task_id),
+        'segments_url': f'/api/transcribe/{task_id}/segments',
+        'message': '转录任务已创建'
+    })
+
+@app.route('/api/transcribe/<task_id>/segments', methods=['GET'])
+def transcribe_segments(task_id):
+    """以NDJSON流式获取转录片段"""
+    return transcript_stream_response(task_id)
+
+@app.route('/api/upstream', methods=['GET'])
+def upstream_budgets():
+    """查看上游请求预算：每个(类型, 提取器, 出口)的当前速率、令牌、冷却时间和限流次数"""
     return jsonify({
-        'error': 'Whisper功能暂时不可用，为了减少部署镜像大小已移除此功能',
-        'message': 'Transcription feature is temporarily unavailable to reduce deployment image size'
-    }), 503
+        'buckets': upstream_governor.stats(),
+        'limits': {
+            'extract': {'rate': GOVERNOR_EXTRACT_RATE, 'burst': GOVERNOR_EXTRACT_BURST},
+            'media': {'rate': GOVERNOR_MEDIA_RATE, 'burst': GOVERNOR_MEDIA_BURST},
+            'decrease': GOVERNOR_DECREASE,
+            'increase': GOVERNOR_INCREASE,
+            'min_rate': GOVERNOR_MIN_RATE,
+            'cooldown': GOVERNOR_COOLDOWN,
+            'max_cooldown': GOVERNOR_MAX_COOLDOWN,
+            'max_wait': GOVERNOR_MAX_WAIT
+        }
+    })
+
+@app.route('/api/cookie-pool', methods=['GET'])
+def cookie_pool_status():
+    """查看cookies池：每个身份的健康分、隔离状态和提取统计"""
+    return jsonify(dict(cookie_pool.stats(), limits={
+        'min_health': COOKIE_MIN_HEALTH,
+        'quarantine': COOKIE_QUARANTINE,
+        'max_quarantine': COOKIE_MAX_QUARANTINE
+    }))
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -752,9 +4714,31 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'service': 'yt-dlp-api',
-        'version': '1.2.3'
+        'version': '1.2.3',
+        'extract_cache': extract_cache.stats(),
+        'extract_singleflight': extract_flights.stats(),
+        'download_queue': download_scheduler.stats(),
+        'download_store': download_store.stats(),
+        'ffmpeg': ffmpeg_limiter.stats(),
+        'download_connections': connection_budget.stats(),
+        'task_store': task_store.stats(),
+        'cookie_jars': cookie_jars.stats(),
+        'cookie_pool': {key: value for key, value in cookie_pool.stats().items() if key != 'pool'},
+        'ydl_pool': ydl_pool.stats(),
+        'playlist_cursors': playlist_cursors.stats(),
+        'task_events': dict(task_events.stats(), streams=stream_slots.stats())
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus格式的内部指标"""
+    values, gauges = metrics.snapshot()
+    if runner_metrics is not None:
+        # 生产模式：先推送本进程指标，再取任务进程汇总的全部进程指标
+        runner_metrics.publish(f'web-{os.getpid()}', values, gauges)
+        values, gauges = runner_metrics.snapshot(True)
+    return Response(metrics.render(values, gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/', methods=['GET'])
 def api_docs():
     """API文档"""
@@ -785,7 +4769,27 @@ def api_docs():
                         'POST': '在请求体中添加 cookies: {"cookies_text": "cookies内容"}'
                     }
                 }
-            }
+            },
+            'cookie_pool': f'未提供cookies的请求从cookies池（{COOKIE_POOL_DIR}目录中的Netscape格式*.txt文件）按最久未使用和健康分轮换身份，遇到机器人验证的身份自动隔离；提供cookies时不使用cookies池，状态见/api/cookie-pool'
+        },
+        'format_policy': {
+            'description': '链接类端点按声明式策略选择格式，无需先获取完整的/api/formats列表；高度、码率和协议是硬性条件，编码和封装是按顺序的偏好',
+            'parameters': {
+                'max_height': '最大高度（如720）',
+                'min_height': '最小高度',
+                'max_bitrate': '最大码率（kbps，如2000）',
+                'vcodec': f'视频编码偏好，逗号分隔（{"/".join(VIDEO_CODECS)}）',
+                'acodec': f'音频编码偏好，逗号分隔（{"/".join(AUDIO_CODECS)}）',
+                'ext': '封装偏好，逗号分隔（如mp4,m4a）',
+                'protocol': '允许的协议，逗号分隔（如https,m3u8_native）',
+                'progressive': 'true时只选可直接按字节范围播放的http(s)格式',
+                'strict': 'true时编码和封装偏好也作为硬性条件'
+            },
+            'ranking': '编码偏好 > 封装偏好 > 高度 > 帧率 > 码率'
+        },
+        'conditional_requests': {
+            'description': '/api/info、/api/formats和/api/tasks的响应带ETag，请求时携带If-None-Match且内容未变化时返回304',
+            'cache_control': f'视频元数据最多缓存{METADATA_MAX_AGE}秒且不超过链接有效期（携带cookies时为private）；任务列表为no-cache'
         },
         'endpoints': {
             '/api/info': {
@@ -796,90 +4800,229 @@ def api_docs():
                     'cookies': 'cookies配置（可选）',
                     'use_browser': '是否使用浏览器cookies (可选)',
                     'browser': '浏览器类型 (chrome/firefox/edge/safari，默认chrome)',
-                    'cookies_from_browser': '直接指定浏览器类型获取cookies (可选)'
+                    'cookies_from_browser': '直接指定浏览器类型获取cookies (可选)',
+                    'cache': '缓存模式（可选，bypass表示跳过缓存重新提取）',
+                    'fields': '只返回指定字段（可选，逗号分隔，点号表示嵌套，如title,formats.format_id,formats.url）；指定时返回全部格式，可选字段见INFO_FIELDS/FORMAT_FIELDS'
                 },
+                'example_fields': '/api/info?url=VIDEO_URL&fields=title,duration,formats.format_id,formats.height,formats.url',
                 'example_with_cookies': {
                     'GET': '/api/info?url=VIDEO_URL&use_browser=true&browser=chrome',
                     'POST': '{"url": "VIDEO_URL", "cookies": {"use_browser": true, "browser": "chrome"}}'
                 }
             },
+            '/api/info/batch': {
+                'method': 'POST',
+                'description': '并发获取多个视频的信息，按完成顺序以NDJSON（每行一个JSON）流式返回',
+                'body': {
+                    'urls': '视频URL列表（必需）',
+                    'concurrency': f'并发数（可选，默认{BATCH_DEFAULT_CONCURRENCY}，最大{BATCH_MAX_CONCURRENCY}）',
+                    'cookies': 'cookies配置（可选）',
+                    'cache': '缓存模式（可选，bypass表示跳过缓存重新提取）'
+                },
+                'response_line': '{"index": 序号, "url": URL, "info": 与/api/info相同的字段, "cache": 缓存状态} 或 {"index", "url", "error": 错误信息}；上游限流时错误行包含retry_after（秒）'
+            },
+            '/api/playlist': {
+                'methods': ['GET', 'POST'],
+                'description': '扁平提取播放列表/频道条目，按页返回（不解析每个视频）',
+                'parameters': {
+                    'url': '播放列表或频道URL（必需）',
+                    'cursor': f'起始位置（可选，默认0，下一页使用响应中的next_cursor；{PLAYLIST_CURSOR_TTL}秒内请求下一页时直接从上一页结束的位置继续读取）',
+                    'page_size': f'每页条目数（可选，默认{PLAYLIST_PAGE_SIZE}，最大{PLAYLIST_MAX_PAGE_SIZE}）',
+                    'stream': '为true时以NDJSON逐行流式返回从cursor开始的全部条目（可选）',
+                    'cookies': 'cookies配置（可选）'
+                }
+            },
             '/api/download': {
                 'method': 'POST',
                 'description': '开始下载视频',
                 'body': {
                     'url': '视频URL（必需）',
                     'format': '格式ID（可选，默认为best）',
-                    'cookies': 'cookies配置（可选）'
-                }
+                    'cookies': 'cookies配置（可选）',
+                    'priority': '队列优先级（可选，数值越小越先执行，默认音频0、视频1）',
+                    'connections': f'并行连接数（可选，默认{DOWNLOAD_CONNECTIONS}，1表示单连接；/api/audio相同）'
+                },
+                'segmented': f'单文件格式按{DOWNLOAD_SEGMENT_SIZE // (1024 * 1024)}MB分段通过多个连接Range下载并写入预先分配的文件，DASH/HLS分片按连接数并发下载；所有任务共用{DOWNLOAD_MAX_CONNECTIONS}个连接（DOWNLOAD_MAX_CONNECTIONS），不足2个时退回单连接；进度中包含connections、segments_done、segments_total和进行中的segments',
+                'queue': '任务进入有界下载队列，由固定数量的工作线程执行；队列已满时返回503',
+                'deduplication': '按提取器+视频ID+实际下载的格式（best等表达式先解析为格式ID）+后处理链去重：产物已存在时任务立即完成（deduplicated=true），正在下载时附着到进行中的任务（attached_to），不重复传输',
+                'storage': f'下载存储上限{DOWNLOAD_QUOTA_MB}MB（DOWNLOAD_QUOTA_MB），超过{int(DOWNLOAD_HIGH_WATERMARK * 100)}%时按最近访问时间淘汰已完成的产物至{int(DOWNLOAD_LOW_WATERMARK * 100)}%；下载中和排队中的产物不会被淘汰，淘汰后仍不足时返回503'
             },
             '/api/status/<task_id>': {
+                'methods': ['GET', 'DELETE'],
+                'description': '获取下载任务状态（排队中的任务返回queue_position，已完成的任务返回file_url，storage为下载存储占用情况）；DELETE取消排队中或正在进行的任务',
+                'status_values': ['queued', 'downloading', 'completed', 'error', 'cancelling', 'cancelled']
+            },
+            '/api/files/<task_id>': {
+                'method': 'GET',
+                'description': '下载已完成任务的文件（sendfile零拷贝发送）',
+                'parameters': {
+                    'disposition': 'attachment（默认，浏览器下载）或inline（浏览器内播放）'
+                },
+                'features': '支持Range/206断点续传、ETag/Last-Modified、If-None-Match/If-Modified-Since返回304、If-Range',
+                'errors': '任务不存在404，未完成409，文件已被清理410'
+            },
+            '/api/status/<task_id>/events': {
+                'method': 'GET',
+                'description': 'Server-Sent Events推送单个任务的状态和进度，任务结束后自动关闭，可替代轮询/api/status',
+                'event_format': 'event: task，data为任务状态JSON（含task_id）；连接超过最长时长时发送event: timeout后关闭',
+                'limits': f'每个工作进程最多{SSE_MAX_STREAMS}个推送连接（SSE_MAX_STREAMS，与转录流共用），超过时返回503和Retry-After；单个连接最长{SSE_MAX_DURATION}秒（SSE_MAX_DURATION）'
+            },
+            '/api/events': {
                 'method': 'GET',
-                'description': '获取下载任务状态'
+                'description': 'Server-Sent Events推送多个任务的状态和进度',
+                'parameters': {
+                    'task_ids': '逗号分隔的任务ID（可选，为空时推送所有任务的变化）'
+                },
+                'throttling': f'进度每{PROGRESS_MIN_INTERVAL}秒或每变化{PROGRESS_MIN_PERCENT}%最多推送一次',
+                'limits': '与/api/status/<task_id>/events相同'
             },
             '/api/tasks': {
                 'method': 'GET',
-                'description': '列出所有下载任务'
+                'description': '分页列出下载任务（按创建时间倒序）',
+                'parameters': {
+                    'limit': '每页数量（可选，默认50，最大500）',
+                    'offset': '偏移量（可选，默认0，下一页使用响应中的next_offset）',
+                    'status': '按状态过滤（可选）',
+                    'since': '只返回此时间之后创建的任务（可选，ISO时间或Unix时间戳）',
+                    'fields': '每个任务只返回指定字段（可选，如status,progress.percent）；默认不返回转录任务的segments和text，需要时在fields中指定'
+                },
+                'retention': '任务持久化在SQLite中，已结束任务在TASK_TTL秒后被清理'
             },
             '/api/formats': {
                 'methods': ['GET', 'POST'],
                 'description': '获取视频的所有可用格式',
                 'parameters': {
                     'url': '视频URL（必需）',
-                    'cookies': 'cookies配置（可选）'
+                    'cookies': 'cookies配置（可选）',
+                    'cache': '缓存模式（可选，bypass表示跳过缓存重新提取）',
+                    'fields': '只返回指定字段（可选，如formats.format_id,formats.tbr）'
                 }
             },
             '/api/audio': {
                 'method': 'POST',
-                'description': '仅下载音频',
+                'description': '仅下载音频；声明可接受的编码时优先只转换封装（复制音频流），没有匹配的格式才转码',
                 'body': {
                     'url': '视频URL（必需）',
-                    'cookies': 'cookies配置（可选）'
-                }
+                    'accept_codecs': f'可播放的音频编码，按偏好排序（可选，{"/".join(AUDIO_CODECS)}，*表示任意；不传时转码为mp3）',
+                    'cookies': 'cookies配置（可选）',
+                    'priority': '队列优先级（可选，数值越小越先执行）',
+                    'connections': '并行连接数（可选，见/api/download）'
+                },
+                'example': '{"url": "VIDEO_URL", "accept_codecs": ["opus", "aac"]}',
+                'response_audio': '{"mode": "remux"或"transcode", "codec": 输出编码, "format_id": 选中的格式}'
             },
             '/api/stream-links': {
                 'methods': ['GET', 'POST'],
                 'description': '获取视频的直接播放链接（不下载）',
                 'parameters': {
                     'url': '视频URL（必需）',
-                    'cookies': 'cookies配置（可选）'
+                    'cookies': 'cookies配置（可选）',
+                    'cache': '缓存模式（可选，bypass表示跳过缓存重新提取）',
+                    'max_height/vcodec/acodec/...': '格式选择策略（可选，见format_policy；/api/playable-links相同）'
                 },
+                'example_policy': '/api/stream-links?url=VIDEO_URL&max_height=720&vcodec=avc1&acodec=aac&max_bitrate=2000&progressive=true',
                 'example_with_cookies': {
                     'GET': '/api/stream-links?url=VIDEO_URL&use_browser=true&browser=chrome',
                     'POST': '{"url": "VIDEO_URL", "cookies": {"use_browser": true, "browser": "chrome"}}'
                 }
             },
+            '/api/stream/<video_id>': {
+                'method': 'GET',
+                'description': '代理传输视频内容，支持Range请求（206 Partial Content），可在播放器中拖动进度',
+                'parameters': {
+                    'format': '格式ID（可选，默认best）',
+                    'token': '/api/playable-links签发的播放令牌（可选）；有效时直接代理，令牌无效、过期或上游返回403时才重新提取',
+                    'max_height/vcodec/acodec/...': '格式选择策略（可选，见format_policy；给出时按策略选择格式）'
+                }
+            },
+            '/api/transcode/<video_id>': {
+                'method': 'GET',
+                'description': '实时转码：上游音频经ffmpeg管道直接以分块响应输出，不写入磁盘；上游已是目标编码时只转换封装',
+                'parameters': {
+                    'to': f'输出格式（可选，{"/".join(TRANSCODE_TARGETS)}，默认mp3）',
+                    'format': '上游格式ID或格式选择（可选，默认bestaudio/best）',
+                    'token': '/api/playable-links签发的播放令牌（可选）'
+                },
+                'response_headers': {
+                    'X-Transcode-Mode': 'copy（只转换封装）或transcode（重新编码）'
+                },
+                'limitations': '不支持Range请求；ffmpeg进程达到FFMPEG_MAX_PROCESSES上限时返回503'
+            },
             '/api/transcribe': {
                 'methods': ['GET', 'POST'],
-                'description': '将YouTube视频音频转换为文字（使用OpenAI Whisper）',
+                'description': '将视频音频转换为文字：创建排队的转录任务，音频按静音切分窗口后在进程池中并行识别；结果有缓存时直接返回',
                 'parameters': {
                     'url': '视频URL（必需）',
                     'language': '语言代码（可选，默认auto自动检测）',
-                    'model': 'Whisper模型大小（可选，tiny/base/small/medium/large，默认base）',
+                    'model': f'模型大小（可选，tiny/base/small/medium/large，默认{TRANSCRIBE_DEFAULT_MODEL}）',
+                    'backend': f'转录后端（可选，{"/".join(asr_backends.ASR_BACKENDS)}，默认{TRANSCRIBE_BACKEND}）',
+                    'stream': '是否直接返回NDJSON片段流（可选，true/false，默认false）',
+                    'priority': '任务优先级（可选）',
                     'cookies': 'cookies配置（可选）'
                 },
                 'limitations': {
-                    'max_duration': '30分钟（1800秒）',
-                    'recommended_model': 'base（平衡速度和准确性）'
+                    'max_duration': f'{TRANSCRIBE_MAX_DURATION}秒',
+                    'window': f'每个识别窗口约{TRANSCRIBE_WINDOW}秒，在静音处切分',
+                    'processes': f'{TRANSCRIBE_PROCESSES}个识别进程'
                 },
                 'example_with_cookies': {
                     'GET': '/api/transcribe?url=VIDEO_URL&language=zh&model=base&use_browser=true',
                     'POST': '{"url": "VIDEO_URL", "language": "zh", "model": "base", "cookies": {"use_browser": true}}'
                 },
                 'response_format': {
-                    'title': '视频标题',
-                    'duration': '视频时长（秒）',
-                    'language': '检测到的语言',
-                    'text': '完整转录文本',
-                    'segments': '分段转录结果（包含时间戳）',
-                    'model_used': '使用的Whisper模型',
-                    'processing_info': '处理状态信息'
+                    'task_id': '任务ID，通过/api/status/<task_id>查询进度和结果；运行中只返回windows_done/windows_total/segments_done等进度，text和segments在完成后返回',
+                    'segments_url': '片段流地址，运行中的片段通过它实时获取',
+                    'cached': '命中缓存时为true，并直接返回title/duration/language/text/segments/model_used/backend'
+                }
+            },
+            '/api/transcribe/<task_id>/segments': {
+                'method': 'GET',
+                'description': '以NDJSON流式获取转录片段，窗口识别完成即输出',
+                'response_line': '{"type": "task"} 开头，随后每行 {"type": "segment", "start", "end", "text"}，最后 {"type": "done", "status", "text", ...}；空行为心跳；超过SSE_MAX_DURATION时以 {"type": "timeout"} 结束，重新请求即可继续',
+                'limits': '与/api/status/<task_id>/events共用推送连接上限'
+            },
+            '/api/upstream': {
+                'method': 'GET',
+                'description': '查看上游请求预算（按提取/媒体请求、提取器和出口划分的令牌桶）；预算不足时接口返回503和Retry-After',
+                'response_format': {
+                    'buckets': '[{kind, extractor, egress, rate, base_rate, burst, tokens, cooldown_remaining, granted, rejected, throttled, last_throttled}]',
+                    'limits': '当前配置'
+                }
+            },
+            '/api/cookie-pool': {
+                'method': 'GET',
+                'description': '查看cookies池中每个身份的状态、健康分、隔离剩余时间、成功/被拦截次数和平均提取耗时（不返回cookies内容）',
+                'response_format': {
+                    'pool': '[{name, state, health, quarantine_remaining, uses, successes, bot_walls, errors, latency_ms, last_used, last_bot_wall}]',
+                    'anonymous': '所有身份都被隔离、不带cookies发出的请求数'
                 }
             },
             '/health': {
                 'method': 'GET',
                 'description': '健康检查'
+            },
+            '/metrics': {
+                'method': 'GET',
+                'description': 'Prometheus格式的内部指标（生产模式下汇总所有工作进程和任务进程）',
+                'metrics': {
+                    'ytdlp_api_http_request_duration_seconds': '各接口处理耗时直方图',
+                    'ytdlp_api_extract_info_duration_seconds': 'extract_info耗时，按extractor和outcome（ok/bot_wall/error）区分',
+                    'ytdlp_api_downloads': '执行中（active）和排队中（queued）的下载任务数',
+                    'ytdlp_api_stream_bytes_total': '/api/stream转发的字节数，按source（token/extract）区分',
+                    'ytdlp_api_stream_throughput_bytes_per_second': '单次代理的平均吞吐',
+                    'ytdlp_api_cookie_files': '存活的临时cookies文件数量',
+                    'ytdlp_api_postprocessor_duration_seconds': 'ffmpeg等后处理器耗时'
+                }
             }
         },
+        'extract_cache': {
+            'description': '/api/info、/api/formats、/api/stream-links、/api/playable-links共享同一份提取结果缓存',
+            'key': '提取器 + 规范视频ID + cookies身份指纹',
+            'ttl': '由格式链接中的expire参数决定，链接过期前自动失效',
+            'coalescing': '同一视频的并发提取请求会合并为一次extract_info，共享结果或错误',
+            'response_header': 'X-Cache: HIT/MISS/BYPASS/COALESCED',
+            'stats': '/health 中的 extract_cache 与 extract_singleflight 字段'
+        },
         'troubleshooting': {
             'bot_detection': {
                 'error': 'Sign in to confirm you\'re not a bot',
@@ -889,6 +5032,79 @@ def api_docs():
     }
     return jsonify(docs)
 
+# 生产模式HTTP服务配置
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 120))
+WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+WEB_KEEPALIVE = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+def start_task_runner():
+    """启动独立的任务进程，返回(进程, 地址, 认证密钥)"""
+    address = os.path.join(tempfile.gettempdir(), f'yt-dlp-api-tasks-{os.getpid()}.sock')
+    authkey = os.urandom(16).hex()
+    env = dict(os.environ, TASK_RUNNER_LISTEN=address, TASK_RUNNER_AUTHKEY=authkey)
+    env.pop('TASK_RUNNER_ADDRESS', None)
+    # 通过PYTHONPATH找到模块，不改变工作目录：任务数据库、下载目录等相对路径与HTTP工作进程解析到同一位置
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (module_dir, os.environ.get('PYTHONPATH'))))
+    # 以模块方式导入，保证任务进程与HTTP工作进程中的类名一致，可以互相传递异常等对象
+    runner = subprocess.Popen(
+        [sys.executable, '-c', 'import yt_dlp_api; yt_dlp_api.run_task_runner()'],
+        env=env
+    )
+    for _ in range(300):
+        if os.path.exists(address):
+            break
+        if runner.poll() is not None:
+            raise RuntimeError('任务进程启动失败')
+        time.sleep(0.1)
+    return runner, address, authkey
+
+def serve(port):
+    """生产模式入口：独立的任务进程 + gunicorn多进程多线程HTTP服务"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("⚠️ 未安装gunicorn，使用单进程多线程模式运行")
+        app.run(host='0.0.0.0', port=port, threaded=True)
+        return
+    
+    # 未配置签名密钥时在这里生成一次，任务进程和所有HTTP工作进程通过环境变量使用同一个密钥，
+    # 否则每个工作进程各自生成随机密钥，其他进程签发的播放令牌会校验失败
+    os.environ.setdefault('STREAM_TOKEN_SECRET', os.urandom(32).hex())
+    runner, address, authkey = start_task_runner()
+    os.environ['TASK_RUNNER_ADDRESS'] = address
+    os.environ['TASK_RUNNER_AUTHKEY'] = authkey
+    
+    class ProductionApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'0.0.0.0:{port}')
+            self.cfg.set('workers', WEB_CONCURRENCY)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', WEB_THREADS)
+            self.cfg.set('timeout', WEB_TIMEOUT)
+            self.cfg.set('graceful_timeout', WEB_GRACEFUL_TIMEOUT)
+            self.cfg.set('keepalive', WEB_KEEPALIVE)
+        
+        def load(self):
+            # 在每个工作进程中重新导入模块，工作进程会连接到任务进程
+            return importlib.import_module('yt_dlp_api').app
+    
+    try:
+        ProductionApplication().run()
+    finally:
+        # HTTP服务退出后再让任务进程等待进行中的下载完成
+        runner.terminate()
+        try:
+            runner.wait(DOWNLOAD_DRAIN_TIMEOUT + 10)
+        except subprocess.TimeoutExpired:
+            runner.kill()
+        try:
+            os.unlink(address)
+        except OSError:
+            pass
+
 if __name__ == '__main__':
     # 从环境变量获取端口，默认为5000
     port = int(os.environ.get('PORT', 5000))
@@ -899,4 +5115,8 @@ if __name__ == '__main__':
     print(f"🏥 健康检查: http://localhost:{port}/health")
     print(f"🎵 示例: curl \"http://localhost:{port}/api/info?url=https://www.youtube.com/watch?v=dQw4w9WgXcQ\"")
     
-    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
+    if debug:
+        app.run(host='0.0.0.0', port=port, debug=debug)
+    else:
+        print(f"⚙️ 生产模式: {WEB_CONCURRENCY}个工作进程 × {WEB_THREADS}个线程")
+        serve(port)